@@ -0,0 +1,65 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Compare the time to build the key of a memoized call with the previous
+    implementation, which zipped the arguments with the names of the
+    arguments on every call, and with :class:`~nereid.cachekeys.KeyBuilder`::
+
+        python benchmarks/keys.py
+"""
+import inspect
+import timeit
+from hashlib import md5
+
+from nereid.cachekeys import KeyBuilder
+
+#: The number of keys of a timing
+COUNT = 100000
+
+
+def price(product, quantity=1, currency=None):
+    pass
+
+
+def getargspec_key(args, kwargs):
+    "The previous implementation, as it was before it cached the names"
+    names = inspect.getargspec(price)[0]
+    kwargs = dict(kwargs)
+    kwargs.update(dict(zip(names, args)))
+    kwargs = sorted(kwargs.items())
+    return md5('price' + repr(kwargs)).hexdigest()
+
+
+ARG_NAMES = inspect.getargspec(price)[0]
+
+
+def previous_key(args, kwargs):
+    "The previous implementation"
+    kwargs = dict(kwargs)
+    kwargs.update(dict(zip(ARG_NAMES, args)))
+    kwargs = sorted(kwargs.items())
+    return md5('price' + repr(kwargs)).hexdigest()
+
+
+def main():
+    builders = [
+        ('getargspec on every call', getargspec_key),
+        ('previous', previous_key),
+        ('KeyBuilder', KeyBuilder('price', price)),
+    ]
+    calls = [
+        ('positional', (42, 3, 'EUR'), {}),
+        ('kwargs', (42, ), {'currency': u'EUR'}),
+    ]
+    for name, builder in builders:
+        for label, args, kwargs in calls:
+            seconds = min(timeit.repeat(
+                lambda: builder(args, kwargs), number=COUNT, repeat=7
+            ))
+            print '%-26s %-10s %.2f us' % (
+                name, label, seconds / COUNT * 1e6
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Measure the number of passwords the registered hashers verify per
+    second, alone and through a :class:`~nereid.passwords.VerificationPool`
+    of 2 threads called from 4 threads::
+
+        python benchmarks/passwords.py
+"""
+import time
+import threading
+
+from nereid.passwords import get_hasher, hashers, VerificationPool, _verify
+
+#: The number of verifications of the strong hashers
+COUNT = 20
+
+#: The number of threads calling the pool
+CALLERS = 4
+
+
+def sequential(hasher, encoded, count):
+    start = time.time()
+    for i in xrange(count):
+        hasher.verify('password', encoded)
+    return count / (time.time() - start)
+
+
+def pooled(encoded, count):
+    pool = VerificationPool(2)
+    pool.get_pool()
+
+    def call():
+        for i in xrange(count / CALLERS):
+            pool.apply(_verify, ('password', encoded))
+
+    threads = [threading.Thread(target=call) for i in xrange(CALLERS)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return count / (time.time() - start)
+
+
+def main():
+    for name in sorted(hashers):
+        hasher = get_hasher(name)
+        encoded = hasher.encode('password')
+        # The weak hashers are too fast to be timed with a few calls
+        count = COUNT * (200 if name == 'sha1' else 1)
+        print '%-14s %10.1f logins/s   pool %10.1f logins/s' % (
+            name,
+            sequential(hasher, encoded, count),
+            pooled(encoded, count),
+        )
+
+
+if __name__ == '__main__':
+    main()
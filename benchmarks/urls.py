@@ -0,0 +1,66 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Compare the time to build a URL with the map and rules of werkzeug and
+    with those of nereid, which remember the rule which built the URLs of
+    an endpoint::
+
+        python benchmarks/urls.py
+"""
+import timeit
+
+from werkzeug import routing
+from werkzeug.routing import Submount
+from nereid.routing import Map, Rule
+
+#: The number of builds of a timing
+COUNT = 100000
+
+
+def get_rules(Rule):
+    """
+    120 rules of other endpoints and the 3 rules of the built endpoint
+    under the submount of the locale
+    """
+    rules = []
+    for i in xrange(60):
+        rules.append(Rule('/e%d/<int:id>' % i, endpoint='e%d' % i))
+        rules.append(Rule('/e%d/<int:id>/<slug>' % i, endpoint='e%d' % i))
+    rules.extend([
+        Rule('/product/<uri>', endpoint='product.render'),
+        Rule('/product/<uri>/<int:page>', endpoint='product.render'),
+        Rule('/product/<uri>/<int:page>/<int:x>', endpoint='product.render'),
+    ])
+    return [Submount('/<locale>', rules)]
+
+
+def timing(function):
+    return min(timeit.repeat(function, number=COUNT, repeat=7)) / COUNT
+
+
+def main():
+    adapters = [
+        ('werkzeug', routing.Map(get_rules(routing.Rule)).bind('localhost')),
+        ('nereid', Map(get_rules(Rule)).bind('localhost')),
+    ]
+    values = {'uri': 'some-product', 'locale': 'en_US'}
+    assert len(set(
+        adapter.build('product.render', values) for name, adapter in adapters
+    )) == 1
+
+    for name, adapter in adapters:
+        print '%-9s build %6.2f us   _partial_build %6.2f us' % (
+            name,
+            timing(
+                lambda: adapter.build('product.render', values)
+            ) * 1e6,
+            timing(
+                lambda: adapter._partial_build(
+                    'product.render', values, None, True
+                )
+            ) * 1e6,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,11 @@ from flask.globals import current_app, g, request, \
 from flask.templating import render_template_string
 from flask.json import jsonify
 
-from .helpers import flash, get_flashed_messages, url_for, \
+from .helpers import flash, get_flashed_messages, url_for, url_for_many, \
     login_required, permissions_required, route, get_version, \
     context_processor, template_filter
 from .application import Nereid, Request, Response
 from .sessions import Session
 from .globals import cache, current_user
 from .templating import render_template, render_email, LazyRenderer
+from .memo import request_memoize
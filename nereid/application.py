@@ -6,27 +6,27 @@ from __future__ import with_statement
 import os  # noqa
 import warnings
 import inspect
+from time import time
 
 from flask import Flask
 from flask.config import ConfigAttribute
-from flask.globals import _request_ctx_stack, current_app
+from flask.globals import _request_ctx_stack, current_app, session
+from flask.ctx import has_request_context
 from flask.helpers import locked_cached_property
 from jinja2 import MemcachedBytecodeCache
 from werkzeug import import_string, abort
 import flask.ext.login
-from flask.ext.login import LoginManager
 from flask.ext.babel import Babel
 
 from trytond import backend
 from trytond.pool import Pool
-from trytond.cache import Cache
 from trytond.config import config
 from trytond.exceptions import UserError
 from trytond.modules import register_classes
 from trytond.transaction import Transaction
 
 from .wrappers import Request, Response
-from .session import NereidSessionInterface
+from .sessions import NereidSessionInterface, SQLiteSessionStore
 from .templating import nereid_default_template_ctx_processor, \
     NEREID_TEMPLATE_FILTERS, ModuleTemplateLoader, LazyRenderer
 from .helpers import url_for, root_transaction_if_required
@@ -34,6 +34,12 @@ from .ctx import RequestContext
 from .csrf import NereidCsrfProtect
 from .signals import transaction_start, transaction_stop
 from .routing import Rule
+from .dbpool import ConnectionPool, DatabasePools, get_dsn
+from .pagecache import PageCache
+from .cachetags import CacheTags, get_tag
+from .passwords import VerificationPool
+from .throttle import LoginThrottle
+from .login import NereidLoginManager
 
 
 class Nereid(Flask):
@@ -63,6 +69,10 @@ class Nereid(Flask):
     #: .. versionadded:: 3.2.0.9
     url_rule_class = Rule
 
+    #: The class of the page cache of the application. See
+    #: :class:`~nereid.pagecache.PageCache`.
+    page_cache_class = PageCache
+
     #: the session interface to use.  By default an instance of
     #: :class:`~nereid.session.NereidSessionInterface` is used here.
     session_interface = NereidSessionInterface()
@@ -117,8 +127,28 @@ class Nereid(Flask):
     #:  MemcachedCache - werkzeug.contrib.cache.MemcachedCache
     #:  GAEMemcachedCache -  werkzeug.contrib.cache.GAEMemcachedCache
     #:  FileSystemCache - werkzeug.contrib.cache.FileSystemCache
+    #:  TwoTierCache - nereid.contrib.cache.TwoTierCache
     cache_type = ConfigAttribute('CACHE_TYPE')
 
+    #: The type of the shared cache behind the local tier of the
+    #: :class:`~nereid.contrib.cache.TwoTierCache`. It is configured like
+    #: the `CACHE_TYPE`. Defaults to the MemcachedCache.
+    cache_shared_type = ConfigAttribute('CACHE_SHARED_TYPE')
+
+    #: The maximum number of values of the local tier of the
+    #: :class:`~nereid.contrib.cache.TwoTierCache`
+    cache_local_threshold = ConfigAttribute('CACHE_LOCAL_THRESHOLD')
+
+    #: The number of seconds the values are kept in the local tier of the
+    #: :class:`~nereid.contrib.cache.TwoTierCache`. This bounds how long a
+    #: worker may read a value changed by another worker.
+    cache_local_timeout = ConfigAttribute('CACHE_LOCAL_TIMEOUT')
+
+    #: The directory of the local channel on which the workers publish the
+    #: keys they change, so that the others drop them from their local
+    #: tier. Not used if None (the default).
+    cache_local_channel = ConfigAttribute('CACHE_LOCAL_CHANNEL')
+
     #: If a custom cache backend unknown to Nereid is used, then
     #: the arguments that are needed for the initialisation
     #: of the cache could be passed here as a `dict`
@@ -129,6 +159,11 @@ class Nereid(Flask):
     #: in debugging issues that may be hard to debug with lazy rendering
     eager_template_render = ConfigAttribute('EAGER_TEMPLATE_RENDER')
 
+    #: The version of the URL rules of the application. It is incremented
+    #: when the rules are collected again from a new pool or when a rule
+    #: is added to the application.
+    url_rules_version = 0
+
     #: boolean attribute to indicate if the initialisation of backend
     #: connection and other nereid support features are loaded. The
     #: application can work only after the initialisation is done.
@@ -153,27 +188,262 @@ class Nereid(Flask):
         'TOKEN_VALIDITY_DURATION'
     )
 
+    #: Time in seconds for which the verified tokens and Basic credentials
+    #: of the users are remembered by each worker. The credentials are
+    #: verified on every request if set to 0.
+    credentials_cache_timeout = ConfigAttribute('CREDENTIALS_CACHE_TIMEOUT')
+
+    #: The name of the hasher of the new passwords. The passwords hashed by
+    #: another hasher are hashed again when the users log in. See
+    #: :mod:`nereid.passwords`.
+    password_hasher = ConfigAttribute('PASSWORD_HASHER')
+
+    #: The number of threads, or processes, which verify the passwords. The
+    #: passwords are verified by the thread of the request if set to 0.
+    password_pool_size = ConfigAttribute('PASSWORD_POOL_SIZE')
+
+    #: `thread` or `process`
+    password_pool_type = ConfigAttribute('PASSWORD_POOL_TYPE')
+
+    #: The length in seconds of the sliding window over which the failed
+    #: logins are counted. See :mod:`nereid.throttle`.
+    login_throttle_window = ConfigAttribute('LOGIN_THROTTLE_WINDOW')
+
+    #: The number of failed logins from an IP address, and with an email,
+    #: in the window after which the logins are rejected. The logins are
+    #: not throttled if both are 0. The limit per IP address is 0 by
+    #: default, as all the logins have the address of the proxy behind a
+    #: reverse proxy unless the application is wrapped with the
+    #: :class:`~werkzeug.contrib.fixers.ProxyFix` of a trusted proxy.
+    login_throttle_ip_limit = ConfigAttribute('LOGIN_THROTTLE_IP_LIMIT')
+    login_throttle_email_limit = ConfigAttribute('LOGIN_THROTTLE_EMAIL_LIMIT')
+
+    #: Time in seconds for which the emails of no user are remembered
+    login_unknown_email_timeout = ConfigAttribute(
+        'LOGIN_UNKNOWN_EMAIL_TIMEOUT'
+    )
+
+    #: The store of the sessions, `cache` to keep them in the cache of the
+    #: application or `sqlite` to keep them in the SQLite database of
+    #: `SESSION_SQLITE_PATH`. See :mod:`nereid.sessions`.
+    session_store_type = ConfigAttribute('SESSION_STORE')
+    session_sqlite_path = ConfigAttribute('SESSION_SQLITE_PATH')
+
+    #: The time in seconds after which the unused sessions expire
+    session_timeout = ConfigAttribute('SESSION_TIMEOUT')
+
+    #: The interval in seconds at which the expiry of the sessions whose
+    #: data did not change is refreshed
+    session_touch_interval = ConfigAttribute('SESSION_TOUCH_INTERVAL')
+
+    #: The name of the serializer of the data of the sessions, `marshal`,
+    #: `pickle` or `msgpack` if it is installed
+    session_serializer = ConfigAttribute('SESSION_SERIALIZER')
+
+    #: The length in bytes of the longest signed cookie in which a session
+    #: is kept instead of the store of the sessions. The sessions are always
+    #: kept in the store if set to 0.
+    session_cookie_max_size = ConfigAttribute('SESSION_COOKIE_MAX_SIZE')
+
+    #: Resolve the website, locale and context in the same transaction
+    #: which runs the view, instead of separate transactions before it.
+    #: The transaction is opened by the request context and is also used
+    #: to create the URL adapter. Set to False by default.
+    single_transaction_dispatch = ConfigAttribute(
+        'SINGLE_TRANSACTION_DISPATCH'
+    )
+
+    #: The strategy used to synchronise the Tryton caches of the worker
+    #: with the invalidations made by other workers. The type must be a
+    #: full specification of the class so that an import can be made.
+    #:
+    #:  nereid.invalidation.CacheSync - On every request (default)
+    #:  nereid.invalidation.ThrottledCacheSync - At most once every interval
+    #:  nereid.invalidation.ThreadedCacheSync - From a background thread
+    #:  nereid.invalidation.PubSubCacheSync - When other workers announce
+    #:      invalidations on a local channel
+    cache_sync_type = ConfigAttribute('CACHE_SYNC_TYPE')
+
+    #: The interval in milliseconds used by the cache sync strategy. This
+    #: bounds the staleness of the caches of a worker. The default interval
+    #: of the strategy is used when it is not set (1 second, and 1 minute
+    #: for the :class:`~nereid.invalidation.PubSubCacheSync`).
+    cache_sync_interval = ConfigAttribute('CACHE_SYNC_INTERVAL')
+
+    #: Additional arguments for the initialisation of the cache sync
+    #: strategy as a `dict`. For example the `channel` of the
+    #: :class:`~nereid.invalidation.PubSubCacheSync`.
+    cache_sync_init_kwargs = ConfigAttribute('CACHE_SYNC_INIT_KWARGS')
+
+    #: The maximum number of connections of the connection pool of the
+    #: application (see :mod:`nereid.dbpool`). The pool of the tryton backend
+    #: is used when it is not set (the default). Only the postgresql backend
+    #: is supported. A request holds a single connection at a time, also
+    #: when the caches are synchronised (see :meth:`synchronise_caches`), so
+    #: the size must be at least the number of threads of the worker, plus
+    #: one for the thread of a threaded :attr:`cache_sync_type`.
+    database_pool_size = ConfigAttribute('DATABASE_POOL_SIZE')
+
+    #: Additional arguments of the :class:`~nereid.dbpool.ConnectionPool`
+    #: as a `dict`, like `min_size` (the connections opened on
+    #: initialisation), `timeout` and `health_check_interval`.
+    database_pool_init_kwargs = ConfigAttribute('DATABASE_POOL_INIT_KWARGS')
+
+    #: The readonly transactions take their connections from a separate
+    #: pool of this size. Defaults to the size of the pool.
+    database_readonly_pool_size = ConfigAttribute(
+        'DATABASE_READONLY_POOL_SIZE'
+    )
+
+    #: The URI of the server of the readonly pool, like a read replica. The
+    #: URI of the database section of the tryton configuration is used when
+    #: it is not set.
+    database_readonly_uri = ConfigAttribute('DATABASE_READONLY_URI')
+
+    #: The name or the list of names of the databases on which the readonly
+    #: transactions run, like the replicas of the database. The databases
+    #: are used in turn, with a pool for each on the server of
+    #: `DATABASE_READONLY_URI`. The models and the caches remain those of
+    #: the database of the application, only the connections differ. The
+    #: readonly transactions use the pool of the database when it is not
+    #: set. Use the name of the database of the application for a replica
+    #: of it on another server.
+    database_readonly_name = ConfigAttribute('DATABASE_READONLY_NAME')
+
+    #: The number of seconds after a write in a session during which the
+    #: readonly transactions of the session run on the database of the
+    #: application, so that users read their own writes. Defaults to 5.
+    database_readonly_sticky_duration = ConfigAttribute(
+        'DATABASE_READONLY_STICKY_DURATION'
+    )
+
+    #: Cache the pages of the routes with a `cache_timeout` for anonymous
+    #: visitors in the cache of the application (see
+    #: :mod:`nereid.pagecache`). Set to False by default.
+    page_cache_enabled = ConfigAttribute('PAGE_CACHE_ENABLED')
+
+    #: The number of seconds during which an expired page is still served
+    #: while a single request renders it again. Defaults to 30.
+    page_cache_stale_timeout = ConfigAttribute('PAGE_CACHE_STALE_TIMEOUT')
+
+    #: The names of the request headers the cached pages vary on, like
+    #: `Accept-Language`. They are also added to the `Vary` header of the
+    #: responses.
+    page_cache_vary_headers = ConfigAttribute('PAGE_CACHE_VARY_HEADERS')
+
+    #: The response header which tells if a page was served from the cache
+    #: (`HIT`), served expired (`STALE`) or rendered (`MISS`). Set to None
+    #: to not add the header.
+    page_cache_header = ConfigAttribute('PAGE_CACHE_HEADER')
+
+    #: The number of seconds the versions of the cache tags are kept (see
+    #: :mod:`nereid.cachetags`). The entries tagged with a tag whose version
+    #: expired are discarded, so this should be longer than the timeouts of
+    #: the tagged entries. Defaults to a week.
+    cache_tag_timeout = ConfigAttribute('CACHE_TAG_TIMEOUT')
+
+    #: The number of seconds during which an expired fragment of the
+    #: `{% cache %}` tag is still served while a single worker renders it
+    #: again. Defaults to 30.
+    fragment_cache_stale_timeout = ConfigAttribute(
+        'FRAGMENT_CACHE_STALE_TIMEOUT'
+    )
+
+    #: The maximum number of seconds a worker renders a fragment of the
+    #: `{% cache %}` tag alone. The other workers wait for the fragment as
+    #: long if there is no expired fragment to serve. Set to 0 to let every
+    #: worker render the missing fragments. Defaults to 5.
+    fragment_cache_lock_timeout = ConfigAttribute(
+        'FRAGMENT_CACHE_LOCK_TIMEOUT'
+    )
+
     def __init__(self, **config):
         """
         The import_name is forced into `Nereid`
         """
         super(Nereid, self).__init__('nereid', **config)
 
+        #: The worker local registry of the URL maps of the websites. See
+        #: :meth:`get_url_map`
+        self.url_maps = {}
+
+        #: The number of URL maps built, and the total and last time taken
+        #: in seconds to build them.
+        self.url_map_stats = {
+            'builds': 0, 'build_time': 0.0, 'last_build_time': None,
+        }
+
         # Update the defaults for config attributes introduced by nereid
         self.config.update({
             'TRYTON_CONFIG': None,
             'TEMPLATE_PREFIX_WEBSITE_NAME': True,
             'TOKEN_VALIDITY_DURATION': 60 * 60,
+            'CREDENTIALS_CACHE_TIMEOUT': 60,
+            'PASSWORD_HASHER': 'pbkdf2_sha256',
+            'PASSWORD_POOL_SIZE': 2,
+            'PASSWORD_POOL_TYPE': 'thread',
+            'LOGIN_THROTTLE_WINDOW': 5 * 60,
+            'LOGIN_THROTTLE_IP_LIMIT': 0,
+            'LOGIN_THROTTLE_EMAIL_LIMIT': 10,
+            'LOGIN_UNKNOWN_EMAIL_TIMEOUT': 60,
+            'SESSION_STORE': 'cache',
+            'SESSION_SQLITE_PATH': None,
+            'SESSION_TIMEOUT': 30 * 24 * 60 * 60,
+            'SESSION_TOUCH_INTERVAL': 24 * 60 * 60,
+            'SESSION_SERIALIZER': 'marshal',
+            'SESSION_COOKIE_MAX_SIZE': 0,
 
             'CACHE_TYPE': 'werkzeug.contrib.cache.NullCache',
             'CACHE_DEFAULT_TIMEOUT': 300,
             'CACHE_THRESHOLD': 500,
             'CACHE_INIT_KWARGS': {},
             'CACHE_KEY_PREFIX': '',
+            'CACHE_SHARED_TYPE': 'werkzeug.contrib.cache.MemcachedCache',
+            'CACHE_LOCAL_THRESHOLD': 1000,
+            'CACHE_LOCAL_TIMEOUT': 5,
+            'CACHE_LOCAL_CHANNEL': None,
 
             'EAGER_TEMPLATE_RENDER': False,
+            'SINGLE_TRANSACTION_DISPATCH': False,
+
+            'CACHE_SYNC_TYPE': 'nereid.invalidation.CacheSync',
+            'CACHE_SYNC_INTERVAL': None,
+            'CACHE_SYNC_INIT_KWARGS': {},
+
+            'DATABASE_POOL_SIZE': None,
+            'DATABASE_POOL_INIT_KWARGS': {},
+            'DATABASE_READONLY_POOL_SIZE': None,
+            'DATABASE_READONLY_URI': None,
+            'DATABASE_READONLY_NAME': None,
+            'DATABASE_READONLY_STICKY_DURATION': 5,
+
+            'PAGE_CACHE_ENABLED': False,
+            'PAGE_CACHE_STALE_TIMEOUT': 30,
+            'PAGE_CACHE_VARY_HEADERS': [],
+            'PAGE_CACHE_HEADER': 'X-Page-Cache',
+
+            'CACHE_TAG_TIMEOUT': 7 * 24 * 60 * 60,
+            'FRAGMENT_CACHE_STALE_TIMEOUT': 30,
+            'FRAGMENT_CACHE_LOCK_TIMEOUT': 5,
         })
 
+        #: The connection pools of the application, if any. See
+        #: :meth:`load_database_pools`
+        self.database_pools = None
+
+        #: The page cache of the application
+        self.page_cache = self.page_cache_class(self)
+
+        #: The versions of the tags of the cached pages and fragments
+        self.cache_tags = CacheTags(self)
+
+        #: The pool which verifies the passwords, if any. See
+        #: :meth:`load_password_pool`
+        self.password_pool = None
+
+        #: The throttle of the logins
+        self.login_throttle = LoginThrottle(self)
+
     def initialise(self):
         """
         The application needs initialisation to load the database
@@ -188,6 +458,9 @@ class Nereid(Flask):
         #: Load the cache
         self.load_cache()
 
+        #: Load the store of the sessions
+        self.load_session_store()
+
         #: Initialise the CSRF handling
         self.csrf_protection = NereidCsrfProtect()
         self.csrf_protection.init_app(self)
@@ -196,9 +469,16 @@ class Nereid(Flask):
 
         # Backend initialisation
         self.load_backend()
+        self.load_database_pools()
+
+        #: Load the strategy to synchronise the tryton caches
+        self.load_cache_sync()
+
+        #: Load the pool which verifies the passwords
+        self.load_password_pool()
 
         #: Initialise the login handler
-        login_manager = LoginManager()
+        login_manager = NereidLoginManager()
         login_manager.user_loader(self._pool.get('nereid.user').load_user)
         login_manager.header_loader(
             self._pool.get('nereid.user').load_user_from_header
@@ -235,64 +515,176 @@ class Nereid(Flask):
         # Initialize Babel
         Babel(self)
 
+        # Build the URL maps of the websites before the first request
+        self.build_url_maps()
+
         # Finally set the initialised attribute
         self.initialised = True
 
-    def get_urls(self):
+    def add_url_rule(self, *args, **kwargs):
         """
-        Return the URL rules for routes formed by decorating methods with the
-        :func:`~nereid.helpers.route` decorator.
+        Adds a rule to the application URL map and invalidates the URL maps
+        of the websites, which include the rules of the application.
+        """
+        super(Nereid, self).add_url_rule(*args, **kwargs)
+        self.url_rules_version += 1
 
-        This method goes through all the models and their methods in the pool
-        of the loaded database and looks for the `_url_rules` attribute in
-        them. If there are URLs defined, it is added to the url map.
+    def get_url_rules(self):
+        """
+        Returns the URL rules returned by :meth:`get_urls`. The rules are
+        collected only once for a pool and are not bound to any map. Use
+        :meth:`werkzeug.routing.Rule.empty` to get a copy which could be
+        added to a map.
         """
-        rules = []
         models = Pool._pool[self.database_name]['model']
+        if getattr(self, '_url_rules_models', None) is not models:
+            self._url_rules = self.get_urls()
+            self._url_rules_models = models
+            self.url_rules_version += 1
+        return self._url_rules
 
-        for model_name, model in models.iteritems():
-            for f_name, f in inspect.getmembers(
-                    model, predicate=inspect.ismethod):
+    def get_url_map(self, key, builder):
+        """
+        Returns the URL map registered for the key in the worker local
+        registry of URL maps. If there is no map for the key and the current
+        version of the URL rules, one is built by calling `builder` with the
+        application as the argument.
+
+        :param key: A tuple whose first item is the id of the website and
+                    which identifies everything else that the map built
+                    depends on, except the URL rules.
+        :param builder: A callable which returns a new URL map
+        """
+        self.get_url_rules()
+        key = key + (self.url_rules_version, )
+
+        url_map = self.url_maps.get(key)
+        if url_map is not None:
+            return url_map
+
+        start = time()
+        url_map = builder(self)
+        url_map.update()
+        build_time = time() - start
+
+        # Forget the maps this one replaces
+        for old_key in self.url_maps.keys():
+            if old_key[0] == key[0] or old_key[-1] != key[-1]:
+                self.url_maps.pop(old_key, None)
+        self.url_maps[key] = url_map
+
+        self.url_map_stats['builds'] += 1
+        self.url_map_stats['build_time'] += build_time
+        self.url_map_stats['last_build_time'] = build_time
+        return url_map
+
+    @root_transaction_if_required
+    def build_url_maps(self):
+        """
+        Build the URL maps of all the websites
+        """
+        Website = Pool().get('nereid.website')
+        for website in Website.search([]):
+            website.get_url_adapter(self)
+
+    def get_model_methods(self, kind):
+        """
+        Returns a list of `(model_name, method_name, method)` tuples for the
+        methods of the models in the pool which are marked with the `kind`
+        attribute by a nereid decorator. The kinds are:
+
+            * `_url_rules` - :func:`~nereid.helpers.route`
+            * `_context_processor` - :func:`~nereid.helpers.context_processor`
+            * `_template_filter` - :func:`~nereid.helpers.template_filter`
+
+        The methods of all kinds are collected in a single pass over the
+        models the first time this is called for a pool.
+        """
+        models = Pool._pool[self.database_name]['model']
+        if getattr(self, '_model_methods_pool', None) is not models:
+            self._model_methods = self._collect_model_methods(models)
+            self._model_methods_pool = models
+        return self._model_methods.get(kind, [])
+
+    def _collect_model_methods(self, models):
+        """
+        Returns a dictionary of the decorated methods of the models by kind.
+        See :meth:`get_model_methods`
+        """
+        kinds = ('_url_rules', '_context_processor', '_template_filter')
+        rv = dict((kind, []) for kind in kinds)
+
+        # The names of the decorated functions defined in each class. The
+        # models share most of their classes, so each is looked at once.
+        decorated_names = {}
+
+        def get_decorated_names(klass):
+            if klass not in decorated_names:
+                decorated_names[klass] = [
+                    name for name, value in vars(klass).iteritems()
+                    if any(
+                        hasattr(getattr(value, '__func__', value), kind)
+                        for kind in kinds
+                    )
+                ]
+            return decorated_names[klass]
 
-                if not hasattr(f, '_url_rules'):
+        for model_name, model in models.iteritems():
+            names = set()
+            for klass in model.__mro__:
+                names.update(get_decorated_names(klass))
+
+            for f_name in sorted(names):
+                # The method may be overridden without the decorator
+                f = getattr(model, f_name)
+                if not inspect.ismethod(f):
                     continue
+                for kind in kinds:
+                    if hasattr(f, kind):
+                        rv[kind].append((model_name, f_name, f))
+        return rv
+
+    def get_urls(self):
+        """
+        Return the URL rules for routes formed by decorating methods with the
+        :func:`~nereid.helpers.route` decorator.
+
+        This method looks for the methods of the models in the pool of the
+        loaded database with the `_url_rules` attribute. If there are URLs
+        defined, it is added to the url map.
+        """
+        rules = []
 
-                for rule in f._url_rules:
-                    rule_obj = self.url_rule_class(
-                        rule[0],
-                        endpoint='.'.join([model_name, f_name]),
-                        **rule[1]
+        for model_name, f_name, f in self.get_model_methods('_url_rules'):
+            for rule in f._url_rules:
+                rule_obj = self.url_rule_class(
+                    rule[0],
+                    endpoint='.'.join([model_name, f_name]),
+                    **rule[1]
+                )
+                rules.append(rule_obj)
+                if rule_obj.is_csrf_exempt:
+                    self.csrf_protection._exempt_views.add(
+                        rule_obj.endpoint
                     )
-                    rules.append(rule_obj)
-                    if rule_obj.is_csrf_exempt:
-                        self.csrf_protection._exempt_views.add(
-                            rule_obj.endpoint
-                        )
 
         return rules
 
-    @root_transaction_if_required
     def get_context_processors(self):
         """
         Returns the method object which wraps context processor methods
         formed by decorating methods with the
         :func:`~nereid.helpers.context_processor` decorator.
 
-        This method goes through all the models and their methods in the pool
-        of the loaded database and looks for the `_context_processor` attribute
-        in them and adds to context_processor dict.
+        This method looks for the methods of the models in the pool of the
+        loaded database with the `_context_processor` attribute and adds
+        them to context_processor dict.
         """
         context_processors = {}
-        models = Pool._pool[self.database_name]['model']
-
-        for model_name, model in models.iteritems():
-            for f_name, f in inspect.getmembers(
-                    model, predicate=inspect.ismethod):
 
-                if hasattr(f, '_context_processor'):
-                    ctx_proc_as_func = getattr(Pool().get(model_name), f_name)
-                    context_processors[ctx_proc_as_func.func_name] = \
-                        ctx_proc_as_func
+        for model_name, f_name, f in self.get_model_methods(
+                '_context_processor'):
+            context_processors[f.func_name] = f
 
         def get_ctx():
             """Returns dictionary having method name in keys and method object
@@ -302,52 +694,202 @@ class Nereid(Flask):
 
         return get_ctx
 
-    @root_transaction_if_required
     def get_template_filters(self):
         """
         Returns a list of name, function pairs for template filters registered
         in the models using :func:`~nereid.helpers.template_filter` decorator.
         """
-        models = Pool._pool[self.database_name]['model']
-        filters = []
-
-        for model_name, model in models.iteritems():
-            for f_name, f in inspect.getmembers(
-                    model, predicate=inspect.ismethod):
-
-                if hasattr(f, '_template_filter'):
-                    filter = getattr(Pool().get(model_name), f_name)
-                    filters.append((filter.func_name, filter))
-
-        return filters
+        return [
+            (f.func_name, f)
+            for model_name, f_name, f in self.get_model_methods(
+                '_template_filter')
+        ]
 
     def load_cache(self):
         """
         Load the cache and assign the Cache interface to
         """
-        BackendClass = import_string(self.cache_type)
+        self.cache = self.make_cache(self.cache_type)
+
+    def make_cache(self, cache_type):
+        """
+        Returns a cache of the given type configured from the config of the
+        application
+        """
+        BackendClass = import_string(cache_type)
 
-        if self.cache_type == 'werkzeug.contrib.cache.NullCache':
-            self.cache = BackendClass(self.cache_default_timeout)
-        elif self.cache_type == 'werkzeug.contrib.cache.SimpleCache':
-            self.cache = BackendClass(
+        if cache_type == 'werkzeug.contrib.cache.NullCache':
+            return BackendClass(self.cache_default_timeout)
+        elif cache_type == 'werkzeug.contrib.cache.SimpleCache':
+            return BackendClass(
                 self.cache_threshold, self.cache_default_timeout)
-        elif self.cache_type == 'werkzeug.contrib.cache.MemcachedCache':
-            self.cache = BackendClass(
+        elif cache_type == 'werkzeug.contrib.cache.MemcachedCache':
+            return BackendClass(
                 self.cache_memcached_servers,
                 self.cache_default_timeout,
                 self.cache_key_prefix)
-        elif self.cache_type == 'werkzeug.contrib.cache.GAEMemcachedCache':
-            self.cache = BackendClass(
+        elif cache_type == 'werkzeug.contrib.cache.GAEMemcachedCache':
+            return BackendClass(
                 self.cache_default_timeout,
                 self.cache_key_prefix)
-        elif self.cache_type == 'werkzeug.contrib.cache.FileSystemCache':
-            self.cache = BackendClass(
+        elif cache_type == 'werkzeug.contrib.cache.FileSystemCache':
+            return BackendClass(
                 self.cache_dir,
                 self.cache_threshold,
                 self.cache_default_timeout)
+        elif cache_type == 'nereid.contrib.cache.TwoTierCache':
+            return BackendClass(
+                self.make_cache(self.cache_shared_type),
+                self.cache_local_threshold,
+                self.cache_local_timeout,
+                self.cache_default_timeout,
+                self.cache_local_channel)
         else:
-            self.cache = BackendClass(**self.cache_init_kwargs)
+            return BackendClass(**self.cache_init_kwargs)
+
+    def load_cache_sync(self):
+        """
+        Load the strategy which synchronises the Tryton caches of this worker
+        with the invalidations made by other workers.
+        """
+        SyncClass = import_string(self.cache_sync_type)
+        self.cache_sync = SyncClass(
+            self, interval=self.cache_sync_interval,
+            **self.cache_sync_init_kwargs
+        )
+
+    def load_session_store(self):
+        """
+        Load the SQLite store of the sessions if `SESSION_STORE` is
+        `sqlite`. The sessions are kept in the cache otherwise.
+        """
+        if self.session_store_type == 'sqlite':
+            if not self.session_sqlite_path:
+                raise ValueError('SESSION_SQLITE_PATH is not defined')
+            self.session_interface = NereidSessionInterface(
+                SQLiteSessionStore(self.session_sqlite_path)
+            )
+        elif self.session_store_type != 'cache':
+            raise ValueError(
+                'Unknown session store %r' % (self.session_store_type, )
+            )
+
+    def load_password_pool(self):
+        """
+        Load the pool of `PASSWORD_POOL_SIZE` threads or processes which
+        verifies the passwords of the users
+        """
+        if self.password_pool_size:
+            self.password_pool = VerificationPool(
+                self.password_pool_size, self.password_pool_type
+            )
+
+    def load_database_pools(self):
+        """
+        Replace the connection pool of the tryton database by the pools of
+        the application if `DATABASE_POOL_SIZE` or `DATABASE_READONLY_NAME`
+        is set, and open the initial connections of the pools.
+        """
+        readonly_names = self.database_readonly_name
+        if isinstance(readonly_names, basestring):
+            readonly_names = [readonly_names]
+
+        if not self.database_pool_size and not readonly_names:
+            return
+        if backend.name() != 'postgresql':
+            self.logger.warning(
+                'The connection pools are not supported by the %s backend' %
+                backend.name()
+            )
+            return
+
+        import psycopg2
+
+        def pool(database_name, size, uri=None, name=None):
+            dsn = get_dsn(database_name, uri)
+            return ConnectionPool(
+                lambda: psycopg2.connect(dsn), size, name=name,
+                **self.database_pool_init_kwargs
+            )
+
+        size = self.database_pool_size or \
+            config.getint('database', 'maxconn', 64)
+        readonly_size = self.database_readonly_pool_size or size
+        readonly_pools = [
+            pool(name, readonly_size, self.database_readonly_uri, name=name)
+            for name in readonly_names or []
+        ]
+        self.database_pools = DatabasePools(
+            pool(self.database_name, size, name='primary'), readonly_pools
+        )
+        self.database_pools.warm_up()
+
+        # The cursors return their connection to the pool they got it from
+        # so the pool of the backend is closed only after it is replaced
+        tryton_pool = self._database._connpool
+        self._database._connpool = self.database_pools
+        tryton_pool.closeall()
+
+    def start_transaction(self, user=0, readonly=False, context=None):
+        """
+        Starts a transaction on the database of the application and returns
+        the manager returned by :meth:`Transaction.start`.
+
+        When the application has its own connection pools, the connection of
+        a readonly transaction is taken from the readonly pools, unless there
+        was a write in the session recently (see :meth:`stick_to_primary`).
+        """
+        if self.database_pools is None:
+            return Transaction().start(
+                self.database_name, user, readonly=readonly, context=context
+            )
+        with self.database_pools.route(
+                readonly and not self.is_stuck_to_primary()):
+            return Transaction().start(
+                self.database_name, user, readonly=readonly, context=context
+            )
+
+    def synchronise_caches(self, clean=True):
+        """
+        Synchronise the tryton caches in a transaction of its own if the
+        :attr:`cache_sync` strategy has something to do. It is called before
+        the transactions of the request are started, so that a request
+        never holds more than one connection of the pool at a time.
+
+        The single transaction dispatch cleans the caches with the cursor
+        of the request and calls this with `clean` False to only publish
+        the resets, which need a transaction that can write.
+        """
+        if clean and self.cache_sync.is_due():
+            with self.start_transaction():
+                self.cache_sync.synchronise()
+        elif not clean and self.cache_sync.resets_due():
+            with self.start_transaction():
+                self.cache_sync.resets()
+
+    def stick_to_primary(self):
+        """
+        Run the readonly transactions of the current session on the primary
+        database for `DATABASE_READONLY_STICKY_DURATION` seconds. This is
+        called by the dispatcher after a write.
+        """
+        if self.database_pools is None or \
+                not self.database_pools.readonly_pools or \
+                not self.database_readonly_sticky_duration:
+            return
+        session['nereid_primary_until'] = \
+            time() + self.database_readonly_sticky_duration
+
+    def is_stuck_to_primary(self):
+        """
+        Returns True if the readonly transactions of the current session
+        must run on the primary database
+        """
+        if not has_request_context() or self.database_pools is None or \
+                not self.database_pools.readonly_pools:
+            # Do not load the session when there is no readonly pool
+            return False
+        return session.get('nereid_primary_until', 0) > time()
 
     def load_backend(self):
         """
@@ -408,9 +950,10 @@ class Nereid(Flask):
         Does the request dispatching.  Matches the URL and returns the
         return value of the view or error handler.  This does not have to
         be a response object.
-        """
-        DatabaseOperationalError = backend.get('DatabaseOperationalError')
 
+        The pages of the routes with a `cache_timeout` are served from the
+        page cache when they can be (see :mod:`nereid.pagecache`).
+        """
         req = _request_ctx_stack.top.request
         if req.routing_exception is not None:
             self.raise_routing_exception(req)
@@ -422,34 +965,35 @@ class Nereid(Flask):
            and req.method == 'OPTIONS':
             return self.make_default_options_response()
 
-        with Transaction().start(self.database_name, 0):
-            Cache.clean(self.database_name)
-            Cache.resets(self.database_name)
+        timeout = self.page_cache.get_timeout(req)
+        if timeout:
+            return self.page_cache.dispatch(
+                req, timeout,
+                lambda: self._dispatch_request_transactions(req, rule)
+            )
+        return self._dispatch_request_transactions(req, rule)
 
-        with Transaction().start(self.database_name, 0, readonly=True):
-            Website = Pool().get('nereid.website')
-            website = Website.get_from_host(req.host)
+    def _dispatch_request_transactions(self, req, rule):
+        """
+        Dispatch the request in the transactions of the application
+        """
+        DatabaseOperationalError = backend.get('DatabaseOperationalError')
 
-            user = website.application_user.id
-            website_context = website.get_context()
-            website_context.update({
-                'company': website.company.id,
-            })
+        if self.single_transaction_dispatch:
+            return self._dispatch_request_single_transaction(req, rule)
 
-            language = 'en_US'
-            if website:
-                # If this is a request specific to a website
-                # then take the locale from the website
-                language = website.get_current_locale(req).language.code
+        self.synchronise_caches()
+
+        with self.start_transaction(readonly=True):
+            user, website_context, language = self.get_website_context(req)
 
         # pop locale if specified in the view_args
         req.view_args.pop('locale', None)
         active_id = req.view_args.pop('active_id', None)
 
         for count in range(int(config.get('database', 'retry')), -1, -1):
-            with Transaction().start(
-                    self.database_name, user,
-                    context=website_context,
+            with self.start_transaction(
+                    user, context=website_context,
                     readonly=rule.is_readonly) as txn:
                 try:
                     transaction_start.send(self)
@@ -457,6 +1001,8 @@ class Nereid(Flask):
                         req, language=language, active_id=active_id
                     )
                     txn.cursor.commit()
+                    if not rule.is_readonly:
+                        self.stick_to_primary()
                 except DatabaseOperationalError:
                     # Strict transaction handling may cause this.
                     # Rollback and Retry the whole transaction if within
@@ -474,6 +1020,93 @@ class Nereid(Flask):
                 finally:
                     transaction_stop.send(self)
 
+    def _dispatch_request_single_transaction(self, req, rule):
+        """
+        Dispatch the request resolving the website, locale and context in
+        the transaction which runs the view.
+
+        The transaction opened by the request context to create the URL
+        adapter is reused for the first attempt, unless it is readonly and
+        the rule needs to write.
+        """
+        DatabaseOperationalError = backend.get('DatabaseOperationalError')
+
+        ctx = _request_ctx_stack.top
+        if ctx.transaction is not None and ctx.transaction_readonly and (
+                not rule.is_readonly or self.is_stuck_to_primary()):
+            # The transaction was started from the method of the request,
+            # before the rule and the session were known
+            ctx.stop_transaction()
+
+        user = website_context = language = active_id = None
+        for count in range(int(config.get('database', 'retry')), -1, -1):
+            if ctx.transaction is None:
+                ctx.start_transaction(readonly=rule.is_readonly)
+            txn = Transaction()
+            try:
+                transaction_start.send(self)
+                if user is None:
+                    if self.cache_sync.clean_due():
+                        self.cache_sync.clean()
+                    user, website_context, language = \
+                        self.get_website_context(req)
+
+                    # pop locale if specified in the view_args
+                    req.view_args.pop('locale', None)
+                    active_id = req.view_args.pop('active_id', None)
+
+                with txn.set_user(user), txn.set_context(website_context):
+                    rv = self._dispatch_request(
+                        req, language=language, active_id=active_id
+                    )
+                txn.cursor.commit()
+                if not rule.is_readonly:
+                    self.stick_to_primary()
+            except DatabaseOperationalError:
+                # Rollback and Retry the whole transaction if within
+                # max retries, or raise exception and quit.
+                txn.cursor.rollback()
+                if count:
+                    continue
+                raise
+            except Exception:
+                # Rollback and raise any other exception
+                txn.cursor.rollback()
+                raise
+            else:
+                return rv
+            finally:
+                transaction_stop.send(self)
+                ctx.stop_transaction()
+
+    def get_website_context(self, req):
+        """
+        Returns a tuple of the user, the transaction context and the language
+        code with which the view of the given request should be dispatched.
+
+        They are taken from the dispatch profile of the website (see
+        :meth:`nereid.website.get_dispatch_profile`) which is kept in the
+        worker, so this does not read the database in the steady state.
+
+        This method must be called within a transaction.
+        """
+        Website = Pool().get('nereid.website')
+        website = Website.get_from_host(req.host)
+        profile = website.get_dispatch_profile()
+
+        website_context = dict(profile.context)
+        website_context.update({
+            'company': profile.company,
+        })
+
+        # The language of the locale in the URL if the website has such a
+        # locale, the language of the default locale otherwise
+        language = profile.get_language(
+            (req.view_args or {}).get('locale')
+        )
+
+        return profile.user, website_context, language
+
     def _dispatch_request(self, req, language, active_id):
         """
         Implement the nereid specific _dispatch
@@ -495,6 +1128,8 @@ class Nereid(Flask):
                 # arguments and pass the model instance as first argument
                 model = Pool().get(req.url_rule.endpoint.rsplit('.', 1)[0])
                 i = model(active_id)
+                # The page shows the record
+                req.cache_tags.add(get_tag(model.__name__, active_id))
                 try:
                     i.rec_name
                 except UserError:
@@ -535,6 +1170,10 @@ class Nereid(Flask):
             rv.bytecode_cache = MemcachedBytecodeCache(self.cache)
             # Setup for fragmented caching
             rv.fragment_cache = self.cache
+            rv.fragment_cache_tags = self.cache_tags
+            rv.fragment_cache_stale_timeout = \
+                self.fragment_cache_stale_timeout
+            rv.fragment_cache_lock_timeout = self.fragment_cache_lock_timeout
             rv.fragment_cache_prefix = self.cache_key_prefix + "-frag-"
 
         # Install the gettext callables
@@ -0,0 +1,166 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    The keys of the memoized calls.
+
+    A :class:`KeyBuilder` binds the arguments of a call to the parameters of
+    the function with a plan made once, when the function is decorated, and
+    encodes each value with a type tag, so that `1`, `'1'` and `u'1'` get
+    different keys. The records of tryton are encoded by their model and id.
+
+    The short keys made of printable ascii characters are used as they are,
+    the others are hashed with xxhash when it is installed, md5 otherwise.
+"""
+import re
+import inspect
+from hashlib import md5
+
+from trytond.model import Model
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+__all__ = ['KeyBuilder', 'make_key', 'hash_key']
+
+#: The longest key used as it is. Longer keys are hashed.
+MAX_KEY_LENGTH = 200
+
+_unsafe = re.compile(r'[^\x21-\x7e]').search
+_missing = object()
+
+
+def hash_key(data):
+    """
+    Returns the hash of the data of a key
+    """
+    if xxhash is not None:
+        return xxhash.xxh64(data).hexdigest()
+    return md5(data).hexdigest()
+
+
+def _encode_str(value):
+    return 's%d:%s' % (len(value), value)
+
+
+def _encode_unicode(value):
+    value = value.encode('utf-8')
+    return 'u%d:%s' % (len(value), value)
+
+
+def _encode_sequence(value):
+    return '(' + ','.join(map(encode, value)) + ')'
+
+
+_encoders = {
+    int: lambda value: 'i%d' % value,
+    long: lambda value: 'i%d' % value,
+    bool: lambda value: 'b%d' % value,
+    float: lambda value: 'f%r' % value,
+    type(None): lambda value: 'n',
+    str: _encode_str,
+    unicode: _encode_unicode,
+    tuple: _encode_sequence,
+    list: _encode_sequence,
+}
+
+
+def encode(value):
+    """
+    Returns the part of a key which stands for the value
+    """
+    encoder = _encoders.get(type(value))
+    if encoder is not None:
+        return encoder(value)
+    if isinstance(value, Model):
+        return 'r%s#%s' % (value.__name__, value.id)
+    if isinstance(value, dict):
+        return 'd' + _encode_sequence(sorted(value.items()))
+    value = repr(value)
+    return 'o%d:%s' % (len(value), value)
+
+
+def make_key(prefix, values):
+    """
+    Returns the key of the values for the prefix
+    """
+    parts = []
+    for value in values:
+        # The most common types are encoded inline, which saves a call
+        if type(value) is int:
+            parts.append('i%d' % value)
+        elif type(value) is str:
+            parts.append('s%d:%s' % (len(value), value))
+        else:
+            parts.append(encode(value))
+    key = prefix + ':' + ','.join(parts)
+    if len(key) <= MAX_KEY_LENGTH and not _unsafe(key):
+        return key
+    if len(prefix) < MAX_KEY_LENGTH / 2 and not _unsafe(prefix):
+        return prefix + '#' + hash_key(key)
+    return hash_key(key)
+
+
+class KeyBuilder(object):
+    """
+    Builds the keys of the calls of a function.
+
+    The positional and keyword arguments are bound to the parameters of the
+    function, with their defaults, so that `f(1)`, `f(1, 2)` and `f(a=1)`
+    get the same key if the default of the second parameter is 2.
+
+    :param prefix: The prefix of the keys
+    :param function: The function
+    :param skip: The number of leading parameters which are not a part of
+                 the key, like `self`
+    :param key_func: A callable which is given the arguments of the call and
+                     returns the value or tuple of values to build the key
+                     from, instead of the arguments.
+    """
+
+    def __init__(self, prefix, function, skip=0, key_func=None):
+        self.prefix = prefix
+        self.skip = skip
+        self.key_func = key_func
+
+        names, varargs, varkw, defaults = inspect.getargspec(function)
+        defaults = list(defaults or [])
+        self.defaults = [_missing] * (len(names) - len(defaults)) + defaults
+        del self.defaults[:skip]
+        self.names = names[skip:]
+        self.required = self.defaults.count(_missing)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+
+    def __call__(self, args, kwargs):
+        if self.key_func is not None:
+            values = self.key_func(*args, **kwargs)
+            if not isinstance(values, tuple):
+                values = (values, )
+            return make_key(self.prefix, values)
+
+        if self.skip:
+            args = args[self.skip:]
+        if not kwargs and len(args) == len(self.names):
+            # All the arguments are positional
+            return make_key(self.prefix, args)
+
+        values = list(args) + self.defaults[len(args):]
+        extra = None
+        for name, value in kwargs.iteritems():
+            i = self.index.get(name)
+            if i is None:
+                if extra is None:
+                    extra = []
+                extra.append((name, value))
+            else:
+                values[i] = value
+        if len(args) < self.required:
+            # The function raises TypeError for the missing arguments
+            values = [
+                value for value in values if value is not _missing
+            ]
+        if extra:
+            extra.sort()
+            values.append(tuple(extra))
+        return make_key(self.prefix, values)
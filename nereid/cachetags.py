@@ -0,0 +1,266 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Invalidation of the cached pages and fragments by tags.
+
+    A tag names a record (`product.product:42`) or all the records of a
+    model (`product.product`). The cache entries remember the version of
+    their tags when they are stored and are discarded when a version changed.
+    The versions are kept in the cache of the application (`app.cache`), so
+    that all the workers sharing the cache see them.
+
+    The `create`, `write` and `delete` of the tryton models which inherit
+    :class:`CacheTagsMixin` bump the tags of the records and of their model
+    when they run within a nereid application with a cache. The tags are
+    bumped again when the transaction stops, so that an entry rendered from
+    the data of before the commit does not survive.
+
+    The versions of the tags of a page are taken when the tags are added to
+    `request.cache_tags`, so that a page rendered while one of its records
+    changed is discarded.
+"""
+import random
+import threading
+
+from flask.globals import current_app
+from flask.ctx import has_app_context
+from werkzeug.contrib.cache import NullCache
+
+from .signals import transaction_stop
+
+__all__ = [
+    'CacheTags', 'CacheTagsMixin', 'RequestTags', 'get_tag', 'get_tags',
+]
+
+
+def get_tag(model_name, id=None):
+    """
+    Returns the tag of the record of the model with the given id or the tag
+    of the model if id is None
+    """
+    if id is None:
+        return model_name
+    return '%s:%s' % (model_name, id)
+
+
+def get_tags(records):
+    """
+    Returns the tags of the records
+    """
+    return set(get_tag(record.__name__, record.id) for record in records)
+
+
+class RequestTags(set):
+    """
+    The tags of the page of a request. Once :meth:`track` was called, the
+    version of a tag is taken when it is added, before the page is stored.
+    Use :meth:`add` and :meth:`update` to add tags, the versions are not
+    taken by the operators of the set.
+    """
+
+    def __init__(self, tags=()):
+        super(RequestTags, self).__init__()
+        self.cache_tags = None
+
+        #: The versions of the tags by tag
+        self.versions = {}
+        self.update(tags)
+
+    def track(self, cache_tags):
+        """
+        Take the versions of the tags added from now on, and of the tags
+        already added, from the :class:`CacheTags`
+        """
+        self.cache_tags = cache_tags
+        self._take_versions(self)
+
+    def add(self, tag):
+        self.update([tag])
+
+    def update(self, *others):
+        new = set()
+        for tags in others:
+            new.update(tag for tag in tags if tag not in self)
+        super(RequestTags, self).update(new)
+        self._take_versions(new)
+
+    def add_versions(self, versions):
+        """
+        Add the tags of versions returned by :meth:`CacheTags.get_versions`,
+        like the versions stored with a fragment. The earliest version of a
+        tag is kept.
+        """
+        for tag, version in versions:
+            if tag not in self:
+                super(RequestTags, self).add(tag)
+            self.versions.setdefault(tag, version)
+
+    def get_versions(self):
+        """
+        Returns the versions of the tags like :meth:`CacheTags.get_versions`
+        """
+        missing = [tag for tag in self if tag not in self.versions]
+        if missing and self.cache_tags is not None:
+            self._take_versions(missing)
+        return tuple(sorted(
+            (tag, self.versions[tag]) for tag in self
+            if tag in self.versions
+        ))
+
+    def _take_versions(self, tags):
+        tags = [tag for tag in tags if tag not in self.versions]
+        if tags and self.cache_tags is not None:
+            self.versions.update(self.cache_tags.get_versions(tags))
+
+
+class CacheTags(object):
+    """
+    The versions of the tags of an application.
+
+    :param app: The nereid application
+    """
+
+    #: The number of tags given a new version by a single `set_many`
+    bump_batch_size = 500
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+        #: The number of tags bumped
+        self.stats = {'bumps': 0}
+
+        transaction_stop.connect(self.flush, sender=app)
+
+    @property
+    def cache(self):
+        return self.app.cache
+
+    @property
+    def enabled(self):
+        """
+        The tags are not bumped when the application has no cache, where
+        nothing is cached
+        """
+        return self.cache is not None and \
+            not isinstance(self.cache, NullCache)
+
+    def get_key(self, tag):
+        return '%stag-%s' % (self.app.cache_key_prefix, tag)
+
+    def get_versions(self, tags):
+        """
+        Returns the current versions of the tags as a tuple of pairs of the
+        tag and its version, to be stored with a cache entry. A version is
+        given to the tags which have none.
+        """
+        tags = sorted(tags)
+        if not tags:
+            return ()
+        versions = list(self.cache.get_many(*map(self.get_key, tags)))
+        for i, (tag, version) in enumerate(zip(tags, versions)):
+            if version is None:
+                version = self.new_version()
+                if not self.cache.add(
+                        self.get_key(tag), version,
+                        self.app.cache_tag_timeout):
+                    # Another worker gave it a version meanwhile
+                    version = self.cache.get(self.get_key(tag))
+                versions[i] = version
+        return tuple(zip(tags, versions))
+
+    def is_current(self, versions):
+        """
+        Returns True if none of the tags of the versions returned by
+        :meth:`get_versions` was bumped since
+        """
+        if not versions:
+            return True
+        tags, stored = zip(*versions)
+        current = self.cache.get_many(*map(self.get_key, tags))
+        return all(
+            version is not None and version == stored_version
+            for version, stored_version in zip(current, stored)
+        )
+
+    def bump(self, tags):
+        """
+        Give new versions to the tags, which discards the cache entries
+        tagged with them
+        """
+        tags = list(tags)
+        for i in xrange(0, len(tags), self.bump_batch_size):
+            self.cache.set_many(dict(
+                (self.get_key(tag), self.new_version())
+                for tag in tags[i:i + self.bump_batch_size]
+            ), self.app.cache_tag_timeout)
+        self.stats['bumps'] += len(tags)
+
+    def invalidate(self, tags):
+        """
+        Bump the tags now and when the transaction stops
+        """
+        self.bump(tags)
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = set()
+        pending.update(tags)
+
+    def flush(self, app=None):
+        """
+        Bump the tags invalidated during the transaction. This is called
+        when the transaction of the dispatcher stops.
+        """
+        pending = getattr(self._local, 'pending', None)
+        if pending:
+            self._local.pending = None
+            self.bump(pending)
+
+    @staticmethod
+    def new_version():
+        return '%016x' % random.getrandbits(64)
+
+
+def _invalidate(model_name, ids):
+    if not has_app_context():
+        return
+    cache_tags = getattr(current_app, 'cache_tags', None)
+    if cache_tags is None or not cache_tags.enabled:
+        return
+    tags = set([get_tag(model_name)])
+    tags.update(get_tag(model_name, id) for id in ids)
+    cache_tags.invalidate(tags)
+
+
+class CacheTagsMixin(object):
+    """
+    Invalidates the tags of the records, and the tag of the model, when
+    they are created, written or deleted. Add it to the models whose records
+    are shown by the cached pages and fragments:
+
+    .. code-block:: python
+
+        class Product(CacheTagsMixin):
+            __metaclass__ = PoolMeta
+            __name__ = 'product.product'
+    """
+
+    @classmethod
+    def create(cls, vlist):
+        records = super(CacheTagsMixin, cls).create(vlist)
+        _invalidate(cls.__name__, [])
+        return records
+
+    @classmethod
+    def write(cls, records, values, *args):
+        ids = [r.id for r in records]
+        for other_records in args[::2]:
+            ids.extend(r.id for r in other_records)
+        super(CacheTagsMixin, cls).write(records, values, *args)
+        _invalidate(cls.__name__, ids)
+
+    @classmethod
+    def delete(cls, records):
+        ids = [r.id for r in records]
+        super(CacheTagsMixin, cls).delete(records)
+        _invalidate(cls.__name__, ids)
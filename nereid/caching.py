@@ -1,12 +1,12 @@
 # This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 from functools import wraps
-from hashlib import md5
-import inspect
 from warnings import warn
 
 from flask.globals import current_app
 
+from .cachekeys import KeyBuilder, make_key
+
 warn(DeprecationWarning("This API will be deprecated"))
 
 
@@ -96,7 +96,7 @@ class Cache(object):
             return wrapper
         return decorator
 
-    def memoize(self, key, timeout=None, unless=None):
+    def memoize(self, key, timeout=None, unless=None, key_func=None):
         """
         Decorator to use as caching function but also evaluates
         the arguments
@@ -108,34 +108,30 @@ class Cache(object):
         :param unless: Callable for truth testing. If provided, the
                        callable is called with no arguments and if true,
                        caching operation will be cancelled
+        :param key_func: Callable which is given the arguments of the call
+                         and returns the value, or tuple of values, the key
+                         is built from instead of the arguments. See
+                         :class:`~nereid.cachekeys.KeyBuilder`.
         """
         def decorator(function):
-            arg_names = inspect.getargspec(function)[0]
+            make_cache_key = KeyBuilder(key, function, key_func=key_func)
 
             @wraps(function)
             def wrapper(*args, **kwargs):
                 if callable(unless) and unless() is True:
                     return function(*args, **kwargs)
 
-                kwargs_origin = kwargs.copy()
-                kwargs.update(dict(zip(arg_names, args)))
-                kwargs = kwargs.items()
-                kwargs.sort()
-
-                hash = md5()
-                hash.update(key + repr(kwargs))
-                cache_key = hash.hexdigest()
-
+                cache_key = make_cache_key(args, kwargs)
                 rv = current_app.cache.get(cache_key)
 
                 if rv is None:
-                    rv = function(*args, **kwargs_origin)
+                    rv = function(*args, **kwargs)
                     current_app.cache.set(cache_key, rv, timeout)
                 return rv
             return wrapper
         return decorator
 
-    def memoize_method(self, key, timeout=None, unless=None):
+    def memoize_method(self, key, timeout=None, unless=None, key_func=None):
         """
         Decorator to use as caching function but also evaluates
         the arguments
@@ -147,30 +143,115 @@ class Cache(object):
         :param unless: Callable for truth testing. If provided, the
                        callable is called with no arguments and if true,
                        caching operation will be cancelled
+        :param key_func: Callable which is given the arguments of the call,
+                         including `self`, and returns the value, or tuple
+                         of values, the key is built from instead of the
+                         arguments.
         """
         def decorator(function):
-            arg_names = inspect.getargspec(function)[0]
+            make_cache_key = KeyBuilder(
+                key, function, skip=1, key_func=key_func
+            )
 
             @wraps(function)
             def wrapper(*args, **kwargs):
                 if callable(unless) and unless() is True:
                     return function(*args, **kwargs)
 
-                kwargs_origin = kwargs.copy()
-                kwargs.update(dict(zip(arg_names, args)))
-                kwargs.pop('self')
-                kwargs = kwargs.items()
-                kwargs.sort()
-
-                hash = md5()
-                hash.update(key + repr(args[1:]) + repr(kwargs))
-                cache_key = hash.hexdigest()
-
+                cache_key = make_cache_key(args, kwargs)
                 rv = current_app.cache.get(cache_key)
 
                 if rv is None:
-                    rv = function(*args, **kwargs_origin)
+                    rv = function(*args, **kwargs)
                     current_app.cache.set(cache_key, rv, timeout)
                 return rv
             return wrapper
         return decorator
+
+    def memoize_many(self, key, timeout=None, unless=None, batched=False,
+                     key_func=None):
+        """
+        Decorator to memoize a function for many arguments at once. The
+        decorated function is called with a list of argument tuples and
+        returns the list of the results in the same order.
+
+        The cached results are fetched with a single `get_many` and the
+        results of the misses are stored with a single `set_many`. Unless
+        the function is batched, the keys are those of :meth:`memoize` with
+        the same key, so both share their cached results.
+
+        .. code-block:: python
+
+            @cache.memoize_many('product-price', 60 * 60)
+            def get_price(product_id, quantity):
+                ...
+
+            prices = get_price([(1, 1), (2, 1), (3, 10)])
+
+        The arguments given before the list, like the class of a
+        classmethod, are passed to the function but are not a part of the
+        key.
+
+        :param key: The prefix of the keys of the cached results
+        :param timeout: Time in seconds to retain cached value
+        :param unless: Callable for truth testing. If provided, the
+                       callable is called with no arguments and if true,
+                       caching operation will be cancelled
+        :param batched: If True, the function is called once with the list
+                        of the argument tuples of the misses and returns the
+                        list of their results, instead of once per miss
+        :param key_func: Callable which is given the leading arguments and
+                         the arguments of a tuple of the list, like the
+                         decorated function without batching, and returns
+                         the value, or tuple of values, the key is built
+                         from instead of the arguments
+        """
+        def decorator(function):
+            # The key builders by number of leading arguments
+            builders = {}
+
+            def get_builder(skip):
+                builder = builders.get(skip)
+                if builder is None:
+                    builder = builders[skip] = KeyBuilder(
+                        key, function, skip, key_func
+                    )
+                return builder
+
+            def call(prefix, args_list):
+                if batched:
+                    return function(*(prefix + (args_list, )))
+                return [function(*(prefix + tuple(args))) for args in args_list]
+
+            @wraps(function)
+            def wrapper(*args):
+                prefix, args_list = args[:-1], list(args[-1])
+                if callable(unless) and unless() is True:
+                    return call(prefix, args_list)
+                if not args_list:
+                    return []
+
+                if batched and key_func is None:
+                    # The arguments of a batched function are not named
+                    cache_keys = [
+                        make_key(key, call_args) for call_args in args_list
+                    ]
+                else:
+                    make_cache_key = get_builder(len(prefix))
+                    cache_keys = [
+                        make_cache_key(prefix + tuple(call_args), {})
+                        for call_args in args_list
+                    ]
+                rv = list(current_app.cache.get_many(*cache_keys))
+                missing = [i for i, value in enumerate(rv) if value is None]
+                if missing:
+                    results = call(prefix, [args_list[i] for i in missing])
+                    for i, result in zip(missing, results):
+                        rv[i] = result
+                    current_app.cache.set_many(dict(
+                        (cache_keys[i], rv[i]) for i in missing
+                        if rv[i] is not None
+                    ), timeout)
+                return rv
+            return wrapper
+        return decorator
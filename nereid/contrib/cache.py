@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    A two tier cache backend: a small in-process LRU cache with a short
+    timeout in front of a cache shared by the workers, like memcached.
+
+    The backend is selected with the `CACHE_TYPE` of the application::
+
+        CACHE_TYPE = 'nereid.contrib.cache.TwoTierCache'
+        CACHE_SHARED_TYPE = 'werkzeug.contrib.cache.MemcachedCache'
+        CACHE_MEMCACHED_SERVERS = ['127.0.0.1:11211']
+
+    The local tier saves the network round trips of the values read again
+    and again, like the templates of the bytecode cache. A value changed by
+    another worker is seen once it expires from the local tier, after
+    `CACHE_LOCAL_TIMEOUT` seconds, or immediately if the workers share a
+    `CACHE_LOCAL_CHANNEL` on which the changed keys are published.
+"""
+import os
+import threading
+from collections import OrderedDict
+from time import time, sleep
+
+from werkzeug.contrib.cache import BaseCache
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from nereid.invalidation import UnixSocketChannel
+
+__all__ = ['LRUCache', 'TwoTierCache']
+
+
+class LRUCache(BaseCache):
+    """
+    A thread safe in-process cache which drops the least recently used
+    values when it holds more than `threshold` values.
+
+    The values are pickled like in :class:`~werkzeug.contrib.cache.SimpleCache`,
+    so that the callers get their own copy.
+
+    :param threshold: The maximum number of values
+    :param default_timeout: The default timeout in seconds
+    """
+
+    def __init__(self, threshold=1000, default_timeout=5):
+        BaseCache.__init__(self, default_timeout)
+        self.threshold = threshold
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._cache.pop(key)
+            except KeyError:
+                return None
+            if expires <= time():
+                return None
+            # Put it back as the most recently used
+            self._cache[key] = (expires, value)
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._set(key, value, timeout)
+        return True
+
+    def _set(self, key, value, timeout):
+        self._cache.pop(key, None)
+        self._cache[key] = (time() + timeout, value)
+        while len(self._cache) > self.threshold:
+            self._cache.popitem(last=False)
+
+    def add(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time():
+                return False
+            self._set(key, value, timeout)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        return True
+
+
+class TwoTierCache(BaseCache):
+    """
+    A cache which keeps the values read from or written to the `shared`
+    cache in a local :class:`LRUCache` for `local_timeout` seconds.
+
+    The writes go to both tiers. The keys missing from the local tier are
+    read from the shared cache in a single `get_many`.
+
+    :param shared: The shared cache, like a
+                   :class:`~werkzeug.contrib.cache.MemcachedCache`
+    :param threshold: The maximum number of values of the local tier
+    :param local_timeout: The number of seconds the values are kept in the
+                          local tier
+    :param default_timeout: The default timeout of the shared cache
+    :param channel: The directory of the
+                    :class:`~nereid.invalidation.UnixSocketChannel` or an
+                    object with the same API on which the workers publish
+                    the keys they change, so that the others drop them from
+                    their local tier. The keys are not published if None.
+    """
+
+    #: The longest message published on the channel. The local tiers are
+    #: cleared if the changed keys do not fit.
+    max_message_size = 60000
+
+    def __init__(self, shared, threshold=1000, local_timeout=5,
+                 default_timeout=300, channel=None):
+        BaseCache.__init__(self, default_timeout)
+        self.shared = shared
+        self.local = LRUCache(threshold, local_timeout)
+        self.local_timeout = local_timeout
+        if isinstance(channel, basestring):
+            channel = UnixSocketChannel(channel)
+        self.channel = channel
+        self._pid = None
+        self._lock = threading.Lock()
+
+        #: The number of values read from each tier and of the keys missing
+        #: from both
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    @property
+    def hit_ratios(self):
+        """
+        The ratio of the reads served by the local tier, by the shared tier
+        (out of the reads the local tier missed) and by either tier
+        """
+        local_hits = self.stats['local_hits']
+        shared_hits = self.stats['shared_hits']
+        reads = local_hits + shared_hits + self.stats['misses']
+        shared_reads = reads - local_hits
+        return {
+            'local': float(local_hits) / reads if reads else 0.0,
+            'shared': float(shared_hits) / shared_reads
+            if shared_reads else 0.0,
+            'total': float(local_hits + shared_hits) / reads
+            if reads else 0.0,
+        }
+
+    def _local_timeout(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return min(timeout, self.local_timeout) if timeout else \
+            self.local_timeout
+
+    def get(self, key):
+        self.subscribe()
+        rv = self.local.get(key)
+        if rv is not None:
+            self.stats['local_hits'] += 1
+            return rv
+        rv = self.shared.get(key)
+        if rv is None:
+            self.stats['misses'] += 1
+        else:
+            self.stats['shared_hits'] += 1
+            self.local.set(key, rv)
+        return rv
+
+    def get_many(self, *keys):
+        self.subscribe()
+        rv = map(self.local.get, keys)
+        missing = [i for i, value in enumerate(rv) if value is None]
+        self.stats['local_hits'] += len(keys) - len(missing)
+        if missing:
+            values = self.shared.get_many(*[keys[i] for i in missing])
+            for i, value in zip(missing, values):
+                if value is None:
+                    self.stats['misses'] += 1
+                    continue
+                self.stats['shared_hits'] += 1
+                self.local.set(keys[i], value)
+                rv[i] = value
+        return rv
+
+    def set(self, key, value, timeout=None):
+        rv = self.shared.set(key, value, timeout)
+        self.local.set(key, value, self._local_timeout(timeout))
+        self.publish([key])
+        return rv
+
+    def add(self, key, value, timeout=None):
+        rv = self.shared.add(key, value, timeout)
+        if rv:
+            self.local.set(key, value, self._local_timeout(timeout))
+            self.publish([key])
+        return rv
+
+    def set_many(self, mapping, timeout=None):
+        rv = self.shared.set_many(mapping, timeout)
+        local_timeout = self._local_timeout(timeout)
+        for key, value in dict(mapping).iteritems():
+            self.local.set(key, value, local_timeout)
+        self.publish(dict(mapping).keys())
+        return rv
+
+    def delete(self, key):
+        self.local.delete(key)
+        rv = self.shared.delete(key)
+        self.publish([key])
+        return rv
+
+    def delete_many(self, *keys):
+        for key in keys:
+            self.local.delete(key)
+        rv = self.shared.delete_many(*keys)
+        self.publish(keys)
+        return rv
+
+    def clear(self):
+        self.local.clear()
+        rv = self.shared.clear()
+        self.publish(None)
+        return rv
+
+    def inc(self, key, delta=1):
+        self.local.delete(key)
+        rv = self.shared.inc(key, delta)
+        self.publish([key])
+        return rv
+
+    def dec(self, key, delta=1):
+        self.local.delete(key)
+        rv = self.shared.dec(key, delta)
+        self.publish([key])
+        return rv
+
+    def publish(self, keys):
+        """
+        Publish the changed keys, or that all the keys changed if `keys` is
+        None, to the other workers
+        """
+        if self.channel is None:
+            return
+        message = '\n'.join(keys) if keys is not None else ''
+        if keys is None or len(message) > self.max_message_size:
+            message = '*'
+        try:
+            self.channel.publish(message)
+        except Exception:
+            # The local tiers of the other workers expire anyway
+            pass
+
+    def subscribe(self):
+        """
+        Start the thread which drops the keys published by the other workers
+        from the local tier, if it is not running in this process
+        """
+        if self.channel is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(
+                target=self.run, name='nereid-cache-channel'
+            )
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def run(self):
+        self.channel.subscribe()
+        while True:
+            try:
+                message = self.channel.receive()
+            except Exception:
+                self.local.clear()
+                sleep(self.local_timeout)
+                continue
+            self.drop(message)
+
+    def drop(self, message):
+        """
+        Drop the keys of a message published by another worker from the
+        local tier
+        """
+        if message == '*':
+            self.local.clear()
+            return
+        for key in message.split('\n'):
+            self.local.delete(key)
@@ -2,6 +2,7 @@
 # this repository contains the full copyright notices and license terms.
 from flask.ctx import RequestContext as RequestContextBase
 from flask.ctx import has_request_context  # noqa
+from trytond.transaction import Transaction
 
 
 class RequestContext(RequestContextBase):
@@ -10,9 +11,50 @@ class RequestContext(RequestContextBase):
     created at the beginning of the request and pushed to the
     `_request_ctx_stack` and removed at the end of it.  It will create the
     URL adapter and request object for the WSGI environment provided.
+
+    If the application dispatches requests in a single transaction, the
+    transaction is started here before the URL adapter is created, so that
+    the dispatcher can reuse it for the view.
     """
 
     def __init__(self, app, environ, request=None):
-        super(RequestContext, self).__init__(app, environ, request)
         self.transaction = None
+        self.transaction_readonly = None
+        self.app = app
+        if app.single_transaction_dispatch and Transaction().cursor is None:
+            # The rule is not known yet, so guess the mode of the cursor
+            # from the method like :attr:`nereid.routing.Rule.is_readonly`
+            self.start_transaction(
+                environ.get('REQUEST_METHOD') in ('HEAD', 'GET')
+            )
+        try:
+            super(RequestContext, self).__init__(app, environ, request)
+        except Exception:
+            self.stop_transaction()
+            raise
         self.cache = app.cache
+
+    def start_transaction(self, readonly=False):
+        """
+        Start the root transaction of this request, after the pending
+        resets of the caches are published in a transaction of their own
+        """
+        self.app.synchronise_caches(clean=False)
+        self.app.start_transaction(readonly=readonly)
+        self.transaction = Transaction()
+        self.transaction_readonly = readonly
+
+    def stop_transaction(self):
+        """
+        Stop the transaction of this request if it is still open
+        """
+        if self.transaction is not None:
+            self.transaction = None
+            self.transaction_readonly = None
+            Transaction().stop()
+
+    def pop(self, exc=None):
+        try:
+            super(RequestContext, self).pop(exc)
+        finally:
+            self.stop_transaction()
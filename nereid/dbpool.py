@@ -0,0 +1,325 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Connection pools for the postgresql backend of tryton.
+
+    The pool of the tryton backend opens a new connection whenever more than
+    `minconn` connections are in use and closes it when it is put back, and
+    fails when `maxconn` connections are in use. Under a threaded WSGI
+    server this means connecting to the database on many requests. The
+    pools here keep up to `size` connections open, make the requests wait
+    for a connection when they are all in use and can send the connections
+    of readonly transactions to another server, like a read replica.
+"""
+import itertools
+import threading
+import urllib
+from collections import deque
+from contextlib import contextmanager
+from time import time
+
+from trytond.config import config, parse_uri
+
+from .signals import connection_checkout
+
+__all__ = ['ConnectionPool', 'DatabasePools', 'PoolError', 'get_dsn']
+
+
+class PoolError(Exception):
+    "No connection of the pool could be handed out"
+
+
+def get_dsn(database_name, uri=None):
+    """
+    Returns the DSN of the postgresql database in the same way the tryton
+    backend builds it.
+
+    :param database_name: The name of the database
+    :param uri: The URI of the server. Defaults to the URI of the database
+                section of the tryton configuration.
+    """
+    uri = parse_uri(uri or config.get('database', 'uri'))
+    assert uri.scheme == 'postgresql'
+    parts = [
+        uri.hostname and "host=%s" % uri.hostname or '',
+        uri.port and "port=%s" % uri.port or '',
+        "dbname=%s" % database_name,
+        uri.username and "user=%s" % uri.username or '',
+        "password=%s" % urllib.unquote_plus(uri.password)
+        if uri.password else '',
+    ]
+    return ' '.join(filter(None, parts))
+
+
+class ConnectionPool(object):
+    """
+    A pool of at most `size` connections. A checkout waits for a connection
+    to be put back when they are all in use.
+
+    The pool has the interface of the psycopg2 pools used by the tryton
+    backend (`getconn`, `putconn` and `closeall`).
+
+    :param connect: A callable which returns a new connection
+    :param size: The maximum number of connections
+    :param min_size: The number of connections opened by :meth:`warm_up`
+    :param timeout: The time in milliseconds a checkout waits for a
+                    connection before :class:`PoolError` is raised
+    :param health_check_interval: A connection which was idle for longer
+                                  than this number of milliseconds is
+                                  checked before it is handed out. Use 0 to
+                                  check every connection and None to never
+                                  check.
+    :param name: The name of the pool sent with the checkout signal
+    """
+
+    def __init__(self, connect, size=10, min_size=1, timeout=30 * 1000,
+                 health_check_interval=30 * 1000, name=None):
+        self.connect = connect
+        self.size = size
+        self.min_size = min(min_size, size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.name = name
+        self.closed = False
+
+        #: The idle connections and the time they were put back
+        self._idle = deque()
+        self._used = 0
+        self._condition = threading.Condition(threading.Lock())
+
+        #: Counters of the pool. The times are in seconds.
+        self.stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'timeouts': 0,
+            'connects': 0,
+            'discards': 0,
+        }
+
+    @property
+    def in_use(self):
+        return self._used
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def warm_up(self):
+        """
+        Open connections till `min_size` connections are open
+        """
+        with self._condition:
+            missing = self.min_size - len(self._idle) - self._used
+            for i in xrange(missing):
+                self._idle.append((self._connect(), time()))
+
+    def getconn(self, key=None):
+        """
+        Returns a connection of the pool, waiting for one to be put back if
+        they are all in use
+        """
+        start = time()
+        waited = False
+        with self._condition:
+            while True:
+                if self.closed:
+                    raise PoolError('The pool is closed')
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._used < self.size:
+                    conn, idle_since = None, None
+                    break
+                remaining = self.timeout / 1000.0 - (time() - start)
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolError(
+                        'No connection available in %s ms' % self.timeout
+                    )
+                waited = True
+                self._condition.wait(remaining)
+            # Take the slot before connecting or checking outside the lock
+            self._used += 1
+
+        try:
+            if conn is not None and not self.is_healthy(conn, idle_since):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._condition:
+                self._used -= 1
+                self._condition.notify()
+            raise
+
+        wait_time = time() - start
+        with self._condition:
+            self.stats['checkouts'] += 1
+            self.stats['wait_time'] += wait_time
+            if waited:
+                self.stats['waits'] += 1
+            if wait_time > self.stats['max_wait_time']:
+                self.stats['max_wait_time'] = wait_time
+
+        connection_checkout.send(self, wait_time=wait_time)
+        return conn
+
+    def putconn(self, conn, key=None, close=False):
+        """
+        Put a connection back in the pool, or close it if `close` is True or
+        the pool is closed
+        """
+        with self._condition:
+            self._used -= 1
+            if close or self.closed or getattr(conn, 'closed', False):
+                self._close(conn)
+            else:
+                self._idle.append((conn, time()))
+            self._condition.notify()
+
+    def closeall(self):
+        """
+        Close the idle connections. The connections in use are closed when
+        they are put back.
+        """
+        with self._condition:
+            self.closed = True
+            while self._idle:
+                conn, idle_since = self._idle.pop()
+                self._close(conn)
+            self._condition.notify_all()
+
+    def is_healthy(self, conn, idle_since):
+        """
+        Returns False if the connection is closed or, when it was idle for
+        longer than the health check interval, if it fails a simple query
+        """
+        if getattr(conn, 'closed', False):
+            return False
+        if self.health_check_interval is None or \
+                (time() - idle_since) * 1000 < self.health_check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+            conn.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _connect(self):
+        conn = self.connect()
+        self.stats['connects'] += 1
+        return conn
+
+    def _close(self, conn):
+        self.stats['discards'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class DatabasePools(object):
+    """
+    Takes the place of the psycopg2 pool of a tryton database and hands out
+    the connections of the readonly pools, when there are some, to the
+    transactions started within :meth:`route` for readonly transactions.
+
+    The readonly pools, like the pools of the replicas of the database, are
+    used in turn. If a connection cannot be taken from a readonly pool, the
+    connection is taken from the primary pool. A readonly pool which failed
+    to connect is skipped for `retry_interval` milliseconds, so that the
+    requests go to the primary pool straight away while a replica is down.
+
+    :param pool: The :class:`ConnectionPool` of the database
+    :param readonly: The :class:`ConnectionPool` or the list of pools for
+                     readonly transactions
+    :param retry_interval: The time in milliseconds a readonly pool is
+                           skipped after a connection error
+    """
+
+    def __init__(self, pool, readonly=None, retry_interval=30 * 1000):
+        if readonly is None:
+            readonly = []
+        elif isinstance(readonly, ConnectionPool):
+            readonly = [readonly]
+        self.pool = pool
+        self.readonly_pools = readonly
+        self._readonly_cycle = itertools.cycle(readonly)
+        self._local = threading.local()
+        self._owners = {}
+        self.retry_interval = retry_interval
+
+        #: The time till which the readonly pools which failed are skipped
+        self._down_until = {}
+
+        #: The number of readonly checkouts which fell back on the primary
+        #: pool
+        self.fallbacks = 0
+
+    @contextmanager
+    def route(self, readonly):
+        """
+        The connections checked out within the block are taken from the
+        readonly pools if `readonly` is True.
+        """
+        previous = getattr(self._local, 'readonly', False)
+        self._local.readonly = readonly
+        try:
+            yield
+        finally:
+            self._local.readonly = previous
+
+    @property
+    def pools(self):
+        return [self.pool] + self.readonly_pools
+
+    def warm_up(self):
+        for pool in self.pools:
+            pool.warm_up()
+
+    def getconn(self, key=None):
+        conn = None
+        if self.readonly_pools and getattr(self._local, 'readonly', False):
+            pool = self.next_readonly_pool()
+            if pool is not None:
+                try:
+                    conn = pool.getconn(key)
+                except PoolError:
+                    pass
+                except Exception:
+                    self._down_until[pool] = \
+                        time() + self.retry_interval / 1000.0
+            if conn is None:
+                self.fallbacks += 1
+        if conn is None:
+            pool = self.pool
+            conn = pool.getconn(key)
+        self._owners[id(conn)] = pool
+        return conn
+
+    def next_readonly_pool(self):
+        """
+        Returns the next readonly pool which is not skipped after a failure,
+        or None if they all are
+        """
+        now = time()
+        for i in xrange(len(self.readonly_pools)):
+            pool = next(self._readonly_cycle)
+            if self._down_until.get(pool, 0) <= now:
+                return pool
+
+    def putconn(self, conn, key=None, close=False):
+        pool = self._owners.pop(id(conn), self.pool)
+        pool.putconn(conn, key, close)
+
+    def closeall(self):
+        for pool in self.pools:
+            pool.closeall()
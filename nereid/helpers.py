@@ -9,6 +9,7 @@ from zlib import adler32
 import re
 import warnings
 import unicodedata
+from copy import copy
 from functools import wraps
 from hashlib import md5
 
@@ -17,9 +18,12 @@ from trytond.transaction import Transaction
 from trytond.config import config
 from speaklater import is_lazy_string
 from flask.helpers import (_PackageBoundObject, locked_cached_property,  # noqa
-        get_flashed_messages, flash as _flash, url_for as flask_url_for)
+        get_flashed_messages, flash as _flash)
 from werkzeug import Headers, wrap_file, redirect, abort
 from werkzeug.exceptions import NotFound
+from werkzeug.routing import BuildError
+from werkzeug.urls import url_quote
+from werkzeug._internal import _missing
 from flask.ext.login import login_required      # noqa
 
 from .globals import current_app, request
@@ -29,6 +33,115 @@ _SLUGIFY_STRIP_RE = re.compile(r'[^\w\s-]')
 _SLUGIFY_HYPHENATE_RE = re.compile(r'[-\s]+')
 
 
+class URLBuilder(object):
+    """
+    Builds the URLs for a request. The builder is created once per request
+    (see :attr:`nereid.wrappers.Request.url_builder`) and keeps the URL
+    adapter bound to the request and the code of the locale of the request,
+    so that building a URL costs little more than the build of the adapter.
+
+    The builder is called like :func:`url_for`, which uses the builder of
+    the current request, and is available as `url_for` in the templates
+    rendered for a request::
+
+        request.url_builder('nereid.website.home', locale='en_US')
+
+    Unlike :func:`flask.url_for`, the `_scheme` argument changes the scheme
+    of the URL being built and not the scheme of the adapter.
+
+    .. versionadded:: 3.4.1.1
+    """
+
+    def __init__(self, req, app, url_adapter):
+        self.request = req
+        self.app = app
+        self.url_adapter = url_adapter
+        self.blueprint = req.blueprint
+        self._locale = _missing
+
+    @property
+    def locale(self):
+        """
+        The code of the locale added to the URLs, None if the website has no
+        locales. It is looked up on the first URL built.
+        """
+        if self._locale is _missing:
+            self._locale = None
+            if self.request.nereid_website.locales:
+                self._locale = self.request.nereid_locale.code
+        return self._locale
+
+    def __call__(self, endpoint, **values):
+        if '_secure' in values and '_scheme' not in values:
+            warnings.warn(
+                "_secure argument will be deprecated in favor of _scheme",
+                DeprecationWarning, stacklevel=3
+            )
+            values['_external'] = True
+            values['_scheme'] = 'https'
+            values.pop('_secure')
+
+        if 'language' in values:
+            warnings.warn(
+                "language argument is deprecated in favor of locale",
+                DeprecationWarning, stacklevel=3
+            )
+
+        if 'locale' not in values:
+            locale = self.locale
+            if locale is not None:
+                values['locale'] = locale
+
+        if endpoint[:1] == '.':
+            if self.blueprint is not None:
+                endpoint = self.blueprint + endpoint
+            else:
+                endpoint = endpoint[1:]
+
+        external = values.pop('_external', False)
+        anchor = values.pop('_anchor', None)
+        method = values.pop('_method', None)
+        scheme = values.pop('_scheme', None)
+        self.app.inject_url_defaults(endpoint, values)
+
+        url_adapter = self.url_adapter
+        if scheme is not None:
+            if not external:
+                raise ValueError(
+                    'When specifying _scheme, _external must be True'
+                )
+            url_adapter = copy(url_adapter)
+            url_adapter.url_scheme = scheme
+
+        try:
+            rv = url_adapter.build(
+                endpoint, values, method=method, force_external=external
+            )
+        except BuildError as error:
+            # The values are injected again so that the handlers of the
+            # application can deal with them.
+            values['_external'] = external
+            values['_anchor'] = anchor
+            values['_method'] = method
+            return self.app.handle_url_build_error(error, endpoint, values)
+
+        if anchor is not None:
+            rv += '#' + url_quote(anchor)
+        return rv
+
+    def many(self, endpoint, values_list, **options):
+        """
+        Returns the URLs of the endpoint for each of the dictionaries of
+        values in `values_list`. See :func:`url_for_many`.
+        """
+        urls = []
+        for values in values_list:
+            kwargs = options.copy()
+            kwargs.update(values)
+            urls.append(self(endpoint, **kwargs))
+        return urls
+
+
 def url_for(endpoint, **values):
     """
     Generates a URL to the given endpoint with the method provided.
@@ -44,26 +157,30 @@ def url_for(endpoint, **values):
 
         url_for('nereid.website.home', locale='en-us')
 
+    The URL is built by the :class:`URLBuilder` of the current request.
     """
-    if '_secure' in values and '_scheme' not in values:
-        warnings.warn(
-            "_secure argument will be deprecated in favor of _scheme",
-            DeprecationWarning, stacklevel=2
-        )
-        values['_external'] = True
-        values['_scheme'] = 'https'
-        values.pop('_secure')
-
-    if 'language' in values:
-        warnings.warn(
-            "language argument is deprecated in favor of locale",
-            DeprecationWarning, stacklevel=2
-        )
+    return request.url_builder(endpoint, **values)
 
-    if 'locale' not in values and request.nereid_website.locales:
-        values['locale'] = request.nereid_locale.code
 
-    return flask_url_for(endpoint, **values)
+def url_for_many(endpoint, values_list, **options):
+    """
+    Generates a URL to the given endpoint for each of the dictionaries of
+    values in `values_list`. The `options` are common to all the URLs and
+    the builder of the request is looked up only once, which makes this
+    faster than calling :func:`url_for` in a loop for product listings or
+    sitemaps.
+
+    For example::
+
+        url_for_many(
+            'product.product.render',
+            [{'uri': product.uri} for product in products],
+            _external=True
+        )
+
+    .. versionadded:: 3.4.1.1
+    """
+    return request.url_builder.many(endpoint, values_list, **options)
 
 
 def secure(function):
@@ -359,11 +476,13 @@ def make_crumbs(browse_record, endpoint, add_home=True, max_depth=10,
     if root_ids is None:
         root_ids = tuple()
 
+    build_url = request.url_builder
+
     def recurse(node, level=1):
         if level > max_depth or not node:
             return []
         data_pair = (
-            url_for(endpoint, uri=getattr(node, field_map['uri_field'])),
+            build_url(endpoint, uri=getattr(node, field_map['uri_field'])),
             getattr(node, field_map['title_field'])
         )
         if node.id in root_ids:
@@ -376,7 +495,7 @@ def make_crumbs(browse_record, endpoint, add_home=True, max_depth=10,
     items = recurse(browse_record)
 
     if add_home:
-        items.append((url_for('nereid.website.home'), 'Home'))
+        items.append((build_url('nereid.website.home'), 'Home'))
 
     # The bread crumb is now in reverse order with home at end, reverse it
     items.reverse()
@@ -450,6 +569,10 @@ def route(rule, **options):
                 ...
                 return 'Product Information'
 
+    The page of a route with a `cache_timeout` (in seconds) is kept in the
+    page cache for anonymous visitors when `PAGE_CACHE_ENABLED` is set (see
+    :mod:`nereid.pagecache`).
+
     """
     def decorator(f):
         if not hasattr(f, '_url_rules'):
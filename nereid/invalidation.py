@@ -0,0 +1,296 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Strategies to synchronise the Tryton caches of a worker with the
+    invalidations recorded by other workers in the `ir_cache` table.
+"""
+import os
+import errno
+import socket
+import tempfile
+import threading
+from time import time, sleep
+
+from sql import Table
+from sql.functions import Now
+from trytond.cache import Cache, LRUDict
+from trytond.transaction import Transaction
+
+__all__ = [
+    'CacheSync', 'ThrottledCacheSync', 'ThreadedCacheSync',
+    'UnixSocketChannel', 'PubSubCacheSync',
+]
+
+
+class CacheSync(object):
+    """
+    Synchronises the caches on every request. This is the default behavior
+    of nereid, which runs `Cache.clean` before the dispatch of each request.
+
+    The invalidations made by this worker (`Cache.resets`) are pushed to the
+    database only when there are some pending.
+
+    :param app: The nereid application
+    :param interval: The interval in milliseconds. Unused by this strategy.
+                     The :attr:`default_interval` is used if it is None.
+    """
+
+    #: The interval used when the application does not set one
+    default_interval = None
+
+    def __init__(self, app, interval=None):
+        self.app = app
+        if interval is None:
+            interval = self.default_interval
+        self.interval = interval
+        self.last_clean = None
+
+    @property
+    def database_name(self):
+        return self.app.database_name
+
+    def clean_due(self):
+        """
+        Returns True if the local caches should be checked against the
+        invalidations made by other workers.
+        """
+        return True
+
+    def resets_due(self):
+        """
+        Returns True if this worker has invalidations to publish.
+        """
+        return bool(Cache._resets.get(self.database_name))
+
+    def is_due(self):
+        """
+        Returns True if :meth:`synchronise` has something to do. The
+        dispatcher starts a transaction for the synchronisation only if
+        this is True.
+        """
+        return self.clean_due() or self.resets_due()
+
+    def synchronise(self):
+        """
+        Clean the local caches and publish the pending resets. This method
+        must be called within a transaction of its own, which is committed
+        if there are resets to publish.
+        """
+        if self.clean_due():
+            self.clean()
+        if self.resets_due():
+            self.resets()
+
+    def clean(self):
+        """
+        Clear the local caches invalidated by other workers, like
+        `Cache.clean`. The `ir_cache` table is read with the cursor of the
+        current transaction instead of a new cursor, so that the
+        synchronisation never takes a second connection from the pool.
+        """
+        cursor = Transaction().cursor
+        table = Table('ir_cache')
+        cursor.execute(*table.select(table.timestamp, table.name))
+        timestamps = {}
+        for timestamp, name in cursor.fetchall():
+            timestamps[name] = timestamp
+        for inst in Cache._cache_instance:
+            if inst._name in timestamps:
+                with inst._lock:
+                    if not inst._timestamp or \
+                            timestamps[inst._name] > inst._timestamp:
+                        inst._timestamp = timestamps[inst._name]
+                        inst._cache[self.database_name] = \
+                            LRUDict(inst.size_limit)
+        self.last_clean = time()
+
+    def resets(self):
+        """
+        Record the invalidations of this worker in the `ir_cache` table and
+        commit the current transaction, like `Cache.resets` does with a new
+        cursor.
+        """
+        cursor = Transaction().cursor
+        table = Table('ir_cache')
+        with Cache._resets_lock:
+            names = Cache._resets.setdefault(self.database_name, set())
+            for name in names:
+                cursor.execute(*table.select(
+                    table.name, where=table.name == name
+                ))
+                if cursor.fetchone():
+                    cursor.execute(*table.update(
+                        [table.timestamp], [Now()], where=table.name == name
+                    ))
+                else:
+                    cursor.execute(*table.insert(
+                        [table.timestamp, table.name], [[Now(), name]]
+                    ))
+            names.clear()
+        cursor.commit()
+
+
+class ThrottledCacheSync(CacheSync):
+    """
+    Cleans the caches at most once every `interval` milliseconds in each
+    worker. The staleness of the caches is bounded by the interval.
+    """
+
+    default_interval = 1000
+
+    def clean_due(self):
+        return self.last_clean is None or \
+            (time() - self.last_clean) * 1000 >= self.interval
+
+
+class ThreadedCacheSync(CacheSync):
+    """
+    Cleans the caches every `interval` milliseconds from a background
+    thread, taking the `ir_cache` query off the requests completely.
+
+    The thread is started lazily on the first request, so that it is
+    started in the worker process and not in a parent which forks.
+    """
+
+    default_interval = 1000
+
+    def __init__(self, app, interval=None):
+        super(ThreadedCacheSync, self).__init__(app, interval)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def clean_due(self):
+        self.start()
+        return False
+
+    def start(self):
+        """
+        Start the background thread if it is not running in this process
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(
+                target=self.run, name='nereid-cache-sync'
+            )
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def run(self):
+        while True:
+            sleep(self.interval / 1000.0)
+            try:
+                with Transaction().start(self.database_name, 0):
+                    self.clean()
+            except Exception:
+                self.app.logger.exception('Cache synchronisation failed')
+
+
+class UnixSocketChannel(object):
+    """
+    A local publish/subscribe channel made of unix datagram sockets in a
+    directory. Every subscribed process binds a socket in the directory and
+    a message is published by sending it to all the sockets there.
+
+    :param path: The directory where the sockets are created
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.socket = None
+
+    def subscribe(self):
+        """
+        Bind the socket of this process and return it
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        name = os.path.join(self.path, '%d.sock' % os.getpid())
+        if os.path.exists(name):
+            os.unlink(name)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(name)
+        return self.socket
+
+    def receive(self):
+        """
+        Block till a message is received and return it
+        """
+        return self.socket.recv(65535)
+
+    def publish(self, message):
+        """
+        Send the message to all the other subscribers
+        """
+        if not os.path.isdir(self.path):
+            return
+        own = '%d.sock' % os.getpid()
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            for name in os.listdir(self.path):
+                if name == own or not name.endswith('.sock'):
+                    continue
+                try:
+                    sender.sendto(message, os.path.join(self.path, name))
+                except socket.error as exc:
+                    if exc.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                        # The subscriber is dead, remove its socket
+                        try:
+                            os.unlink(os.path.join(self.path, name))
+                        except OSError:
+                            pass
+        finally:
+            sender.close()
+
+
+class PubSubCacheSync(ThreadedCacheSync):
+    """
+    Cleans the caches only when another worker has announced invalidations
+    on a local channel, or when `interval` milliseconds have passed since
+    the last clean. The interval bounds the staleness for invalidations made
+    by processes which do not publish on the channel, like the Tryton server.
+
+    :param channel: The directory of the :class:`UnixSocketChannel` or an
+                    object with the same API.
+    """
+
+    default_interval = 60 * 1000
+
+    def __init__(self, app, interval=None, channel=None):
+        super(PubSubCacheSync, self).__init__(app, interval)
+        if channel is None:
+            channel = os.path.join(
+                tempfile.gettempdir(), 'nereid-%s' % app.database_name
+            )
+        if isinstance(channel, basestring):
+            channel = UnixSocketChannel(channel)
+        self.channel = channel
+        self._invalidated = threading.Event()
+
+    def clean_due(self):
+        self.start()
+        return self._invalidated.is_set() or self.last_clean is None or \
+            (time() - self.last_clean) * 1000 >= self.interval
+
+    def clean(self):
+        self._invalidated.clear()
+        super(PubSubCacheSync, self).clean()
+
+    def resets(self):
+        names = set(Cache._resets.get(self.database_name, []))
+        super(PubSubCacheSync, self).resets()
+        if names:
+            self.channel.publish(','.join(sorted(names)))
+
+    def run(self):
+        self.channel.subscribe()
+        while True:
+            try:
+                self.channel.receive()
+            except Exception:
+                self.app.logger.exception('Cache channel failed')
+                sleep(self.interval / 1000.0)
+            self._invalidated.set()
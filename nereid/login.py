@@ -0,0 +1,25 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+from flask.globals import session
+from flask.ext.login import LoginManager
+
+from .sessions import LazySession
+
+__all__ = ['NereidLoginManager']
+
+
+class NereidLoginManager(LoginManager):
+    """
+    The login manager of nereid, which does not load the lazy sessions
+    which were not used by the request.
+    """
+
+    def _update_remember_cookie(self, response):
+        # The remember operation is set and removed from the session in
+        # the same request, so a session which was not used has none
+        sess = session._get_current_object()
+        if isinstance(sess, LazySession) and not sess.loaded:
+            return response
+        return super(NereidLoginManager, self)._update_remember_cookie(
+            response
+        )
@@ -0,0 +1,115 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Memoization of the calls within a request.
+
+    The results of the functions decorated with :func:`request_memoize` are
+    kept on the request, in the :class:`RequestMemo` of `request.memo`, so
+    that the helpers called again and again while rendering a page, like
+    the permissions of the user, hit neither the cache backend nor the
+    database twice.
+
+    The results live until the transaction of the dispatcher stops or until
+    the end of the request. Outside of a request the functions are called
+    as they are.
+"""
+import copy as copy_module
+from functools import wraps
+
+from werkzeug._internal import _missing
+from flask.ctx import has_request_context
+from flask.globals import _request_ctx_stack
+from trytond.transaction import Transaction
+
+from .cachekeys import KeyBuilder
+
+__all__ = ['RequestMemo', 'request_memoize']
+
+#: The lifetimes of the memoized results
+LIFETIMES = ('transaction', 'request')
+
+
+class RequestMemo(object):
+    """
+    The results memoized during a request, per lifetime.
+    """
+
+    def __init__(self):
+        self.stores = dict((lifetime, {}) for lifetime in LIFETIMES)
+
+        #: The number of calls served from and missing from the memo
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def __len__(self):
+        return sum(map(len, self.stores.itervalues()))
+
+    def clear(self, lifetime=None):
+        """
+        Forget the results of the lifetime, or all the results if lifetime
+        is None
+        """
+        for name, store in self.stores.iteritems():
+            if lifetime is None or name == lifetime:
+                store.clear()
+
+
+def request_memoize(key=None, lifetime='transaction', key_func=None,
+                    copy=False):
+    """
+    Decorator to memoize a function for the current request.
+
+    .. code-block:: python
+
+        @request_memoize()
+        def get_permissions(self):
+            ...
+
+    The keys are built like the keys of :meth:`nereid.caching.Cache.memoize`
+    with the language of the context, so a record is a part of the key by
+    its model and id. The same result is returned to all the callers of the
+    request, which must not change it, unless `copy` is True.
+
+    :param key: The prefix of the keys, the module and name of the function
+                by default
+    :param lifetime: `transaction` to forget the results when the
+                     transaction of the dispatcher stops, which is right for
+                     the results read from the database, or `request` to
+                     keep them until the end of the request
+    :param key_func: Callable which is given the arguments of the call and
+                     returns the value, or tuple of values, the key is built
+                     from instead of the arguments
+    :param copy: If True, each caller gets a shallow copy of the result,
+                 for the results like dictionaries which the callers, or
+                 the overrides of the method, may change
+    """
+    if lifetime not in LIFETIMES:
+        raise ValueError('Unknown lifetime %r' % (lifetime, ))
+
+    def decorator(function):
+        make_key = KeyBuilder(
+            key or '%s.%s' % (function.__module__, function.__name__),
+            function, key_func=key_func
+        )
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not has_request_context():
+                return function(*args, **kwargs)
+            memo = getattr(_request_ctx_stack.top.request, 'memo', None)
+            if memo is None:
+                return function(*args, **kwargs)
+
+            store = memo.stores[lifetime]
+            context = Transaction().context or {}
+            cache_key = (context.get('language'), make_key(args, kwargs))
+            rv = store.get(cache_key, _missing)
+            if rv is _missing:
+                memo.stats['misses'] += 1
+                rv = store[cache_key] = function(*args, **kwargs)
+            else:
+                memo.stats['hits'] += 1
+            if copy:
+                return copy_module.copy(rv)
+            return rv
+        return wrapper
+    return decorator
@@ -0,0 +1,204 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    A cache of the pages rendered for anonymous visitors, kept in the cache
+    of the application (`app.cache`).
+
+    Only the routes which opt in with a `cache_timeout` are cached:
+
+    .. code-block:: python
+
+        @classmethod
+        @route('/products', cache_timeout=60)
+        def render_list(cls):
+            ...
+
+    A cached page is served without starting a transaction. When it
+    expires, it is served for `PAGE_CACHE_STALE_TIMEOUT` more seconds to the
+    other visitors while a single request renders it again.
+
+    The pages are also discarded when one of their tags is invalidated (see
+    :mod:`nereid.cachetags`). The views add the tags of the records they
+    show to `request.cache_tags`, the record of the views of instance
+    methods is added by the dispatcher. The version of a tag is taken when
+    it is added, so a record should be tagged before it is read.
+"""
+import hashlib
+from time import time
+
+from flask.globals import session
+
+__all__ = ['PageCache']
+
+
+class PageCache(object):
+    """
+    The page cache of a nereid application.
+
+    The pages of GET and HEAD requests are cached when the session holds no
+    data (like a logged in user, flashed messages or a CSRF token) and the
+    request has no credentials. A page is stored only if the view did not
+    put anything in the session, the status is 200 and the response does
+    not set cookies or forbid caching.
+
+    The key of a page is made of the host (and so the website), the locale,
+    the path, the query string and the request headers listed in
+    `PAGE_CACHE_VARY_HEADERS`.
+
+    :param app: The nereid application
+    """
+
+    #: The keys of the session which do not prevent caching. The identifier
+    #: is set by flask-login in every session the current user is looked up
+    #: from.
+    ignored_session_keys = frozenset(['_id'])
+
+    def __init__(self, app):
+        self.app = app
+
+        #: Counters of the cache. Stale pages served while another request
+        #: renders the page are counted in `stale`.
+        self.stats = {
+            'hits': 0, 'stale': 0, 'misses': 0, 'stores': 0, 'bypasses': 0,
+        }
+
+    @property
+    def cache(self):
+        return self.app.cache
+
+    def get_timeout(self, req):
+        """
+        Returns the number of seconds for which the page of the request may
+        be cached or None if it must not be cached
+        """
+        if not self.app.page_cache_enabled:
+            return None
+        timeout = getattr(req.url_rule, 'cache_timeout', None)
+        if not timeout or req.method not in ('GET', 'HEAD'):
+            return None
+        if not self.is_anonymous(req):
+            self.stats['bypasses'] += 1
+            return None
+        return timeout
+
+    def is_anonymous(self, req):
+        """
+        Returns True if the request has no credentials and its session holds
+        no data
+        """
+        if self.get_session_keys():
+            return False
+        if self.app.config.get('AUTH_HEADER_NAME', 'Authorization') in \
+                req.headers:
+            return False
+        cookie_name = self.app.config.get(
+            'REMEMBER_COOKIE_NAME', 'remember_token'
+        )
+        return cookie_name not in req.cookies
+
+    def get_session_keys(self):
+        return set(session.keys()) - self.ignored_session_keys
+
+    def get_key(self, req):
+        """
+        Returns the key of the page of the request in the cache
+        """
+        parts = [
+            req.host,
+            ((req.view_args or {}).get('locale') or '').encode('utf-8'),
+            req.path.encode('utf-8'),
+            req.query_string,
+        ]
+        for header in self.app.page_cache_vary_headers:
+            parts.append(req.headers.get(header, '').encode('utf-8'))
+        return '%spage-%s' % (
+            self.app.cache_key_prefix,
+            hashlib.md5('\n'.join(parts)).hexdigest()
+        )
+
+    def dispatch(self, req, timeout, dispatch):
+        """
+        Returns the cached page of the request or the response returned by
+        `dispatch`, which is cached for `timeout` seconds if it can be.
+
+        :param req: The request
+        :param timeout: The number of seconds for which the page is fresh
+        :param dispatch: A callable which returns the return value of the
+                         view
+        """
+        key = self.get_key(req)
+        lock_key = key + '-lock'
+        stale_timeout = self.app.page_cache_stale_timeout
+
+        entry = self.cache.get(key)
+        if entry is not None and \
+                not self.app.cache_tags.is_current(entry[4]):
+            # A record shown by the page changed
+            entry = None
+        if entry is not None:
+            expires = entry[0]
+            if expires > time():
+                self.stats['hits'] += 1
+                return self.make_response(entry, 'HIT')
+            # A lock without a timeout would never expire on memcached
+            if not self.cache.add(lock_key, True, max(stale_timeout, 1)):
+                # Another request is rendering the page
+                self.stats['stale'] += 1
+                return self.make_response(entry, 'STALE')
+
+        self.stats['misses'] += 1
+        # Take the versions of the tags as they are added by the view
+        req.cache_tags.track(self.app.cache_tags)
+        try:
+            response = self.app.make_response(dispatch())
+            if self.is_cacheable(response):
+                self.store(req, key, response, timeout, stale_timeout)
+        finally:
+            if entry is not None:
+                self.cache.delete(lock_key)
+        self.add_headers(response, 'MISS')
+        return response
+
+    def is_cacheable(self, response):
+        """
+        Returns True if the response of the view can be cached
+        """
+        if response.status_code != 200 or response.is_streamed or \
+                response.direct_passthrough:
+            return False
+        if 'Set-Cookie' in response.headers:
+            return False
+        if response.cache_control.private or \
+                response.cache_control.no_store or \
+                response.cache_control.no_cache:
+            return False
+        # The view put something in the session, like a flashed message
+        return not self.get_session_keys()
+
+    def store(self, req, key, response, timeout, stale_timeout):
+        """
+        Store the response to the request in the cache. The entry is kept
+        for the stale timeout after it expires.
+        """
+        entry = (
+            time() + timeout,
+            response.status_code,
+            list(response.headers),
+            response.get_data(),
+            req.cache_tags.get_versions(),
+        )
+        self.cache.set(key, entry, timeout + stale_timeout)
+        self.stats['stores'] += 1
+
+    def make_response(self, entry, state):
+        expires, status, headers, data, versions = entry
+        response = self.app.response_class(data, status, headers)
+        self.add_headers(response, state)
+        return response
+
+    def add_headers(self, response, state):
+        for header in self.app.page_cache_vary_headers:
+            response.vary.add(header)
+        header = self.app.page_cache_header
+        if header:
+            response.headers[header] = state
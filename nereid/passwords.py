@@ -0,0 +1,290 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Hashing of the passwords of the users.
+
+    The hashers are registered by name and the hasher of the new passwords
+    is selected with the `PASSWORD_HASHER` of the application::
+
+        PASSWORD_HASHER = 'pbkdf2_sha256'
+
+    The passwords are stored as `<name>$<parameters>$<salt>$<hash>`, so the
+    passwords hashed with another hasher, or with weaker parameters, are
+    still verified and are hashed again when the user logs in. The salted
+    sha1 hashes of the previous versions of nereid are verified by the
+    `sha1` hasher.
+
+    The strong hashers take tens of milliseconds of CPU, so the passwords
+    are verified by a bounded pool of `PASSWORD_POOL_SIZE` threads (or
+    processes if `PASSWORD_POOL_TYPE` is `process`), which keeps a burst of
+    logins from starving the threads rendering the pages.
+"""
+import os
+import hmac
+import base64
+import hashlib
+import threading
+from multiprocessing.pool import Pool, ThreadPool
+
+from flask.ctx import has_app_context
+from flask.globals import current_app
+
+__all__ = [
+    'PasswordHasher', 'SHA1Hasher', 'PBKDF2Hasher', 'ScryptHasher',
+    'register_hasher', 'get_hasher', 'identify_hasher', 'make_password',
+    'check_password', 'VerificationPool',
+]
+
+#: The hasher of the new passwords outside of an application, like the
+#: passwords set from the tryton client
+DEFAULT_HASHER = 'pbkdf2_sha256'
+
+#: The registered hashers by name
+hashers = {}
+
+
+def _salt(size=12):
+    return base64.b64encode(os.urandom(size), './')
+
+
+def _compare(a, b):
+    if hasattr(hmac, 'compare_digest'):
+        return hmac.compare_digest(a, b)
+    return a == b
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class PasswordHasher(object):
+    """
+    The base class of the password hashers.
+
+    :param name: The name of the hasher, which prefixes its hashes
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def encode(self, password, salt=None):
+        """
+        Returns the hash of the password
+        """
+        raise NotImplementedError
+
+    def verify(self, password, encoded):
+        """
+        Returns True if the hash is the hash of the password
+        """
+        salt = encoded.split('$')[-2]
+        return _compare(
+            _to_bytes(self.encode(password, salt)), _to_bytes(encoded)
+        )
+
+    def needs_rehash(self, encoded):
+        """
+        Returns True if the hash was made with other parameters than those
+        of this hasher
+        """
+        return False
+
+
+class SHA1Hasher(PasswordHasher):
+    """
+    The salted sha1 of the previous versions of nereid, which is only
+    there to verify the existing passwords.
+    """
+
+    def __init__(self, name='sha1'):
+        super(SHA1Hasher, self).__init__(name)
+
+    def encode(self, password, salt=None):
+        if salt is None:
+            salt = _salt(6)[:8]
+        digest = hashlib.sha1(_to_bytes(password) + _to_bytes(salt))
+        return '%s$%s$%s' % (self.name, salt, digest.hexdigest())
+
+
+class PBKDF2Hasher(PasswordHasher):
+    """
+    PBKDF2 with HMAC, from :func:`hashlib.pbkdf2_hmac`.
+
+    :param iterations: The number of iterations
+    :param digest: The name of the digest of the HMAC
+    """
+
+    def __init__(self, name='pbkdf2_sha256', iterations=100000,
+                 digest='sha256'):
+        super(PBKDF2Hasher, self).__init__(name)
+        self.iterations = iterations
+        self.digest = digest
+
+    def encode(self, password, salt=None, iterations=None):
+        if salt is None:
+            salt = _salt()
+        iterations = iterations or self.iterations
+        digest = hashlib.pbkdf2_hmac(
+            self.digest, _to_bytes(password), _to_bytes(salt), iterations
+        )
+        return '%s$%d$%s$%s' % (
+            self.name, iterations, salt, base64.b64encode(digest)
+        )
+
+    def verify(self, password, encoded):
+        name, iterations, salt, digest = encoded.split('$')
+        return _compare(
+            _to_bytes(self.encode(password, salt, int(iterations))),
+            _to_bytes(encoded)
+        )
+
+    def needs_rehash(self, encoded):
+        return int(encoded.split('$')[1]) != self.iterations
+
+
+class ScryptHasher(PasswordHasher):
+    """
+    scrypt, from :func:`hashlib.scrypt`, which is only available with
+    python 3.6 and OpenSSL 1.1. The hasher is not registered otherwise.
+
+    :param n: The CPU and memory cost
+    :param r: The block size
+    :param p: The parallelization
+    """
+
+    def __init__(self, name='scrypt', n=2 ** 14, r=8, p=1):
+        super(ScryptHasher, self).__init__(name)
+        self.n, self.r, self.p = n, r, p
+
+    def encode(self, password, salt=None, params=None):
+        if salt is None:
+            salt = _salt()
+        n, r, p = params or (self.n, self.r, self.p)
+        digest = hashlib.scrypt(
+            _to_bytes(password), salt=_to_bytes(salt), n=n, r=r, p=p,
+            maxmem=256 * n * r + 1024 * 1024,
+        )
+        return '%s$%d,%d,%d$%s$%s' % (
+            self.name, n, r, p, salt, base64.b64encode(digest)
+        )
+
+    def verify(self, password, encoded):
+        name, params, salt, digest = encoded.split('$')
+        params = tuple(map(int, params.split(',')))
+        return _compare(
+            _to_bytes(self.encode(password, salt, params)),
+            _to_bytes(encoded)
+        )
+
+    def needs_rehash(self, encoded):
+        return encoded.split('$')[1] != '%d,%d,%d' % (self.n, self.r, self.p)
+
+
+def register_hasher(hasher):
+    """
+    Register a hasher under its name, replacing the hasher of the same name
+    """
+    hashers[hasher.name] = hasher
+    return hasher
+
+
+register_hasher(SHA1Hasher())
+register_hasher(PBKDF2Hasher())
+register_hasher(PBKDF2Hasher('pbkdf2_sha512', digest='sha512'))
+if hasattr(hashlib, 'scrypt'):
+    register_hasher(ScryptHasher())
+
+
+def get_hasher(name=None):
+    """
+    Returns the hasher of the name or the hasher of the new passwords, the
+    `PASSWORD_HASHER` of the current application or the
+    :data:`DEFAULT_HASHER`
+    """
+    if name is None:
+        name = DEFAULT_HASHER
+        if has_app_context():
+            name = current_app.config.get('PASSWORD_HASHER') or name
+    try:
+        return hashers[name]
+    except KeyError:
+        raise ValueError('Unknown password hasher %r' % (name, ))
+
+
+def identify_hasher(encoded):
+    """
+    Returns the hasher of the hash
+    """
+    return get_hasher(encoded.split('$', 1)[0])
+
+
+def make_password(password):
+    """
+    Returns the hash of the password with the hasher of the new passwords
+    """
+    return get_hasher().encode(password)
+
+
+def _verify(password, encoded):
+    return identify_hasher(encoded).verify(password, encoded)
+
+
+def check_password(password, encoded, pool=None):
+    """
+    Returns a tuple of True if the hash is the hash of the password, and of
+    True if the password should be hashed again with the hasher of the new
+    passwords.
+
+    :param pool: The :class:`VerificationPool` which verifies the password
+                 or None to verify it in the calling thread
+    """
+    if not password or not encoded:
+        return False, False
+    hasher = identify_hasher(encoded)
+    if pool is None:
+        valid = hasher.verify(password, encoded)
+    else:
+        valid = pool.apply(_verify, (password, encoded))
+    if not valid:
+        return False, False
+    new_hasher = get_hasher()
+    return True, (
+        new_hasher is not hasher or new_hasher.needs_rehash(encoded)
+    )
+
+
+class VerificationPool(object):
+    """
+    A bounded pool of threads or processes verifying the passwords. The
+    pool is made by each process the first time it is used.
+
+    :param size: The number of threads or processes
+    :param type: `thread` or `process`
+    """
+
+    def __init__(self, size=2, type='thread'):
+        if type not in ('thread', 'process'):
+            raise ValueError('Unknown pool type %r' % (type, ))
+        self.size = size
+        self.type = type
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    PoolClass = ThreadPool if self.type == 'thread' else Pool
+                    self._pool = PoolClass(self.size)
+                    self._pid = os.getpid()
+        return self._pool
+
+    def apply(self, function, args):
+        """
+        Returns the result of the function called in the pool, waiting
+        until a thread or process of the pool is free
+        """
+        return self.get_pool().apply(function, args)
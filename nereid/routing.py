@@ -8,14 +8,59 @@
 
     Also see: https://github.com/mitsuhiko/werkzeug/issues/488
 
+    The map also remembers the rule which built the URL for an endpoint,
+    the names of the values and the method, so that templates which build
+    hundreds of URLs do not have to scan the rules of the endpoint each time.
+
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
 from werkzeug import routing
+from werkzeug.urls import url_encode, url_quote
+from werkzeug.datastructures import MultiDict
+from werkzeug._compat import to_bytes
 from nereid import request
 
 
 class Map(routing.Map):
+
+    #: The maximum number of entries in the build cache. The cache is
+    #: cleared when it grows beyond the limit.
+    build_cache_size = 1024
+
+    def __init__(self, *args, **kwargs):
+        self._build_cache = {}
+        self.build_cache_stats = {'hits': 0, 'misses': 0}
+        super(Map, self).__init__(*args, **kwargs)
+
+    def add(self, rulefactory):
+        super(Map, self).add(rulefactory)
+        self._build_cache.clear()
+
+    def bind(self, *args, **kwargs):
+        return self._adapter(super(Map, self).bind(*args, **kwargs))
+
+    def bind_to_environ(self, *args, **kwargs):
+        return self._adapter(
+            super(Map, self).bind_to_environ(*args, **kwargs)
+        )
+
+    def _adapter(self, adapter):
+        """
+        Returns a :class:`MapAdapter` which uses the build cache of the map
+        in place of the werkzeug adapter returned by the bind methods.
+
+        :internal:
+        """
+        return MapAdapter(
+            self, adapter.server_name, adapter.script_name, adapter.subdomain,
+            adapter.url_scheme, adapter.path_info, adapter.default_method,
+            adapter.query_args
+        )
+
+
+class MapAdapter(routing.MapAdapter):
+
     def _partial_build(self, endpoint, values, method, append_unknown):
         """Helper for :meth:`build`.  Returns subdomain and path for the
         rule that accepts this endpoint, values and method.
@@ -31,13 +76,70 @@ class Map(routing.Map):
 
         host = self.map.host_matching and self.server_name or self.subdomain
 
+        build_cache = self.map._build_cache
+        key = (endpoint, frozenset(values), method, host)
+        try:
+            rule = build_cache[key]
+        except KeyError:
+            self.map.build_cache_stats['misses'] += 1
+        else:
+            self.map.build_cache_stats['hits'] += 1
+            if rule is None:
+                # No rule is suitable for these values
+                return
+            rv = rule.build(values, append_unknown)
+            if rv is not None:
+                return rv
+
+        rule, rv = self._build_with_rules(
+            endpoint, values, method, host, append_unknown
+        )
+        if rule is not False:
+            if len(build_cache) >= self.map.build_cache_size:
+                build_cache.clear()
+            build_cache[key] = rule
+        return rv
+
+    def _build_with_rules(self, endpoint, values, method, host,
+                          append_unknown):
+        """
+        Returns the rule which built the URL and the result of the build.
+
+        The rule is `None` if no rule is suitable for the values and `False`
+        if the result cannot be cached for other values with the same names:
+        the suitability of a rule with defaults depends on the values and a
+        rule which failed to build may succeed with other values.
+
+        :internal:
+        """
+        rules = self.map._rules_by_endpoint.get(endpoint, ())
+        cacheable = not any(rule.defaults for rule in rules)
+
         # default method did not match or a specific method is passed,
         # check all and go with first result.
-        for rule in self.map._rules_by_endpoint.get(endpoint, ()):
-            if rule.suitable_for(values, method, host):
+        for rule in rules:
+            if not self._host_suitable(rule, host):
+                continue
+            if rule.suitable_for(values, method):
                 rv = rule.build(values, append_unknown)
                 if rv is not None:
-                    return rv
+                    return (cacheable and rule), rv
+                cacheable = False
+        return (None if cacheable else False), None
+
+    def _host_suitable(self, rule, host):
+        """
+        Returns False if the host of the rule cannot build URLs for the host
+        the adapter is bound to.
+
+        :internal:
+        """
+        if not self.map.host_matching or not rule.host:
+            return True
+        if '<' in rule.host:
+            # Hosts with variables are built from the values
+            return True
+        return rule.host == host
 
 
 class Rule(routing.Rule):
@@ -45,8 +147,56 @@ class Rule(routing.Rule):
     def __init__(self, *args, **kwargs):
         self.readonly = kwargs.pop('readonly', None)
         self.is_csrf_exempt = kwargs.pop('exempt_csrf', False)
+        self.cache_timeout = kwargs.pop('cache_timeout', None)
         super(Rule, self).__init__(*args, **kwargs)
 
+    def compile(self):
+        """Compiles the regular expression and the trace used to build the
+        URLs, in which the static parts are quoted once.
+        """
+        super(Rule, self).compile()
+        self._build_trace = [
+            (is_dynamic, data if is_dynamic else url_quote(
+                to_bytes(data, self.map.charset), safe='/:|+'
+            ))
+            for is_dynamic, data in self._trace
+        ]
+
+    def build(self, values, append_unknown=True):
+        """Assembles the relative url for that rule and the subdomain.
+        If building doesn't work for some reasons `None` is returned.
+
+        Same as :meth:`werkzeug.routing.Rule.build`, but uses the trace
+        compiled by :meth:`compile` and encodes the query string only if
+        there are unknown values.
+
+        :internal:
+        """
+        tmp = []
+        add = tmp.append
+        for is_dynamic, data in self._build_trace:
+            if is_dynamic:
+                try:
+                    add(self._converters[data].to_url(values[data]))
+                except routing.ValidationError:
+                    return
+            else:
+                add(data)
+        domain_part, url = (u''.join(tmp)).split(u'|', 1)
+
+        if append_unknown and not self.arguments.issuperset(values):
+            query_vars = MultiDict(values)
+            for key in self.arguments:
+                if key in query_vars:
+                    del query_vars[key]
+
+            if query_vars:
+                url += u'?' + url_encode(query_vars, charset=self.map.charset,
+                                        sort=self.map.sort_parameters,
+                                        key=self.map.sort_key)
+
+        return domain_part, url
+
     def empty(self):
         """Return an unbound copy of this rule.  This can be useful if you
         want to reuse an already bound URL for another map.
@@ -59,7 +209,9 @@ class Rule(routing.Rule):
         return self.__class__(
             self.rule, defaults, self.subdomain, self.methods,
             self.build_only, self.endpoint, self.strict_slashes,
-            self.redirect_to, self.alias, self.host
+            self.redirect_to, self.alias, self.host,
+            readonly=self.readonly, exempt_csrf=self.is_csrf_exempt,
+            cache_timeout=self.cache_timeout
         )
 
     @property
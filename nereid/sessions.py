@@ -1,15 +1,67 @@
 # This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+"""
+    The sessions of nereid.
+
+    The sessions are kept on the server by a :class:`NereidSessionStore`,
+    in the cache of the application by default (:class:`MemcachedSessionStore`)
+    or in a SQLite database for the deployments without a shared cache
+    (:class:`SQLiteSessionStore`, with `SESSION_STORE = 'sqlite'`).
+
+    The data of the sessions is serialized by the `SESSION_SERIALIZER`,
+    marshal by default, which is more compact and faster than pickle. The
+    sessions are written only when their data changed, whether or not the
+    session was marked as modified, and the unchanged sessions are touched
+    once per `SESSION_TOUCH_INTERVAL` so that they expire `SESSION_TIMEOUT`
+    seconds after they were last used.
+
+    The keys of the sessions are prefixed by the domain of the cookie, or
+    the host of the website, so the websites of an application do not share
+    their sessions.
+
+    The sessions of the requests with a cookie are loaded from the store
+    the first time they are used (:class:`LazySession`) and are not saved
+    if they were never used.
+
+    If `SESSION_COOKIE_MAX_SIZE` is set, the sessions are kept in a signed
+    and compressed cookie instead, without a round trip to the store, as
+    long as the cookie is not longer than this size. The larger sessions,
+    and the sessions which can only be pickled, are kept in the store.
+"""
+import os
+import time
+import calendar
+import pickle
+import marshal
+import sqlite3
+import threading
 from datetime import datetime  # noqa
 
 from flask.sessions import SessionInterface, SessionMixin
+from flask.ctx import has_request_context
 from werkzeug.contrib.sessions import Session as SessionBase, SessionStore
-from flask.globals import current_app
+from flask.globals import current_app, request
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from nereid.contrib.cache import TwoTierCache
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 class Session(SessionBase, SessionMixin):
     "Nereid Default Session Object"
 
+    #: The serialized data of the session when it was loaded, and the time
+    #: it was last written or touched, if the session was in the store
+    payload = None
+    written = None
+
+    #: True if the session was kept in a signed cookie
+    in_cookie = False
+
 
 class NullSession(Session):
     """
@@ -27,29 +79,193 @@ class NullSession(Session):
     del _fail
 
 
-class MemcachedSessionStore(SessionStore):
+class SessionSerializer(object):
+    """
+    The base class of the serializers of the data of the sessions. The
+    serialized data starts with the tag of the serializer, so the sessions
+    stay readable when the `SESSION_SERIALIZER` changes.
+    """
+    tag = None
+
+    #: The exact types of the values the serializer supports. The data is
+    #: pickled if it contains another type, even a subclass of one of these
+    #: types like `Markup`, as it would not be loaded as the same type.
+    types = ()
+
+    def is_supported(self, data):
+        """
+        Returns True if the data and all the values it contains are of one
+        of the :attr:`types`
+        """
+        kind = type(data)
+        if kind not in self.types:
+            return False
+        if kind is dict:
+            return all(
+                self.is_supported(key) and self.is_supported(value)
+                for key, value in data.iteritems()
+            )
+        if kind in (list, tuple, set, frozenset):
+            return all(self.is_supported(value) for value in data)
+        return True
+
+    def dumps(self, data):
+        raise NotImplementedError
+
+    def loads(self, payload):
+        raise NotImplementedError
+
+
+class PickleSerializer(SessionSerializer):
+    """
+    pickle, for the sessions with values which the other serializers do not
+    support
     """
-    Session store that stores session on memcached
+    tag = 'p'
+
+    def dumps(self, data):
+        return self.tag + pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, payload):
+        return pickle.loads(payload[1:])
+
+
+class MarshalSerializer(SessionSerializer):
+    """
+    marshal, which serializes the builtin types only. The sessions with
+    other values, like dates or `Markup`, are pickled.
+    """
+    tag = 'm'
+    types = (
+        dict, list, tuple, set, frozenset, str, unicode, int, long, float,
+        bool, type(None),
+    )
+
+    def dumps(self, data):
+        if not self.is_supported(data):
+            return serializers['pickle'].dumps(data)
+        try:
+            return self.tag + marshal.dumps(data, 2)
+        except ValueError:
+            return serializers['pickle'].dumps(data)
+
+    def loads(self, payload):
+        return marshal.loads(payload[1:])
+
+
+class MsgpackSerializer(SessionSerializer):
+    """
+    msgpack, if it is installed, which loads the tuples as lists. The
+    sessions with other values than the builtin types are pickled.
+    """
+    tag = 'k'
+    types = (
+        dict, list, tuple, str, unicode, int, long, float, bool, type(None),
+    )
+
+    def dumps(self, data):
+        if not self.is_supported(data):
+            return serializers['pickle'].dumps(data)
+        try:
+            return self.tag + msgpack.packb(data, use_bin_type=True)
+        except TypeError:
+            return serializers['pickle'].dumps(data)
+
+    def loads(self, payload):
+        return msgpack.unpackb(payload[1:], encoding='utf-8')
+
+
+#: The serializers of the sessions by name
+serializers = {
+    'pickle': PickleSerializer(),
+    'marshal': MarshalSerializer(),
+}
+if msgpack is not None:
+    serializers['msgpack'] = MsgpackSerializer()
+
+
+def dumps(data):
+    """
+    Returns the data serialized by the `SESSION_SERIALIZER` of the current
+    application
+    """
+    name = current_app.session_serializer
+    try:
+        serializer = serializers[name]
+    except KeyError:
+        raise ValueError('Unknown session serializer %r' % (name, ))
+    return serializer.dumps(data)
+
+
+def loads(payload):
+    """
+    Returns the data serialized by any of the serializers
+    """
+    for serializer in serializers.itervalues():
+        if payload[:1] == serializer.tag:
+            return serializer.loads(payload)
+    raise ValueError('Unknown session payload')
+
+
+class NereidSessionStore(SessionStore):
+    """
+    The base class of the stores of nereid, which keep the serialized data
+    of the sessions with the time they were written. The subclasses
+    implement :meth:`load`, :meth:`store` and :meth:`remove`, and
+    :meth:`touch_record` if they can refresh the expiry of a session
+    without writing it again.
 
     :param session_class: The session class to use.
     Defaults to :class:`Session`.
     """
+
     def __init__(self, session_class=Session):
         SessionStore.__init__(self, session_class)
 
-    def save(self, session):
+        #: The number of sessions written, touched and not written because
+        #: their data did not change, the number of sessions found and not
+        #: found in the store, the total time in seconds taken to load them
+        #: and the number of lazy sessions which were never used
+        self.stats = {
+            'writes': 0, 'touches': 0, 'skipped': 0,
+            'hits': 0, 'misses': 0, 'load_time': 0.0, 'untouched': 0,
+        }
+
+    def get_prefix(self):
         """
-        Updates the session
+        Returns the prefix of the keys of the sessions of the current
+        website, from the domain of the cookie or the host of the request
         """
-        current_app.cache.set(
-            session.sid, dict(session), 30 * 24 * 60 * 60
-        )
+        domain = current_app.config.get('SESSION_COOKIE_DOMAIN')
+        if not domain and has_request_context():
+            domain = request.host
+        return 'session-%s-' % (domain or '')
 
-    def delete(self, session):
+    def load(self, prefix, sid):
         """
-        Deletes the session
+        Returns a tuple of the serialized data of the session and the time
+        it was written, or None if the session is not in the store
         """
-        current_app.cache.delete(session.sid)
+        raise NotImplementedError
+
+    def store(self, prefix, sid, payload, written):
+        """
+        Stores the serialized data of the session
+        """
+        raise NotImplementedError
+
+    def touch_record(self, prefix, sid, payload, written):
+        """
+        Refreshes the expiry of the session, which is written again by
+        default
+        """
+        self.store(prefix, sid, payload, written)
+
+    def remove(self, prefix, sid):
+        """
+        Removes the session from the store
+        """
+        raise NotImplementedError
 
     def get(self, sid):
         """
@@ -57,16 +273,322 @@ class MemcachedSessionStore(SessionStore):
         """
         if not self.is_valid_key(sid):
             return self.new()
-        session_data = current_app.cache.get(sid)
-        if session_data is None:
-            session_data = {}
-        return self.session_class(session_data, sid, False)
+        data, payload, written = self.load_data(sid)
+        session = self.session_class(data, sid, False)
+        session.payload, session.written = payload, written
+        return session
+
+    def load_data(self, sid):
+        """
+        Returns a tuple of the data of the session, its serialized data and
+        the time it was written, which are None if the session is not in
+        the store
+        """
+        start = time.time()
+        try:
+            record = self.load(self.get_prefix(), sid)
+            if record is not None:
+                payload, written = record
+                try:
+                    data = loads(payload)
+                except Exception:
+                    # A session of another version which cannot be read
+                    pass
+                else:
+                    self.stats['hits'] += 1
+                    return data, payload, written
+            self.stats['misses'] += 1
+            return {}, None, None
+        finally:
+            self.stats['load_time'] += time.time() - start
+
+    def save(self, session):
+        """
+        Updates the session
+        """
+        self._store(session, dumps(_session_data(session)))
+
+    def _store(self, session, payload):
+        session.payload, session.written = payload, time.time()
+        self.store(self.get_prefix(), session.sid, payload, session.written)
+        self.stats['writes'] += 1
+
+    def save_if_modified(self, session):
+        """
+        Writes the session if its data changed, or touches it if it was
+        written more than `SESSION_TOUCH_INTERVAL` seconds ago. Returns True
+        if the session was written.
+        """
+        if session.payload is None:
+            if not session:
+                # There is nothing to keep
+                return False
+            self.save(session)
+            return True
+
+        payload = dumps(_session_data(session))
+        if payload != session.payload:
+            self._store(session, payload)
+            return True
+
+        if time.time() - session.written >= \
+                current_app.session_touch_interval:
+            session.written = time.time()
+            self.touch_record(
+                self.get_prefix(), session.sid, payload, session.written
+            )
+            self.stats['touches'] += 1
+        else:
+            self.stats['skipped'] += 1
+        return False
+
+    def delete(self, session):
+        """
+        Deletes the session
+        """
+        self.remove(self.get_prefix(), session.sid)
+
+    def get_timeout(self):
+        return current_app.session_timeout
+
+
+class MemcachedSessionStore(NereidSessionStore):
+    """
+    Session store that stores session on memcached, or any other cache of
+    the application
+
+    The sessions kept by the previous versions of nereid, the dictionary of
+    the data under the sid, are moved to the current format the first time
+    they are read.
+    """
+
+    @property
+    def cache(self):
+        """
+        The cache of the application, or its shared tier if it is a
+        :class:`~nereid.contrib.cache.TwoTierCache`, so that a session
+        changed by a worker, like by a logout, is seen by the others at once
+        """
+        cache = current_app.cache
+        if isinstance(cache, TwoTierCache):
+            return cache.shared
+        return cache
+
+    def get_key(self, prefix, sid):
+        return '%s%s%s' % (current_app.cache_key_prefix, prefix, sid)
+
+    def load(self, prefix, sid):
+        record, previous = self.cache.get_many(
+            self.get_key(prefix, sid), sid
+        )
+        if record is None and isinstance(previous, dict):
+            return self.migrate(prefix, sid, previous)
+        if not isinstance(record, str):
+            return None
+        written, _, payload = record.partition(':')
+        return payload, float(written)
+
+    def migrate(self, prefix, sid, data):
+        """
+        Store the data of a session of a previous version in the current
+        format and remove it from the key of the previous version
+        """
+        payload, written = dumps(data), time.time()
+        self.store(prefix, sid, payload, written)
+        self.cache.delete(sid)
+        return payload, written
+
+    def store(self, prefix, sid, payload, written):
+        self.cache.set(
+            self.get_key(prefix, sid), '%.0f:%s' % (written, payload),
+            self.get_timeout()
+        )
+
+    def remove(self, prefix, sid):
+        self.cache.delete(self.get_key(prefix, sid))
 
     def list(self):
         """
         Lists all sessions in the store
         """
-        raise Exception("Not implemented yet")
+        raise NotImplementedError(
+            'The sessions of a cache cannot be listed'
+        )
+
+
+class SQLiteSessionStore(NereidSessionStore):
+    """
+    Session store that stores the sessions in a SQLite database, for the
+    deployments without a shared cache. The workers of a host share the
+    database file.
+
+    :param path: The path of the database file
+    """
+
+    def __init__(self, path, session_class=Session):
+        super(SQLiteSessionStore, self).__init__(session_class)
+        self.path = path
+        self._local = threading.local()
+
+    def get_connection(self):
+        """
+        Returns the connection of the current thread and process
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None
+            )
+            local.connection.text_factory = str
+            local.connection.execute(
+                'CREATE TABLE IF NOT EXISTS nereid_session ('
+                'prefix TEXT NOT NULL, '
+                'sid TEXT NOT NULL, '
+                'payload BLOB NOT NULL, '
+                'written REAL NOT NULL, '
+                'expires REAL NOT NULL, '
+                'PRIMARY KEY (prefix, sid))'
+            )
+            local.connection.execute(
+                'CREATE INDEX IF NOT EXISTS nereid_session_expires '
+                'ON nereid_session (expires)'
+            )
+            local.pid = os.getpid()
+        return local.connection
+
+    def load(self, prefix, sid):
+        row = self.get_connection().execute(
+            'SELECT payload, written FROM nereid_session '
+            'WHERE prefix = ? AND sid = ? AND expires > ?',
+            (prefix, sid, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return str(row[0]), row[1]
+
+    def store(self, prefix, sid, payload, written):
+        self.get_connection().execute(
+            'INSERT OR REPLACE INTO nereid_session '
+            '(prefix, sid, payload, written, expires) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (prefix, sid, sqlite3.Binary(payload), written,
+                written + self.get_timeout())
+        )
+
+    def touch_record(self, prefix, sid, payload, written):
+        self.get_connection().execute(
+            'UPDATE nereid_session SET written = ?, expires = ? '
+            'WHERE prefix = ? AND sid = ?',
+            (written, written + self.get_timeout(), prefix, sid)
+        )
+
+    def remove(self, prefix, sid):
+        self.get_connection().execute(
+            'DELETE FROM nereid_session WHERE prefix = ? AND sid = ?',
+            (prefix, sid)
+        )
+
+    def list(self, prefix=None):
+        """
+        Lists the sids of the sessions which did not expire, of all the
+        websites or of the prefix
+        """
+        query = 'SELECT sid FROM nereid_session WHERE expires > ?'
+        params = [time.time()]
+        if prefix is not None:
+            query += ' AND prefix = ?'
+            params.append(prefix)
+        return [
+            sid for sid, in self.get_connection().execute(query, params)
+        ]
+
+    def purge(self, prefix=None, expired_only=True):
+        """
+        Deletes the expired sessions, or all the sessions if expired_only
+        is False, of all the websites or of the prefix. Returns the number
+        of sessions deleted.
+        """
+        query = 'DELETE FROM nereid_session WHERE 1 = 1'
+        params = []
+        if expired_only:
+            query += ' AND expires <= ?'
+            params.append(time.time())
+        if prefix is not None:
+            query += ' AND prefix = ?'
+            params.append(prefix)
+        return self.get_connection().execute(query, params).rowcount
+
+
+class LazySession(Session):
+    """
+    A session of a :class:`NereidSessionStore` which is loaded from the
+    store the first time it is used, so the requests which do not use the
+    session, like the static files, do not read it from the store.
+
+    The session is loaded by its methods and before it is saved by the
+    store, but not by the functions which read the dictionary directly,
+    like `dict(session)` or `json.dumps(session)`. Call :meth:`load` before
+    those.
+
+    :param store: The store of the session
+    :param sid: The id of the session
+    """
+
+    def __init__(self, store, sid):
+        Session.__init__(self, {}, sid, False)
+        self.store = store
+        self.loaded = False
+
+    def load(self):
+        """
+        Load the session from the store, if it was not loaded yet
+        """
+        if not self.loaded:
+            self.loaded = True
+            data, self.payload, self.written = self.store.load_data(self.sid)
+            dict.update(self, data)
+
+
+def _loading(name):
+    method = getattr(Session, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for name in (
+        '__getitem__', '__setitem__', '__delitem__', '__contains__',
+        '__iter__', '__len__', '__eq__', '__ne__', '__repr__', '__copy__',
+        'get', 'setdefault', 'pop', 'popitem', 'clear', 'update', 'copy',
+        'has_key', 'keys', 'values', 'items', 'iterkeys', 'itervalues',
+        'iteritems', 'viewkeys', 'viewvalues', 'viewitems'):
+    setattr(LazySession, name, _loading(name))
+del name
+
+
+def _session_data(session):
+    """
+    Returns the data of the session as a dictionary. A lazy session is
+    loaded first, since `dict` reads the dictionary of the session directly.
+    """
+    if isinstance(session, LazySession):
+        session.load()
+    return dict(session)
+
+
+class _PayloadSerializer(object):
+    # The serialized data of the sessions is signed as it is
+    @staticmethod
+    def dumps(payload):
+        return payload
+
+    @staticmethod
+    def loads(payload):
+        return payload
 
 
 class NereidSessionInterface(SessionInterface):
@@ -75,6 +597,35 @@ class NereidSessionInterface(SessionInterface):
     session_store = MemcachedSessionStore()
     null_session_class = NullSession
 
+    #: The salt of the signatures of the sessions kept in the cookies
+    cookie_salt = 'nereid-session'
+
+    def __init__(self, session_store=None):
+        if session_store is not None:
+            self.session_store = session_store
+        self._serializers = {}
+
+        #: The number of sessions written in the cookies, of sessions kept
+        #: in the store because they were too large for the cookies and of
+        #: cookies which were not valid or had expired
+        self.stats = {
+            'cookie_writes': 0, 'cookie_fallbacks': 0, 'cookie_invalid': 0,
+        }
+
+    def get_cookie_serializer(self, app):
+        """
+        Returns the serializer which signs the sessions kept in the cookies
+        of the application, which is made once
+        """
+        serializer = self._serializers.get(app.secret_key)
+        if serializer is None:
+            serializer = self._serializers[app.secret_key] = \
+                URLSafeTimedSerializer(
+                    app.secret_key, salt=self.cookie_salt,
+                    serializer=_PayloadSerializer
+                )
+        return serializer
+
     def open_session(self, app, request):
         """
         Creates or opens a new session.
@@ -83,20 +634,68 @@ class NereidSessionInterface(SessionInterface):
         """
         sid = request.cookies.get(app.session_cookie_name, None)
         if sid:
+            if isinstance(self.session_store, NereidSessionStore):
+                if self.session_store.is_valid_key(sid):
+                    return LazySession(self.session_store, sid)
+                if app.session_cookie_max_size:
+                    return self.open_cookie_session(app, sid) or \
+                        self.session_store.new()
             return self.session_store.get(sid)
         else:
             return self.session_store.new()
 
+    def open_cookie_session(self, app, value):
+        """
+        Returns the session kept in the signed cookie, or None if the
+        signature is not valid or expired
+        """
+        try:
+            payload, timestamp = self.get_cookie_serializer(app).loads(
+                value, max_age=app.session_timeout, return_timestamp=True
+            )
+            if payload[:1] == PickleSerializer.tag:
+                # The pickles are never loaded from the cookies
+                raise BadSignature('Pickled session')
+            data = loads(payload)
+        except (BadSignature, ValueError):
+            self.stats['cookie_invalid'] += 1
+            return None
+        store = self.session_store
+        session = store.session_class(data, store.generate_key(), True)
+        session.payload = payload
+        session.written = calendar.timegm(timestamp.utctimetuple())
+        session.in_cookie = True
+        return session
+
     def save_session(self, app, session, response):
         """
         Saves the session if it needs updates.  For the default
         implementation, check :meth:`open_session`.
 
+        The stores of nereid write the session only if its data changed,
+        and the lazy sessions which were not used are not saved at all.
+
         :param session: the session to be saved
         :param response: an instance of :attr:`response_class`
         """
-        if session.should_save:
-            self.session_store.save(session)
+        if isinstance(session, LazySession) and not session.loaded:
+            self.session_store.stats['untouched'] += 1
+            return
+
+        if isinstance(self.session_store, NereidSessionStore):
+            if app.session_cookie_max_size:
+                if self.save_cookie_session(app, session, response):
+                    return
+                if session.in_cookie:
+                    # The session moves from the cookie to the store
+                    session.payload = None
+            saved = self.session_store.save_if_modified(session)
+        else:
+            saved = session.should_save
+            if saved:
+                self.session_store.save(session)
+
+        if saved:
             expires = self.get_expiration_time(app, session)
             domain = self.get_cookie_domain(app)
 
@@ -110,3 +709,49 @@ class NereidSessionInterface(SessionInterface):
                     app.session_cookie_name, session.sid,
                     expires=expires, httponly=False, domain=domain
                 )
+
+    def save_cookie_session(self, app, session, response):
+        """
+        Keeps the session in a signed cookie if the cookie is at most
+        `SESSION_COOKIE_MAX_SIZE` long. Returns False if the session must
+        be kept in the store instead.
+
+        The cookie is set again only when the data of the session changed
+        or once per `SESSION_TOUCH_INTERVAL` to refresh its signature.
+        """
+        in_store = not session.in_cookie and session.payload is not None
+        if not session:
+            if in_store:
+                self.session_store.delete(session)
+            if in_store or session.in_cookie:
+                response.delete_cookie(
+                    app.session_cookie_name,
+                    domain=self.get_cookie_domain(app)
+                )
+            return True
+
+        payload = dumps(_session_data(session))
+        if payload[:1] == PickleSerializer.tag:
+            self.stats['cookie_fallbacks'] += 1
+            return False
+        if session.in_cookie and payload == session.payload and \
+                time.time() - session.written < app.session_touch_interval:
+            return True
+
+        value = self.get_cookie_serializer(app).dumps(payload)
+        if len(value) > app.session_cookie_max_size:
+            self.stats['cookie_fallbacks'] += 1
+            return False
+
+        if in_store:
+            # The session moves from the store to the cookie
+            self.session_store.delete(session)
+        response.set_cookie(
+            app.session_cookie_name, value,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            domain=self.get_cookie_domain(app),
+        )
+        self.stats['cookie_writes'] += 1
+        return True
@@ -24,3 +24,21 @@ registration = _signals.signal('registration')
 
 transaction_start = _signals.signal('nereid.transaction.start')
 transaction_stop = _signals.signal('nereid.transaction.stop')
+
+#: Connection checkout
+#:  - Sent by the connection pools of nereid (:mod:`nereid.dbpool`) with the
+#:    time in seconds the checkout took as `wait_time`
+connection_checkout = _signals.signal('nereid.connection.checkout')
+
+#: Fragment cache render
+#:  - Sent by the `{% cache %}` tag when it renders a fragment, with the
+#:    `name` of the fragment and the time in seconds the render took as
+#:    `render_time`
+fragment_cache_render = _signals.signal('nereid.fragment_cache.render')
+
+#: Fragment cache wait
+#:  - Sent by the `{% cache %}` tag when another worker renders the fragment,
+#:    with the `name` of the fragment, the time in seconds spent waiting for
+#:    it as `wait_time` and `stale` which is True if the expired fragment
+#:    was served instead
+fragment_cache_wait = _signals.signal('nereid.fragment_cache.wait')
@@ -2,9 +2,12 @@
 # This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import os
+import hashlib
 import contextlib
 from decimal import Decimal
+from time import time, sleep
 
+from flask import has_request_context
 from flask.templating import render_template as flask_render_template
 from jinja2 import (BaseLoader, TemplateNotFound, nodes, Template,  # noqa
         ChoiceLoader, FileSystemLoader, BaseLoader)
@@ -20,6 +23,8 @@ from trytond.transaction import Transaction
 
 from .globals import request, current_app  # noqa
 from .helpers import _rst_to_html_filter, make_crumbs
+from .cachetags import get_tags
+from .signals import fragment_cache_render, fragment_cache_wait
 
 
 # Override python's weird assumption that utf-8 text should be encoded with
@@ -147,11 +152,17 @@ def render_template(template_name_or_list, **context):
 
 
 def nereid_default_template_ctx_processor():
-    """Add Decimal and make_crumbs to template context"""
-    return dict(
+    """
+    Add Decimal and make_crumbs to template context, and the URL builder of
+    the request as url_for when there is a request
+    """
+    rv = dict(
         Decimal=Decimal,
         make_crumbs=make_crumbs,
     )
+    if has_request_context():
+        rv['url_for'] = request.url_builder
+    return rv
 
 
 NEREID_TEMPLATE_FILTERS = dict(
@@ -250,16 +261,47 @@ class ModuleTemplateLoader(ChoiceLoader):
 
 
 class FragmentCacheExtension(Extension):
+    """
+    Caches the fragment of a template in the cache of the application::
+
+        {% cache 'product-' ~ product.id, 3600, tags=[product] %}
+            ...
+        {% endcache %}
+
+    The optional `tags` are records or cache tags (see
+    :mod:`nereid.cachetags`). The fragment is rendered again when one of
+    them is invalidated, like when a record is written. The tags of the
+    fragment are also added to the tags of the page of the request.
+
+    Within a request, the key of the fragment includes the website, the
+    language and the currency, so the name only has to tell the fragments
+    of a page apart. Other values the fragment depends on, like the user,
+    are given as a `vary` list::
+
+        {% cache 'cart', 60, vary=[current_user.id] %}
+
+    Only one worker renders an expired fragment: the others serve the
+    expired fragment for `FRAGMENT_CACHE_STALE_TIMEOUT` seconds, or wait for
+    up to `FRAGMENT_CACHE_LOCK_TIMEOUT` seconds for the fragment if there is
+    none.
+    """
     # a set of names that trigger the extension.
     tags = set(['cache'])
 
+    #: The interval in seconds at which a worker waiting for the fragment
+    #: rendered by another worker checks the cache
+    lock_poll_interval = 0.05
+
     def __init__(self, environment):
         super(FragmentCacheExtension, self).__init__(environment)
 
         # add the defaults to the environment
         environment.extend(
             fragment_cache_prefix='',
-            fragment_cache=None
+            fragment_cache=None,
+            fragment_cache_tags=None,
+            fragment_cache_stale_timeout=0,
+            fragment_cache_lock_timeout=0,
         )
 
     def parse(self, parser):
@@ -274,32 +316,172 @@ class FragmentCacheExtension(Extension):
 
         # if there is a comma, the user provided a timeout.  If not use
         # None as second parameter.
+        kwargs = []
         if parser.stream.skip_if('comma'):
-            args.append(parser.parse_expression())
-        else:
+            if not self._parse_keyword(parser, kwargs):
+                args.append(parser.parse_expression())
+        if len(args) < 2:
             args.append(nodes.Const(None))
 
+        # the keyword arguments like the tags
+        while parser.stream.skip_if('comma'):
+            if not self._parse_keyword(parser, kwargs):
+                parser.fail(
+                    'Only keyword arguments may follow the timeout', lineno
+                )
+
         # now we parse the body of the cache block up to `endcache` and
         # drop the needle (which would always be `endcache` in that case)
         body = parser.parse_statements(['name:endcache'], drop_needle=True)
 
         # now return a `CallBlock` node that calls our _cache_support
         # helper method on this extension.
-        return nodes.CallBlock(self.call_method('_cache_support', args),
+        return nodes.CallBlock(self.call_method('_cache_support', args, kwargs),
                                [], [], body).set_lineno(lineno)
 
-    def _cache_support(self, name, timeout, caller):
+    def _parse_keyword(self, parser, kwargs):
+        """
+        Parse a keyword argument if the stream is at one
+        """
+        if parser.stream.current.type != 'name' or \
+                parser.stream.look().type != 'assign':
+            return False
+        key = parser.stream.next().value
+        parser.stream.expect('assign')
+        kwargs.append(nodes.Keyword(key, parser.parse_expression()))
+        return True
+
+    def _cache_support(self, name, timeout, caller, tags=None, vary=None):
         """Helper callback."""
-        key = self.environment.fragment_cache_prefix + name
+        env = self.environment
+        cache = env.fragment_cache
+        if timeout is None:
+            timeout = getattr(cache, 'default_timeout', 300)
+        key = self._get_key(name, vary)
+        lock_key = key + '-lock'
+        lock_timeout = env.fragment_cache_lock_timeout
 
         # try to load the block from the cache
-        # if there is no fragment in the cache, render it and store
-        # it in the cache.
-        rv = self.environment.fragment_cache.get(key)
-        if rv is not None:
-            return rv
+        # if there is no fragment in the cache, or one of its tags was
+        # invalidated, render it and store it in the cache.
+        entry = self._get_entry(key)
+        if entry is None or entry[2] <= time():
+            if lock_timeout and not cache.add(lock_key, True, lock_timeout):
+                # Another worker is rendering the fragment
+                if entry is None:
+                    entry = self._wait_for_entry(name, key, lock_key)
+                else:
+                    fragment_cache_wait.send(
+                        self._get_app(), name=name, wait_time=0.0, stale=True
+                    )
+            else:
+                try:
+                    entry = self._render(
+                        name, key, timeout, caller, self._get_tags(tags)
+                    )
+                finally:
+                    if lock_timeout:
+                        cache.delete(lock_key)
+        if entry is None:
+            # The other worker did not render the fragment in time
+            entry = self._render(
+                name, key, timeout, caller, self._get_tags(tags)
+            )
+
+        rv, versions, expires = entry
+        if has_request_context():
+            request.cache_tags.add_versions(versions)
+        return rv
+
+    def _get_key(self, name, vary):
+        """
+        Returns the key of the fragment with the name for the website,
+        language and currency of the request and the vary values
+        """
+        parts = [name]
+        if has_request_context() and request.nereid_website:
+            locale = request.nereid_locale
+            parts.extend([
+                request.nereid_website.id,
+                (Transaction().context or {}).get('language'),
+                locale and locale.currency.id,
+            ])
+        parts.extend(vary or [])
+        return self.environment.fragment_cache_prefix + hashlib.md5(
+            '\x00'.join(
+                unicode(part).encode('utf-8') for part in parts
+            )
+        ).hexdigest()
+
+    def _get_entry(self, key):
+        """
+        Returns the entry of the fragment or None if there is none or one of
+        its tags was invalidated
+        """
+        entry = self.environment.fragment_cache.get(key)
+        cache_tags = self.environment.fragment_cache_tags
+        if entry is not None and (
+                cache_tags is None or cache_tags.is_current(entry[1])):
+            return entry
+
+    def _wait_for_entry(self, name, key, lock_key):
+        """
+        Wait for the fragment rendered by another worker till the lock is
+        released or expires. Returns None if the fragment is not in the
+        cache by then.
+        """
+        cache = self.environment.fragment_cache
+        start = time()
+        entry = None
+        while cache.get(lock_key) is not None:
+            sleep(self.lock_poll_interval)
+            entry = self._get_entry(key)
+            if entry is not None:
+                break
+        else:
+            entry = self._get_entry(key)
+        fragment_cache_wait.send(
+            self._get_app(), name=name, wait_time=time() - start, stale=False
+        )
+        return entry
+
+    def _render(self, name, key, timeout, caller, tags):
+        """
+        Render the fragment and store it in the cache. The fragment may be
+        served for the stale timeout after it expires.
+        """
+        env = self.environment
+        # Take the versions before the render, so that the fragment is
+        # discarded if a record changed while it was rendered
+        cache_tags = env.fragment_cache_tags
+        versions = cache_tags.get_versions(tags) if cache_tags else ()
+
+        start = time()
         rv = caller()
-        self.environment.fragment_cache.add(key, rv, timeout)
+        render_time = time() - start
+
+        entry = (rv, versions, time() + timeout)
+        env.fragment_cache.set(
+            key, entry, timeout + env.fragment_cache_stale_timeout
+        )
+        fragment_cache_render.send(
+            self._get_app(), name=name, render_time=render_time
+        )
+        return entry
+
+    def _get_app(self):
+        return getattr(self.environment, 'app', None)
+
+    def _get_tags(self, tags):
+        """
+        Returns the cache tags of the records and tags of the block
+        """
+        rv = set()
+        for tag in tags or []:
+            if isinstance(tag, basestring):
+                rv.add(tag)
+            else:
+                rv.update(get_tags([tag]))
         return rv
 
 
@@ -9,9 +9,30 @@ from nereid.contrib.locale import Babel
 from werkzeug.contrib.sessions import FilesystemSessionStore
 
 from nereid import Nereid
+from nereid.passwords import PBKDF2Hasher, register_hasher
 from flask.globals import _request_ctx_stack
 
 
+#: The number of iterations of the pbkdf2 hashers in the tests. The hashing
+#: of the passwords of the users created by the tests would take most of
+#: their time with the iterations of the production hashers.
+TEST_PASSWORD_ITERATIONS = 1000
+
+
+def register_test_hashers(iterations=TEST_PASSWORD_ITERATIONS):
+    """
+    Replace the pbkdf2 hashers by hashers of the same names with fewer
+    iterations. The hashes keep their format and are verified the same way.
+    """
+    register_hasher(PBKDF2Hasher(iterations=iterations))
+    register_hasher(PBKDF2Hasher(
+        'pbkdf2_sha512', iterations=iterations, digest='sha512'
+    ))
+
+
+register_test_hashers()
+
+
 class NereidTestApp(Nereid):
     """
     A Nereid app which works by removing transaction handling around the wsgi
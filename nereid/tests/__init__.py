@@ -2,10 +2,21 @@
 # this repository contains the full copyright notices and license terms.
 import unittest
 
-from .test_templates import TestTemplateLoading, TestLazyRendering
+from .test_templates import TestTemplateLoading, TestLazyRendering, \
+    TestFragmentCache
 from .test_helpers import TestURLfor, TestHelperFunctions
 from .test_signals import SignalsTestCase
 from .test_pagination import TestPagination
+from .test_invalidation import TestCacheSync
+from .test_dbpool import TestConnectionPool, TestReadonlyRouting
+from .test_pagecache import TestPageCache
+from .test_cachetags import TestCacheTags
+from .test_cache import TestTwoTierCache, TestMemoize, TestKeyBuilder
+from .test_memo import TestRequestMemoize
+from .test_passwords import TestPasswords
+from .test_throttle import TestLoginThrottle
+from .test_sessions import TestSessionStore
+from .test_single_dispatch import TestSingleTransactionDispatch
 
 
 def suite():
@@ -14,9 +25,25 @@ def suite():
     test_suite.addTests([
         unittest.TestLoader().loadTestsFromTestCase(TestTemplateLoading),
         unittest.TestLoader().loadTestsFromTestCase(TestLazyRendering),
+        unittest.TestLoader().loadTestsFromTestCase(TestFragmentCache),
         unittest.TestLoader().loadTestsFromTestCase(TestURLfor),
         unittest.TestLoader().loadTestsFromTestCase(TestHelperFunctions),
         unittest.TestLoader().loadTestsFromTestCase(SignalsTestCase),
         unittest.TestLoader().loadTestsFromTestCase(TestPagination),
+        unittest.TestLoader().loadTestsFromTestCase(TestCacheSync),
+        unittest.TestLoader().loadTestsFromTestCase(TestConnectionPool),
+        unittest.TestLoader().loadTestsFromTestCase(TestReadonlyRouting),
+        unittest.TestLoader().loadTestsFromTestCase(TestPageCache),
+        unittest.TestLoader().loadTestsFromTestCase(TestCacheTags),
+        unittest.TestLoader().loadTestsFromTestCase(TestTwoTierCache),
+        unittest.TestLoader().loadTestsFromTestCase(TestMemoize),
+        unittest.TestLoader().loadTestsFromTestCase(TestKeyBuilder),
+        unittest.TestLoader().loadTestsFromTestCase(TestRequestMemoize),
+        unittest.TestLoader().loadTestsFromTestCase(TestPasswords),
+        unittest.TestLoader().loadTestsFromTestCase(TestLoginThrottle),
+        unittest.TestLoader().loadTestsFromTestCase(TestSessionStore),
+        unittest.TestLoader().loadTestsFromTestCase(
+            TestSingleTransactionDispatch
+        ),
     ])
     return test_suite
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import unittest
+import warnings
+
+from flask import Flask
+from werkzeug.contrib.cache import SimpleCache
+from nereid import Nereid
+from nereid.contrib.cache import LRUCache, TwoTierCache
+from nereid.cachekeys import KeyBuilder, make_key, MAX_KEY_LENGTH
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from nereid.caching import Cache
+
+
+class CountingCache(SimpleCache):
+    """
+    A shared cache which counts the calls to its read methods
+    """
+
+    def __init__(self, *args, **kwargs):
+        SimpleCache.__init__(self, *args, **kwargs)
+        self.reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        return SimpleCache.get(self, key)
+
+    def get_many(self, *keys):
+        self.reads += 1
+        return [SimpleCache.get(self, key) for key in keys]
+
+
+class Channel(object):
+    """
+    A channel which keeps the messages published
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, message):
+        self.messages.append(message)
+
+
+class TestTwoTierCache(unittest.TestCase):
+    """
+    Test the two tier cache backend
+    """
+
+    def test_0010_lru(self):
+        """
+        The least recently used values are dropped first
+        """
+        cache = LRUCache(threshold=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(len(cache), 2)
+
+        self.assertFalse(cache.add('a', 4))
+        cache.set('d', 4, -1)
+        self.assertIsNone(cache.get('d'))
+        self.assertTrue(cache.add('d', 4))
+
+        # The values are copies
+        cache.set('e', [1])
+        cache.get('e').append(2)
+        self.assertEqual(cache.get('e'), [1])
+
+    def test_0020_tiers(self):
+        """
+        The values read from the shared cache are kept in the local tier
+        """
+        shared = CountingCache()
+        cache = TwoTierCache(shared, threshold=10, local_timeout=60)
+
+        shared.set('a', 1)
+        shared.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(shared.reads, 1)
+
+        # The keys missing from the local tier are read at once
+        self.assertEqual(cache.get_many('a', 'b', 'c'), [1, 2, None])
+        self.assertEqual(shared.reads, 2)
+        self.assertEqual(cache.get_many('a', 'b'), [1, 2])
+        self.assertEqual(shared.reads, 2)
+
+        self.assertEqual(
+            cache.stats, {'local_hits': 4, 'shared_hits': 2, 'misses': 1}
+        )
+        self.assertEqual(cache.hit_ratios['local'], 4.0 / 7)
+        self.assertEqual(cache.hit_ratios['shared'], 2.0 / 3)
+
+        # The writes go to both tiers
+        cache.set('a', 3)
+        self.assertEqual(shared.get('a'), 3)
+        self.assertEqual(cache.get('a'), 3)
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(shared.get('a'))
+
+        # A value changed in the shared cache by another worker is read
+        # again once it expired from the local tier
+        shared.set('b', 4)
+        self.assertEqual(cache.get('b'), 2)
+        cache.local.set('b', 2, -1)
+        self.assertEqual(cache.get('b'), 4)
+
+    def test_0030_channel(self):
+        """
+        The changed keys are published and dropped from the local tier by
+        the other workers
+        """
+        channel = Channel()
+        cache = TwoTierCache(SimpleCache(), channel=channel)
+        cache.set('a', 1)
+        cache.set_many({'b': 2})
+        cache.clear()
+        self.assertEqual(channel.messages, ['a', 'b', '*'])
+
+        other = TwoTierCache(SimpleCache())
+        other.set('a', 1)
+        other.set('b', 2)
+        other.drop('a')
+        self.assertIsNone(other.local.get('a'))
+        self.assertEqual(other.local.get('b'), 2)
+        other.drop('*')
+        self.assertIsNone(other.local.get('b'))
+
+    def test_0040_config(self):
+        """
+        The application builds the two tier cache from its config
+        """
+        app = Nereid()
+        app.config.update({
+            'CACHE_TYPE': 'nereid.contrib.cache.TwoTierCache',
+            'CACHE_SHARED_TYPE': 'werkzeug.contrib.cache.SimpleCache',
+            'CACHE_LOCAL_THRESHOLD': 10,
+        })
+        app.load_cache()
+        self.assertTrue(isinstance(app.cache, TwoTierCache))
+        self.assertTrue(isinstance(app.cache.shared, SimpleCache))
+        self.assertEqual(app.cache.local.threshold, 10)
+
+
+class TestMemoize(unittest.TestCase):
+    """
+    Test the memoize decorators of nereid.caching
+    """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.shared = self.app.cache = CountingCache()
+
+    def test_0010_memoize_many(self):
+        """
+        The results of many arguments are read and written at once
+        """
+        cache = Cache()
+        calls = []
+
+        @cache.memoize_many('multiply')
+        def multiply(a, b):
+            calls.append((a, b))
+            return a * b
+
+        @cache.memoize('multiply')
+        def multiply_one(a, b):
+            return a * b
+
+        with self.app.app_context():
+            self.assertEqual(multiply([(1, 2), (2, 3)]), [2, 6])
+            self.assertEqual(calls, [(1, 2), (2, 3)])
+            self.assertEqual(self.shared.reads, 1)
+
+            self.assertEqual(multiply([(2, 3), (3, 4), (1, 2)]), [6, 12, 2])
+            self.assertEqual(calls, [(1, 2), (2, 3), (3, 4)])
+            self.assertEqual(self.shared.reads, 2)
+            self.assertEqual(multiply([]), [])
+
+            # The cached results are shared with memoize
+            self.assertEqual(multiply_one(3, 4), 12)
+            self.assertEqual(self.shared.reads, 3)
+            self.assertEqual(calls, [(1, 2), (2, 3), (3, 4)])
+
+    def test_0020_batched(self):
+        """
+        The misses are computed in a single call of a batched function
+        """
+        cache = Cache()
+        calls = []
+
+        class Product(object):
+            @classmethod
+            @cache.memoize_many('price', batched=True)
+            def get_prices(cls, args_list):
+                calls.append(args_list)
+                return [product_id * 10 for product_id, in args_list]
+
+        with self.app.app_context():
+            self.assertEqual(Product.get_prices([(1, ), (2, )]), [10, 20])
+            self.assertEqual(
+                Product.get_prices([(3, ), (2, ), (4, )]), [30, 20, 40]
+            )
+            self.assertEqual(calls, [[(1, ), (2, )], [(3, ), (4, )]])
+
+
+class TestKeyBuilder(unittest.TestCase):
+    """
+    Test the keys of the memoized calls
+    """
+
+    def test_0010_binding(self):
+        """
+        The calls with the same arguments get the same key however they are
+        given
+        """
+        def price(product, quantity=1, currency=None):
+            pass
+
+        make_key = KeyBuilder('price', price)
+        key = make_key((1, 1, None), {})
+        self.assertEqual(key, 'price:i1,i1,n')
+        self.assertEqual(make_key((1, ), {}), key)
+        self.assertEqual(make_key((), {'product': 1}), key)
+        self.assertEqual(make_key((1, ), {'currency': None}), key)
+        self.assertNotEqual(make_key((1, 2), {}), key)
+
+        class Product(object):
+            def price(self, quantity=1):
+                pass
+
+        make_key = KeyBuilder('price', Product.price.im_func, skip=1)
+        self.assertEqual(make_key((Product(), ), {}), 'price:i1')
+
+        make_key = KeyBuilder(
+            'price', price, key_func=lambda product, *args, **kwargs: product
+        )
+        self.assertEqual(make_key((1, 2), {'currency': 3}), 'price:i1')
+
+    def test_0020_encoding(self):
+        """
+        The values of different types get different keys
+        """
+        keys = [
+            make_key('f', values) for values in [
+                (1, ), ('1', ), (u'1', ), (1.0, ), (True, ), (None, ),
+                ((1, ), ), ('1,1', ), (1, 1), ('a:1', ), ('a', '1'),
+            ]
+        ]
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(make_key('f', [[1, 2]]), make_key('f', [(1, 2)]))
+
+        # The keys which are too long or not printable are hashed
+        for value in ['a' * MAX_KEY_LENGTH, 'a b', u'\xe9']:
+            key = make_key('f', [value])
+            self.assertTrue(key.startswith('f#'))
+            self.assertTrue(len(key) < 50)
+        self.assertNotEqual(make_key('f', ['a b']), make_key('f', ['a  b']))
+
+
+def suite():
+    "Cache backend test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestTwoTierCache),
+        unittest.TestLoader().loadTestsFromTestCase(TestMemoize),
+        unittest.TestLoader().loadTestsFromTestCase(TestKeyBuilder),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import unittest
+
+import trytond.tests.test_tryton
+from test_templates import BaseTestCase
+from trytond.tests.test_tryton import USER, DB_NAME, CONTEXT
+from trytond.transaction import Transaction
+from mock import patch
+from nereid.globals import request
+from nereid.cachetags import get_tag
+
+
+class TestCacheTags(BaseTestCase):
+    """
+    Test the invalidation of the cache entries by tags
+    """
+
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('nereid_test')
+        super(TestCacheTags, self).setUp()
+
+    def get_app(self, **options):
+        options.setdefault('CACHE_TYPE', 'werkzeug.contrib.cache.SimpleCache')
+        options.setdefault('PAGE_CACHE_ENABLED', True)
+        return super(TestCacheTags, self).get_app(**options)
+
+    def test_0010_versions(self):
+        """
+        The versions of the tags change when they are bumped
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            cache_tags = app.cache_tags
+
+            versions = cache_tags.get_versions(['b', 'a'])
+            self.assertEqual([tag for tag, version in versions], ['a', 'b'])
+            self.assertEqual(cache_tags.get_versions(['a', 'b']), versions)
+            self.assertTrue(cache_tags.is_current(versions))
+            self.assertTrue(cache_tags.is_current(()))
+
+            cache_tags.bump(['a'])
+            self.assertFalse(cache_tags.is_current(versions))
+            self.assertTrue(cache_tags.is_current(versions[1:]))
+
+            # A tag whose version was lost is not current
+            app.cache.delete(cache_tags.get_key('b'))
+            self.assertFalse(cache_tags.is_current(versions[1:]))
+
+    def test_0020_model_write(self):
+        """
+        Writing a record invalidates the fragments and pages tagged with it
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            party = self.party
+            renders = []
+
+            def view():
+                renders.append(1)
+                request.cache_tags.add(get_tag('party.party', party.id))
+                return party.name
+
+            template = app.jinja_env.from_string(
+                "{% cache 'party', tags=[party] %}"
+                "{{ party.name }}"
+                "{% endcache %}"
+            )
+            with app.test_request_context('/'):
+                self.assertEqual(template.render(party=party), 'Openlabs')
+                self.assertEqual(
+                    request.cache_tags,
+                    set([get_tag('party.party', party.id)])
+                )
+                app.page_cache.dispatch(request, 60, view)
+
+            with app.test_request_context('/'):
+                self.party_obj.write([party], {'name': 'Fulfil'})
+                self.assertEqual(template.render(party=party), 'Fulfil')
+
+                response = app.page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.data, 'Fulfil')
+                self.assertEqual(len(renders), 2)
+
+            # Writing another record does not, but it invalidates the tag of
+            # the model
+            other, = self.party_obj.create([{'name': 'Other'}])
+            model_versions = app.cache_tags.get_versions(['party.party'])
+            with app.test_request_context('/'):
+                self.party_obj.write([other], {'name': 'Another'})
+                response = app.page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.headers['X-Page-Cache'], 'HIT')
+                self.assertFalse(app.cache_tags.is_current(model_versions))
+
+    def test_0030_write_during_render(self):
+        """
+        A page is discarded if a record it shows changed while it was being
+        rendered
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            tag = get_tag('party.party', self.party.id)
+            renders = []
+
+            def view():
+                renders.append(1)
+                request.cache_tags.add(tag)
+                if len(renders) == 1:
+                    # Another worker writes the record after it was read
+                    app.cache_tags.bump([tag])
+                return 'Openlabs'
+
+            with app.test_request_context('/'):
+                app.page_cache.dispatch(request, 60, view)
+                self.assertEqual(len(request.cache_tags.versions), 1)
+            with app.test_request_context('/'):
+                response = app.page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.headers['X-Page-Cache'], 'MISS')
+            with app.test_request_context('/'):
+                response = app.page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.headers['X-Page-Cache'], 'HIT')
+            self.assertEqual(len(renders), 2)
+
+            # The versions of a cached fragment are those of its render
+            versions = app.cache_tags.get_versions([tag])
+            app.cache_tags.bump([tag])
+            with app.test_request_context('/'):
+                request.cache_tags.track(app.cache_tags)
+                request.cache_tags.add_versions(versions)
+                request.cache_tags.add(tag)
+                self.assertEqual(request.cache_tags.get_versions(), versions)
+                self.assertFalse(
+                    app.cache_tags.is_current(request.cache_tags.get_versions())
+                )
+
+    def test_0040_opt_in(self):
+        """
+        Only the models with the mixin bump their tags, when the application
+        has a cache, and the tags are bumped in batches
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            stats = app.cache_tags.stats
+
+            with app.test_request_context('/'):
+                self.company_obj.write([self.company], {})
+                self.assertEqual(stats['bumps'], 0)
+                self.party_obj.write([self.party], {'name': 'Fulfil'})
+                self.assertEqual(stats['bumps'], 2)
+
+            app = self.get_app(CACHE_TYPE='werkzeug.contrib.cache.NullCache')
+            self.assertFalse(app.cache_tags.enabled)
+            with app.test_request_context('/'):
+                self.party_obj.write([self.party], {'name': 'Openlabs'})
+                self.assertEqual(app.cache_tags.stats['bumps'], 0)
+
+            app = self.get_app()
+            app.cache_tags.bump_batch_size = 2
+            with patch.object(app.cache, 'set_many') as set_many:
+                app.cache_tags.bump(['a', 'b', 'c'])
+                self.assertEqual(set_many.call_count, 2)
+
+
+def suite():
+    "Cache tags test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestCacheTags),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
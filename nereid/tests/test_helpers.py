@@ -9,7 +9,7 @@ from test_templates import BaseTestCase
 from trytond.pool import PoolMeta, Pool
 from trytond.tests.test_tryton import USER, DB_NAME, CONTEXT, POOL
 from trytond.transaction import Transaction
-from nereid import url_for, template_filter
+from nereid import url_for, url_for_many, template_filter, request
 
 
 class TestURLfor(BaseTestCase):
@@ -66,6 +66,85 @@ class TestURLfor(BaseTestCase):
                     )
                     self.assertEqual(len(w), 1)
 
+    def test_0040_build_cache(self):
+        """
+        The rule used to build a URL is reused for values with the same names
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+
+            with app.test_request_context('/'):
+                url_map, = app.url_maps.values()
+                self.assertEqual(
+                    url_for('country.country.get_subdivisions', active_id=1),
+                    '/countries/1/subdivisions'
+                )
+                self.assertEqual(url_map.build_cache_stats['hits'], 0)
+                self.assertEqual(
+                    url_for('country.country.get_subdivisions', active_id=2),
+                    '/countries/2/subdivisions'
+                )
+                self.assertEqual(url_map.build_cache_stats['hits'], 1)
+
+                # Unknown values are added to the query string
+                self.assertEqual(
+                    url_for(
+                        'country.country.get_subdivisions',
+                        active_id=2, page=3
+                    ),
+                    '/countries/2/subdivisions?page=3'
+                )
+
+    def test_0050_url_for_many(self):
+        """
+        Generate URLs in bulk
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+
+            with app.test_request_context('/'):
+                self.assertEqual(
+                    url_for_many(
+                        'country.country.get_subdivisions',
+                        [{'active_id': 1}, {'active_id': 2}],
+                        _external=True
+                    ), [
+                        'http://localhost/countries/1/subdivisions',
+                        'http://localhost/countries/2/subdivisions',
+                    ]
+                )
+
+    def test_0060_url_builder(self):
+        """
+        The URL builder is created once for a request
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+
+            with app.test_request_context('/'):
+                builder = request.url_builder
+                self.assertIs(builder, request.url_builder)
+                self.assertIsNone(builder.locale)
+                self.assertEqual(builder('nereid.website.home'), '/')
+                self.assertEqual(
+                    builder('nereid.website.home', _anchor='top'), '/#top'
+                )
+
+                # The scheme does not change the adapter of the request
+                self.assertEqual(
+                    builder(
+                        'nereid.website.home', _external=True, _scheme='https'
+                    ),
+                    'https://localhost/'
+                )
+                self.assertEqual(
+                    builder('nereid.website.home', _external=True),
+                    'http://localhost/'
+                )
+
 
 class NereidWebsite:
     __metaclass__ = PoolMeta
@@ -115,6 +194,30 @@ class TestHelperFunctions(BaseTestCase):
                 response = c.get('/')
                 self.assertEqual(response.data, 'cba')
 
+    def test_model_methods(self):
+        """
+        Test the registry of the methods decorated by nereid
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+
+            filters = app.get_model_methods('_template_filter')
+            self.assertIn(
+                ('nereid.website', 'reverse_test'),
+                [(model, name) for model, name, f in filters]
+            )
+            routes = [
+                (model, name)
+                for model, name, f in app.get_model_methods('_url_rules')
+            ]
+            self.assertIn(('nereid.website', 'home'), routes)
+            self.assertIn(('nereid.user', 'verify_email'), routes)
+            self.assertEqual(app.get_model_methods('_unknown'), [])
+
+            # The registry is not built again for the same pool
+            self.assertIs(filters, app.get_model_methods('_template_filter'))
+
 
 def suite():
     "Nereid Helpers test suite"
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import os
+import shutil
+import tempfile
+import unittest
+from Queue import Queue
+
+from mock import patch
+import trytond.tests.test_tryton
+from trytond.cache import Cache
+from trytond.transaction import Transaction
+from trytond.tests.test_tryton import USER, DB_NAME, CONTEXT
+
+from test_dbpool import Connection
+
+from nereid import Nereid
+from nereid.dbpool import ConnectionPool
+from nereid.invalidation import CacheSync, ThrottledCacheSync, \
+    ThreadedCacheSync, PubSubCacheSync, UnixSocketChannel
+
+
+class QueueChannel(object):
+    """
+    A channel between the instances of a process with the API of the
+    :class:`~nereid.invalidation.UnixSocketChannel`
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+        self.queue = Queue()
+
+    def subscribe(self):
+        self.queues.append(self.queue)
+
+    def receive(self):
+        return self.queue.get()
+
+    def publish(self, message):
+        for queue in self.queues:
+            if queue is not self.queue:
+                queue.put(message)
+
+
+class StopSync(Exception):
+    pass
+
+
+class TestCacheSync(unittest.TestCase):
+    """
+    Test the strategies which synchronise the tryton caches
+    """
+
+    def setUp(self):
+        self.app = Nereid()
+        self.app.config['DATABASE_NAME'] = 'test_cache_sync'
+
+    def tearDown(self):
+        Cache._resets.pop('test_cache_sync', None)
+        Cache._resets.pop(DB_NAME, None)
+
+    def get_cache(self, name):
+        """
+        Return a tryton cache with a value set
+        """
+        cache = Cache(name)
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            cache.set('key', 'value')
+        return cache
+
+    def get_cached(self, cache):
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            return cache.get('key')
+
+    def publish_reset(self, sync, name):
+        """
+        Reset the cache and publish it from the sync strategy of a worker
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            Cache.reset(DB_NAME, name)
+            self.assertTrue(sync.resets_due())
+            sync.resets()
+
+    def test_0010_every_request(self):
+        """
+        The default strategy cleans on every request and resets only when
+        there are pending resets
+        """
+        sync = CacheSync(self.app)
+        self.assertTrue(sync.clean_due())
+        self.assertFalse(sync.resets_due())
+
+        Cache.reset('test_cache_sync', 'nereid.website.url_adapter')
+        self.assertTrue(sync.resets_due())
+
+    def test_0020_throttled(self):
+        """
+        The throttled strategy cleans only once in the interval
+        """
+        trytond.tests.test_tryton.install_module('nereid')
+        self.app.config['DATABASE_NAME'] = DB_NAME
+        sync = ThrottledCacheSync(self.app, interval=1000)
+        self.assertTrue(sync.is_due())
+
+        with patch('nereid.invalidation.time') as time:
+            time.return_value = 100.0
+            with Transaction().start(DB_NAME, USER, CONTEXT):
+                sync.synchronise()
+            self.assertEqual(sync.last_clean, 100.0)
+
+            time.return_value = 100.5
+            self.assertFalse(sync.is_due())
+
+            # Pending resets of this worker are never throttled
+            Cache.reset(DB_NAME, 'nereid.website.url_adapter')
+            self.assertTrue(sync.is_due())
+            self.assertFalse(sync.clean_due())
+
+            time.return_value = 101.0
+            self.assertTrue(sync.clean_due())
+
+    def test_0030_unix_socket_channel(self):
+        """
+        Publish on a channel and receive on another subscriber
+        """
+        path = tempfile.mkdtemp()
+        try:
+            subscriber = UnixSocketChannel(path)
+            subscriber.subscribe()
+
+            # The publisher skips the socket of its own process, so
+            # rename the subscriber socket to look like another process
+            os.rename(
+                os.path.join(path, '%d.sock' % os.getpid()),
+                os.path.join(path, 'other.sock')
+            )
+            # A dead subscriber is removed on publish
+            open(os.path.join(path, 'dead.sock'), 'w').close()
+
+            UnixSocketChannel(path).publish('nereid.website.url_adapter')
+            self.assertEqual(
+                subscriber.receive(), 'nereid.website.url_adapter'
+            )
+            self.assertFalse(os.path.exists(os.path.join(path, 'dead.sock')))
+        finally:
+            shutil.rmtree(path)
+
+    def test_0040_default_interval(self):
+        """
+        The strategies use their own interval unless one is configured
+        """
+        self.assertEqual(self.app.cache_sync_interval, None)
+        self.assertEqual(ThrottledCacheSync(self.app).interval, 1000)
+        self.assertEqual(ThreadedCacheSync(self.app).interval, 1000)
+        self.assertEqual(
+            PubSubCacheSync(self.app, channel=QueueChannel([])).interval,
+            60 * 1000
+        )
+        self.assertEqual(
+            PubSubCacheSync(
+                self.app, interval=5000, channel=QueueChannel([])
+            ).interval, 5000
+        )
+
+        self.app.config['CACHE_SYNC_TYPE'] = \
+            'nereid.invalidation.PubSubCacheSync'
+        self.app.config['CACHE_SYNC_INIT_KWARGS'] = {
+            'channel': QueueChannel([]),
+        }
+        self.app.load_cache_sync()
+        self.assertEqual(self.app.cache_sync.interval, 60 * 1000)
+
+    def test_0050_threaded_reset(self):
+        """
+        The thread of a worker clears the caches reset by another worker
+        """
+        trytond.tests.test_tryton.install_module('nereid')
+        self.app.config['DATABASE_NAME'] = DB_NAME
+        cache = self.get_cache('test.threaded_reset')
+        publisher = ThreadedCacheSync(self.app)
+        subscriber = ThreadedCacheSync(self.app)
+
+        def run_once(sync):
+            # Run a single iteration of the loop of the thread
+            with patch('nereid.invalidation.sleep') as sleep:
+                sleep.side_effect = [None, StopSync()]
+                self.assertRaises(StopSync, sync.run)
+                sleep.assert_called_with(1.0)
+
+        run_once(subscriber)
+        self.assertEqual(self.get_cached(cache), 'value')
+
+        self.publish_reset(publisher, 'test.threaded_reset')
+        self.assertFalse(publisher.resets_due())
+        run_once(subscriber)
+        self.assertEqual(self.get_cached(cache), None)
+
+    def test_0060_pubsub_reset(self):
+        """
+        A worker clears the caches when another worker announces a reset on
+        the channel, without waiting for the interval
+        """
+        trytond.tests.test_tryton.install_module('nereid')
+        self.app.config['DATABASE_NAME'] = DB_NAME
+        cache = self.get_cache('test.pubsub_reset')
+        queues = []
+        publisher = PubSubCacheSync(self.app, channel=QueueChannel(queues))
+        subscriber = PubSubCacheSync(self.app, channel=QueueChannel(queues))
+
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            subscriber.synchronise()
+        self.assertEqual(self.get_cached(cache), 'value')
+        self.assertFalse(subscriber.clean_due())
+
+        publisher.start()
+        self.publish_reset(publisher, 'test.pubsub_reset')
+        self.assertTrue(subscriber._invalidated.wait(5))
+        self.assertTrue(subscriber.clean_due())
+
+        # The publisher does not receive its own announcements
+        self.assertFalse(publisher._invalidated.is_set())
+
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            subscriber.synchronise()
+        self.assertEqual(self.get_cached(cache), None)
+        self.assertFalse(subscriber.clean_due())
+
+    def test_0070_single_connection(self):
+        """
+        The synchronisation runs on the connection of its transaction and
+        does not take another one from a pool of size 1
+        """
+        trytond.tests.test_tryton.install_module('nereid')
+        self.app.config['DATABASE_NAME'] = DB_NAME
+        cache = self.get_cache('test.single_connection')
+        publisher = CacheSync(self.app)
+        subscriber = CacheSync(self.app)
+
+        # The transaction of the synchronisation holds the only connection
+        pool = ConnectionPool(Connection, size=1, timeout=10)
+        pool.getconn()
+
+        def new_cursor(*args, **kwargs):
+            pool.getconn()
+
+        with patch.object(Transaction, 'new_cursor', new_cursor):
+            Cache.reset(DB_NAME, 'test.single_connection')
+            with Transaction().start(DB_NAME, USER, CONTEXT):
+                publisher.synchronise()
+            self.assertFalse(publisher.resets_due())
+
+            with Transaction().start(DB_NAME, USER, CONTEXT):
+                subscriber.synchronise()
+        self.assertEqual(pool.stats['timeouts'], 0)
+        self.assertEqual(self.get_cached(cache), None)
+
+
+def suite():
+    "Cache synchronisation test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestCacheSync),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
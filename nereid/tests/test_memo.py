@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import unittest
+
+from test_templates import BaseTestCase
+from trytond.tests.test_tryton import USER, DB_NAME, CONTEXT
+from trytond.transaction import Transaction
+from nereid import request_memoize
+from nereid.globals import request
+from nereid.signals import transaction_stop
+
+
+class TestRequestMemoize(BaseTestCase):
+    """
+    Test the memoization of the calls within a request
+    """
+
+    def test_0010_lifetimes(self):
+        """
+        The results are kept for the transaction or for the request
+        """
+        calls = []
+
+        @request_memoize()
+        def name(party):
+            calls.append(party.id)
+            return party.name
+
+        @request_memoize(lifetime='request', copy=True)
+        def serialize(party):
+            calls.append(party.id)
+            return {'name': party.name}
+
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            party = self.party
+
+            # The calls outside of a request are not memoized
+            name(party)
+            name(party)
+            self.assertEqual(len(calls), 2)
+
+            with app.test_request_context('/'):
+                self.assertEqual(name(party), 'Openlabs')
+                self.assertEqual(name(party=party), 'Openlabs')
+                serialize(party)['name'] = 'Changed'
+                self.assertEqual(serialize(party), {'name': 'Openlabs'})
+                self.assertEqual(len(calls), 4)
+                self.assertEqual(request.memo.stats, {'hits': 2, 'misses': 2})
+
+                # The language of the context is a part of the key
+                with Transaction().set_context(language='fr_FR'):
+                    name(party)
+                self.assertEqual(len(calls), 5)
+
+                transaction_stop.send(app)
+                name(party)
+                serialize(party)
+                self.assertEqual(len(calls), 6)
+
+            with app.test_request_context('/'):
+                serialize(party)
+                self.assertEqual(len(calls), 7)
+
+        self.assertRaises(ValueError, request_memoize, lifetime='session')
+
+
+def suite():
+    "Request memoization test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestRequestMemoize),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import unittest
+
+from mock import patch
+from test_templates import BaseTestCase
+from trytond.tests.test_tryton import USER, DB_NAME, CONTEXT
+from trytond.transaction import Transaction
+from nereid.globals import session, request
+
+
+class TestPageCache(BaseTestCase):
+    """
+    Test the page cache
+    """
+
+    def get_app(self, **options):
+        options.setdefault('CACHE_TYPE', 'werkzeug.contrib.cache.SimpleCache')
+        options.setdefault('PAGE_CACHE_ENABLED', True)
+        return super(TestPageCache, self).get_app(**options)
+
+    def test_0010_dispatch(self):
+        """
+        The pages are served from the cache till they expire
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            page_cache = app.page_cache
+            renders = []
+
+            def view():
+                renders.append(1)
+                return 'Page %d' % len(renders)
+
+            with app.test_request_context('/?page=1'):
+                response = page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.data, 'Page 1')
+                self.assertEqual(response.headers['X-Page-Cache'], 'MISS')
+
+            with app.test_request_context('/?page=1'):
+                response = page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.data, 'Page 1')
+                self.assertEqual(response.headers['X-Page-Cache'], 'HIT')
+
+            # The query string is a part of the key
+            with app.test_request_context('/?page=2'):
+                response = page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.data, 'Page 2')
+
+            # An expired page is rendered again, unless another request is
+            # rendering it
+            with app.test_request_context('/?page=1'):
+                key = page_cache.get_key(request)
+                entry = app.cache.get(key)
+                app.cache.set(key, (0, ) + entry[1:])
+
+                app.cache.add(key + '-lock', True)
+                response = page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.data, 'Page 1')
+                self.assertEqual(response.headers['X-Page-Cache'], 'STALE')
+
+                app.cache.delete(key + '-lock')
+                response = page_cache.dispatch(request, 60, view)
+                self.assertEqual(response.data, 'Page 3')
+                self.assertEqual(response.headers['X-Page-Cache'], 'MISS')
+
+            self.assertEqual(page_cache.stats['hits'], 1)
+            self.assertEqual(page_cache.stats['stale'], 1)
+            self.assertEqual(page_cache.stats['stores'], 3)
+
+    def test_0020_not_cacheable(self):
+        """
+        The pages of the sessions with data and the pages which change the
+        session are not cached
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            page_cache = app.page_cache
+
+            def view():
+                session['_flashes'] = [('message', 'Hello')]
+                return 'Hello'
+
+            with app.test_request_context('/'):
+                # The home page has no cache timeout
+                self.assertIsNone(page_cache.get_timeout(request))
+
+                request.url_rule.cache_timeout = 60
+                try:
+                    self.assertEqual(page_cache.get_timeout(request), 60)
+                    page_cache.dispatch(request, 60, view)
+                    self.assertIsNone(page_cache.get_timeout(request))
+                finally:
+                    request.url_rule.cache_timeout = None
+            self.assertEqual(page_cache.stats['stores'], 0)
+            self.assertEqual(page_cache.stats['bypasses'], 1)
+
+            with app.test_request_context(
+                    '/', headers=[('Authorization', 'Basic dXNlcg==')]):
+                self.assertFalse(page_cache.is_anonymous(request))
+
+            with app.test_request_context('/', method='POST'):
+                request.url_rule.cache_timeout = 60
+                try:
+                    self.assertIsNone(page_cache.get_timeout(request))
+                finally:
+                    request.url_rule.cache_timeout = None
+
+            app.config['PAGE_CACHE_VARY_HEADERS'] = ['Accept-Language']
+            with app.test_request_context(
+                    '/', headers=[('Accept-Language', 'fr')]):
+                key = page_cache.get_key(request)
+                response = page_cache.dispatch(request, 60, lambda: 'Salut')
+                self.assertEqual(response.headers['Vary'], 'Accept-Language')
+            with app.test_request_context(
+                    '/', headers=[('Accept-Language', 'en')]):
+                self.assertNotEqual(page_cache.get_key(request), key)
+
+    def test_0030_lock_timeout(self):
+        """
+        The lock of a page rendered again expires even if the stale timeout
+        is 0
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app(PAGE_CACHE_STALE_TIMEOUT=0)
+            page_cache = app.page_cache
+
+            with app.test_request_context('/'):
+                key = page_cache.get_key(request)
+                page_cache.dispatch(request, 60, lambda: 'Page')
+                entry = app.cache.get(key)
+                app.cache.set(key, (0, ) + entry[1:])
+
+                with patch.object(app.cache, 'add') as add:
+                    add.return_value = True
+                    response = page_cache.dispatch(request, 60, lambda: 'New')
+                add.assert_called_once_with(key + '-lock', True, 1)
+                self.assertEqual(response.data, 'New')
+
+
+def suite():
+    "Page cache test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestPageCache),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
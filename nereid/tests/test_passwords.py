@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import unittest
+import hashlib
+
+from flask import Flask
+from nereid.passwords import PBKDF2Hasher, VerificationPool, \
+    register_hasher, get_hasher, identify_hasher, make_password, \
+    check_password, hashers
+
+
+class TestPasswords(unittest.TestCase):
+    """
+    Test the hashing of the passwords
+    """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['PASSWORD_HASHER'] = 'pbkdf2_fast'
+        register_hasher(PBKDF2Hasher('pbkdf2_fast', iterations=10))
+
+    def tearDown(self):
+        hashers.pop('pbkdf2_fast', None)
+
+    def test_0010_hashers(self):
+        """
+        The passwords are verified by the hasher which hashed them
+        """
+        for name in ('sha1', 'pbkdf2_fast'):
+            hasher = get_hasher(name)
+            encoded = hasher.encode(u'pässword')
+            self.assertTrue(encoded.startswith(name + '$'))
+            self.assertTrue(identify_hasher(encoded) is hasher)
+            self.assertTrue(hasher.verify(u'pässword', encoded))
+            self.assertFalse(hasher.verify(u'password', encoded))
+            self.assertNotEqual(hasher.encode(u'pässword'), encoded)
+
+        # The salted sha1 of the previous versions
+        self.assertTrue(get_hasher('sha1').verify(
+            'password', 'sha1$abcdefgh$%s' % (
+                hashlib.sha1('passwordabcdefgh').hexdigest()
+            )
+        ))
+        self.assertRaises(ValueError, get_hasher, 'md5')
+
+        # The hasher of the new passwords is the hasher of the application
+        self.assertTrue(make_password('password').startswith('pbkdf2_sha256$'))
+        with self.app.app_context():
+            self.assertTrue(
+                make_password('password').startswith('pbkdf2_fast$')
+            )
+
+    def test_0020_check_password(self):
+        """
+        The passwords which are not hashed by the hasher of the new
+        passwords, or with other parameters, are hashed again
+        """
+        with self.app.app_context():
+            encoded = get_hasher('sha1').encode('password')
+            self.assertEqual(
+                check_password('password', encoded), (True, True)
+            )
+            self.assertEqual(
+                check_password('wrong', encoded), (False, False)
+            )
+            self.assertEqual(check_password('', encoded), (False, False))
+
+            encoded = make_password('password')
+            self.assertEqual(
+                check_password('password', encoded), (True, False)
+            )
+            register_hasher(PBKDF2Hasher('pbkdf2_fast', iterations=20))
+            self.assertEqual(
+                check_password('password', encoded), (True, True)
+            )
+
+            # The passwords can be verified by a pool of threads
+            pool = VerificationPool(2)
+            self.assertEqual(
+                check_password('password', encoded, pool), (True, True)
+            )
+            self.assertEqual(
+                check_password('wrong', encoded, pool), (False, False)
+            )
+            self.assertTrue(pool.get_pool() is pool.get_pool())
+
+        self.assertRaises(ValueError, VerificationPool, 2, 'fiber')
+
+    def test_0030_production_cost(self):
+        """
+        The default hasher hashes with the iterations of production, while
+        the other tests use hashers with fewer iterations
+        """
+        hasher = PBKDF2Hasher()
+        encoded = hasher.encode(u'pässword')
+        self.assertEqual(encoded.split('$')[1], '100000')
+        self.assertTrue(hasher.verify(u'pässword', encoded))
+        self.assertFalse(hasher.needs_rehash(encoded))
+
+        # The hashes of the tests are hashed again in production
+        self.assertTrue(hasher.needs_rehash(
+            PBKDF2Hasher(iterations=1000).encode(u'pässword')
+        ))
+
+
+def suite():
+    "Password hashing test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestPasswords),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
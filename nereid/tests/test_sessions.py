@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from jinja2 import Markup
+
+from test_templates import BaseTestCase
+from trytond.tests.test_tryton import USER, DB_NAME, CONTEXT
+from trytond.transaction import Transaction
+from nereid import flash, get_flashed_messages
+from nereid.globals import request, session
+from nereid.sessions import NereidSessionInterface, MemcachedSessionStore, \
+    SQLiteSessionStore, LazySession, dumps, loads
+
+
+class TestSessionStore(BaseTestCase):
+    """
+    Test the stores of the sessions
+    """
+
+    def setUp(self):
+        super(TestSessionStore, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_app(self, **options):
+        options.setdefault('CACHE_TYPE', 'werkzeug.contrib.cache.SimpleCache')
+        app = super(TestSessionStore, self).get_app(**options)
+        if app.session_store_type == 'cache':
+            app.session_interface = NereidSessionInterface(
+                MemcachedSessionStore()
+            )
+        return app
+
+    def test_0010_serializers(self):
+        """
+        The sessions are marshalled, or pickled if they cannot be
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            app = self.get_app()
+
+            with app.app_context():
+                data = {'user_id': u'1', '_flashes': [('message', u'Hé')]}
+                self.assertTrue(dumps(data).startswith('m'))
+                self.assertEqual(loads(dumps(data)), data)
+
+                data['day'] = date(2015, 1, 1)
+                self.assertTrue(dumps(data).startswith('p'))
+                self.assertEqual(loads(dumps(data)), data)
+
+                # The subclasses of the builtin types are pickled too
+                data = {'_flashes': [('message', Markup(u'Saved <b>it</b>'))]}
+                self.assertTrue(dumps(data).startswith('p'))
+                message = loads(dumps(data))['_flashes'][0][1]
+                self.assertEqual(type(message), Markup)
+                self.assertEqual(message, Markup(u'Saved <b>it</b>'))
+
+                app.config['SESSION_SERIALIZER'] = 'pickle'
+                self.assertTrue(dumps({}).startswith('p'))
+                app.config['SESSION_SERIALIZER'] = 'json'
+                self.assertRaises(ValueError, dumps, {})
+                self.assertRaises(ValueError, loads, 'x')
+
+    def test_0015_flashed_markup(self):
+        """
+        A flashed markup is read back as markup from the store
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            interface = app.session_interface
+
+            with app.test_request_context('/'):
+                flash(Markup(u'Saved <b>order</b>'))
+                response = app.response_class()
+                interface.save_session(app, session, response)
+                sid = session.sid
+
+            headers = {'Cookie': '%s=%s' % (app.session_cookie_name, sid)}
+            with app.test_request_context('/', headers=headers):
+                messages = get_flashed_messages()
+                self.assertEqual(messages, [u'Saved <b>order</b>'])
+                self.assertEqual(type(messages[0]), Markup)
+
+    def test_0020_save_if_modified(self):
+        """
+        The sessions are written only if their data changed and are touched
+        once per interval
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            interface = app.session_interface
+            store = interface.session_store
+
+            with app.test_request_context('/'):
+                session = store.new()
+                response = app.response_class()
+                interface.save_session(app, session, response)
+                self.assertFalse('Set-Cookie' in response.headers)
+
+                session['user_id'] = u'1'
+                interface.save_session(app, session, response)
+                self.assertTrue(session.sid in response.headers['Set-Cookie'])
+                self.assertEqual(store.stats['writes'], 1)
+
+                session = store.get(session.sid)
+                self.assertEqual(session, {'user_id': u'1'})
+                self.assertFalse(store.save_if_modified(session))
+                session['user_id'] = u'1'
+                self.assertFalse(store.save_if_modified(session))
+                self.assertEqual(store.stats['skipped'], 2)
+
+                # The changes of the values of the session are written too
+                session['cart'] = []
+                self.assertTrue(store.save_if_modified(session))
+                session['cart'].append(1)
+                self.assertTrue(store.save_if_modified(session))
+                self.assertEqual(store.get(session.sid)['cart'], [1])
+                self.assertEqual(store.stats['writes'], 3)
+
+                session.written -= app.session_touch_interval
+                self.assertFalse(store.save_if_modified(session))
+                self.assertEqual(store.stats['touches'], 1)
+                self.assertTrue(
+                    time.time() - store.get(session.sid).written < 60
+                )
+                sid = session.sid
+
+            # The sessions of the other websites are not shared
+            with app.test_request_context('/', base_url='http://other.com'):
+                self.assertEqual(store.get(sid), {})
+
+            with app.test_request_context('/'):
+                store.delete(store.get(sid))
+                self.assertEqual(store.get(sid), {})
+                self.assertRaises(NotImplementedError, store.list)
+
+    def test_0025_previous_format(self):
+        """
+        The sessions kept in the cache by the previous versions are read
+        and moved to the current format
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            store = app.session_interface.session_store
+
+            with app.test_request_context('/'):
+                sid = store.new().sid
+                app.cache.set(sid, {'user_id': u'1'})
+
+                session = store.get(sid)
+                self.assertEqual(session, {'user_id': u'1'})
+                self.assertFalse(store.save_if_modified(session))
+                self.assertEqual(app.cache.get(sid), None)
+                self.assertEqual(
+                    store.get(sid).payload, session.payload
+                )
+                self.assertEqual(store.stats['hits'], 2)
+
+    def test_0027_two_tier_cache(self):
+        """
+        The sessions are kept in the shared tier of a two tier cache, so
+        that a logout on a worker is seen by the others at once
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app(
+                CACHE_TYPE='nereid.contrib.cache.TwoTierCache',
+                CACHE_SHARED_TYPE='werkzeug.contrib.cache.SimpleCache',
+            )
+            store = app.session_interface.session_store
+
+            with app.test_request_context('/'):
+                self.assertIs(store.cache, app.cache.shared)
+                session = store.new()
+                session['user_id'] = u'1'
+                store.save(session)
+                key = store.get_key(store.get_prefix(), session.sid)
+                self.assertEqual(app.cache.local.get(key), None)
+                self.assertEqual(store.get(session.sid), {'user_id': u'1'})
+                self.assertEqual(app.cache.local.get(key), None)
+
+                # The logout on another worker
+                app.cache.shared.delete(key)
+                self.assertEqual(store.get(session.sid), {})
+
+    def test_0030_sqlite(self):
+        """
+        The sessions are stored in a SQLite database which can be listed
+        and purged
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app(
+                SESSION_STORE='sqlite',
+                SESSION_SQLITE_PATH=os.path.join(self.tmpdir, 'sessions.db'),
+                SESSION_TIMEOUT=60,
+            )
+            store = app.session_interface.session_store
+            self.assertTrue(isinstance(store, SQLiteSessionStore))
+
+            with app.test_request_context('/'):
+                sessions = []
+                for i in range(3):
+                    session = store.new()
+                    session['user_id'] = i
+                    store.save(session)
+                    sessions.append(session)
+                prefix = store.get_prefix()
+                self.assertEqual(store.get(sessions[1].sid), {'user_id': 1})
+
+                # A session which expired
+                store.store(
+                    prefix, sessions[2].sid, sessions[2].payload,
+                    time.time() - 120
+                )
+                self.assertEqual(store.get(sessions[2].sid), {})
+                self.assertEqual(
+                    sorted(store.list()),
+                    sorted(s.sid for s in sessions[:2])
+                )
+                self.assertEqual(store.list('session-other.com-'), [])
+
+                self.assertEqual(store.purge(), 1)
+                store.delete(sessions[0])
+                self.assertEqual(store.list(prefix), [sessions[1].sid])
+                self.assertEqual(store.purge(expired_only=False), 1)
+                self.assertEqual(store.list(), [])
+
+        self.assertRaises(ValueError, self.get_app, SESSION_STORE='sqlite')
+        self.assertRaises(ValueError, self.get_app, SESSION_STORE='redis')
+
+    def test_0040_lazy_session(self):
+        """
+        The sessions are loaded the first time they are used, and are not
+        saved if they were not used
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            interface = app.session_interface
+            store = interface.session_store
+
+            with app.test_request_context('/'):
+                session = store.new()
+                session['user_id'] = u'1'
+                store.save(session)
+                sid = session.sid
+            headers = {'Cookie': '%s=%s' % (app.session_cookie_name, sid)}
+
+            with app.test_request_context('/', headers=headers):
+                session = interface.open_session(app, request)
+                self.assertTrue(isinstance(session, LazySession))
+                self.assertFalse(session.loaded)
+                interface.save_session(app, session, app.response_class())
+                self.assertEqual(store.stats['untouched'], 1)
+                self.assertEqual(store.stats['hits'], 0)
+
+                session = interface.open_session(app, request)
+                self.assertEqual(session.get('user_id'), u'1')
+                self.assertTrue(session.loaded)
+                self.assertEqual(store.stats['hits'], 1)
+                self.assertEqual(dict(session), {'user_id': u'1'})
+                interface.save_session(app, session, app.response_class())
+                self.assertEqual(store.stats['skipped'], 1)
+
+                session = interface.open_session(app, request)
+                session['cart'] = [1]
+                self.assertEqual(
+                    session, {'user_id': u'1', 'cart': [1]}
+                )
+                interface.save_session(app, session, app.response_class())
+                self.assertEqual(store.stats['writes'], 2)
+
+                # The store loads the sessions it saves
+                session = interface.open_session(app, request)
+                store.save(session)
+                self.assertTrue(session.loaded)
+                self.assertEqual(
+                    store.get(sid), {'user_id': u'1', 'cart': [1]}
+                )
+                self.assertEqual(store.stats['writes'], 3)
+
+            # The requests which do not use the session do not load it
+            with app.test_client() as c:
+                c.set_cookie('localhost', app.session_cookie_name, sid)
+                response = c.get('/countries')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(store.stats['untouched'], 2)
+                self.assertEqual(store.stats['hits'], 4)
+
+            headers = {'Cookie': '%s=%s' % (app.session_cookie_name, 'a' * 40)}
+            with app.test_request_context('/', headers=headers):
+                self.assertEqual(len(interface.open_session(app, request)), 0)
+                self.assertEqual(store.stats['misses'], 1)
+
+    def test_0050_cookie_sessions(self):
+        """
+        The small sessions are kept in signed cookies and the others in the
+        store
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app(SESSION_COOKIE_MAX_SIZE=500)
+            interface = app.session_interface
+            store = interface.session_store
+
+            def save(sess):
+                response = app.response_class()
+                interface.save_session(app, sess, response)
+                cookie = response.headers.get('Set-Cookie')
+                if cookie:
+                    return cookie.split(';')[0].split('=', 1)[1]
+
+            def load(value):
+                headers = {
+                    'Cookie': '%s=%s' % (app.session_cookie_name, value)
+                }
+                with app.test_request_context('/', headers=headers):
+                    sess = session._get_current_object()
+                    if isinstance(sess, LazySession):
+                        sess.load()
+                    return sess
+
+            with app.test_request_context('/'):
+                sess = store.new()
+                sess['user_id'] = u'1'
+                value = save(sess)
+                self.assertFalse(store.is_valid_key(value))
+                self.assertEqual(interface.stats['cookie_writes'], 1)
+                self.assertEqual(store.stats['writes'], 0)
+
+            sess = load(value)
+            self.assertTrue(sess.in_cookie)
+            self.assertEqual(sess, {'user_id': u'1'})
+            with app.test_request_context('/'):
+                self.assertEqual(save(sess), None)
+
+            # The cookies which are not signed are ignored. The last
+            # character of the signature holds padding bits, so a character
+            # which holds 6 bits of it is changed.
+            char = 'A' if value[-5] != 'A' else 'B'
+            self.assertEqual(load(value[:-5] + char + value[-4:]), {})
+            self.assertEqual(load('user_id=1'), {})
+            self.assertEqual(interface.stats['cookie_invalid'], 2)
+
+            # The large sessions are kept in the store
+            sess = load(value)
+            sess['data'] = os.urandom(300).encode('hex')
+            with app.test_request_context('/'):
+                sid = save(sess)
+                self.assertEqual(sid, sess.sid)
+                self.assertEqual(store.stats['writes'], 1)
+                self.assertEqual(interface.stats['cookie_fallbacks'], 1)
+
+            # And move back to the cookies when they get smaller
+            sess = load(sid)
+            self.assertEqual(len(sess['data']), 600)
+            del sess['data']
+            with app.test_request_context('/'):
+                value = save(sess)
+                self.assertFalse(store.is_valid_key(value))
+                self.assertEqual(store.get(sid), {})
+
+            # The sessions which can only be pickled are kept in the store
+            sess = load(value)
+            sess['day'] = date(2015, 1, 1)
+            with app.test_request_context('/'):
+                self.assertEqual(save(sess), sess.sid)
+                self.assertEqual(interface.stats['cookie_fallbacks'], 2)
+
+            # Like the flashed markup
+            sess = load(value)
+            sess['_flashes'] = [('message', Markup(u'Saved <b>it</b>'))]
+            with app.test_request_context('/'):
+                sid = save(sess)
+                self.assertEqual(sid, sess.sid)
+                self.assertEqual(interface.stats['cookie_fallbacks'], 3)
+            message = load(sid)['_flashes'][0][1]
+            self.assertEqual(type(message), Markup)
+            self.assertEqual(message, Markup(u'Saved <b>it</b>'))
+
+            sess = load(value)
+            sess.clear()
+            with app.test_request_context('/'):
+                self.assertEqual(save(sess), '')
+
+
+def suite():
+    "Session store test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestSessionStore),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import os
+import unittest
+
+import trytond.tests.test_tryton
+from trytond import backend
+from trytond.cache import Cache
+from trytond.config import config
+from trytond.transaction import Transaction
+from trytond.tests.test_tryton import POOL, USER, DB, DB_NAME, CONTEXT
+from werkzeug.contrib.sessions import FilesystemSessionStore
+from nereid import Nereid
+from nereid.signals import transaction_start
+from nereid.sessions import Session
+from nereid.contrib.locale import Babel
+
+
+class SingleTransactionApp(Nereid):
+    """
+    A Nereid app which dispatches the requests with the real dispatcher and
+    records the transactions it starts
+    """
+
+    def __init__(self, **config):
+        super(SingleTransactionApp, self).__init__(**config)
+        self.transactions = []
+
+    def load_backend(self):
+        """
+        Just reuse the pool and DB already loaded by the tryton test loader
+        """
+        self._database = DB
+        self._pool = POOL
+
+    def start_transaction(self, user=0, readonly=False, context=None):
+        self.transactions.append(readonly)
+        return super(SingleTransactionApp, self).start_transaction(
+            user, readonly=readonly, context=context
+        )
+
+
+class TestSingleTransactionDispatch(unittest.TestCase):
+    """
+    Test the dispatch of the requests in a single transaction
+
+    The requests run in the transactions of the dispatcher, so the website
+    is committed by setUp and deleted by tearDown.
+    """
+
+    def setUp(self):
+        trytond.tests.test_tryton.install_module('nereid_test')
+        self.retry = config.get('database', 'retry')
+
+        with Transaction().start(DB_NAME, USER, CONTEXT) as txn:
+            Currency = POOL.get('currency.currency')
+            Party = POOL.get('party.party')
+            Company = POOL.get('company.company')
+            Language = POOL.get('ir.lang')
+            Locale = POOL.get('nereid.website.locale')
+            Website = POOL.get('nereid.website')
+
+            usd, = Currency.create([{
+                'name': 'US Dollar',
+                'code': 'USD',
+                'symbol': '$',
+            }])
+            party, = Party.create([{'name': 'Openlabs'}])
+            company, = Company.create([{
+                'party': party,
+                'currency': usd,
+            }])
+            en_us, = Language.search([('code', '=', 'en_US')])
+            locale, = Locale.create([{
+                'code': 'en_US',
+                'language': en_us,
+                'currency': usd,
+            }])
+            website, = Website.create([{
+                'name': 'localhost',
+                'company': company,
+                'application_user': USER,
+                'default_locale': locale,
+            }])
+            self.records = [
+                ('nereid.website', website.id),
+                ('nereid.website.locale', locale.id),
+                ('company.company', company.id),
+                ('party.party', party.id),
+                ('currency.currency', usd.id),
+            ]
+            txn.cursor.commit()
+
+    def tearDown(self):
+        config.set('database', 'retry', self.retry)
+        with Transaction().start(DB_NAME, USER, CONTEXT) as txn:
+            TestModel = POOL.get('nereid.test.test_model')
+            TestModel.delete(TestModel.search([]))
+            for model, id_ in self.records:
+                Model = POOL.get(model)
+                Model.delete([Model(id_)])
+            txn.cursor.commit()
+
+    def get_app(self, **options):
+        app = SingleTransactionApp(
+            template_folder=os.path.abspath(
+                os.path.join(os.path.dirname(__file__), 'templates')
+            )
+        )
+        options.setdefault('SECRET_KEY', 'secret-key')
+        options.setdefault('SINGLE_TRANSACTION_DISPATCH', True)
+        options.setdefault('WTF_CSRF_ENABLED', False)
+        app.config['TEMPLATE_PREFIX_WEBSITE_NAME'] = False
+        app.config.update(options)
+        app.config['DATABASE_NAME'] = DB_NAME
+        app.config['DEBUG'] = True
+        app.session_interface.session_store = \
+            FilesystemSessionStore('/tmp', session_class=Session)
+
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            app.initialise()
+        Babel(app)
+
+        # Publish the resets of the caches made by setUp
+        app.synchronise_caches()
+        del app.transactions[:]
+        return app
+
+    def test_0010_reuse_transaction(self):
+        """
+        The transaction of the request context runs the view of a readonly
+        rule
+        """
+        app = self.get_app()
+
+        with app.test_client() as c:
+            response = c.get('/gen-csrf')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(app.transactions, [True])
+        self.assertEqual(Transaction().cursor, None)
+
+    def test_0020_writing_rule(self):
+        """
+        The readonly transaction of the request context is replaced by a
+        transaction which can write for the rules which are not readonly
+        """
+        app = self.get_app()
+
+        with app.test_client() as c:
+            response = c.get('/test-write')
+            self.assertEqual(response.status_code, 200)
+            record_id = int(response.data)
+
+            response = c.post('/test-write')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(app.transactions, [True, False, False])
+
+        # The writes were committed
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            TestModel = POOL.get('nereid.test.test_model')
+            self.assertEqual(
+                TestModel.search([('id', '=', record_id)]), [
+                    TestModel(record_id)
+                ]
+            )
+
+    def test_0030_retry(self):
+        """
+        The view is retried in new transactions on operational errors
+        """
+        DatabaseOperationalError = backend.get('DatabaseOperationalError')
+        config.set('database', 'retry', '2')
+        app = self.get_app()
+        starts = []
+
+        def count(sender):
+            starts.append(sender)
+        transaction_start.connect(count, app)
+
+        with app.test_client() as c:
+            self.assertRaises(
+                DatabaseOperationalError,
+                c.get, '/fail-with-transaction-error'
+            )
+        transaction_start.disconnect(count, app)
+        self.assertEqual(len(starts), 3)
+        self.assertEqual(app.transactions, [True, True, True])
+        self.assertEqual(Transaction().cursor, None)
+
+    def test_0040_pending_resets(self):
+        """
+        The pending resets of the caches are published in a transaction of
+        their own before the transaction of the request
+        """
+        app = self.get_app()
+        Cache.reset(DB_NAME, 'test.pending_resets')
+
+        with app.test_client() as c:
+            response = c.get('/gen-csrf')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(app.transactions, [False, True])
+        self.assertFalse(app.cache_sync.resets_due())
+
+
+def suite():
+    "Single transaction dispatch test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(
+            TestSingleTransactionDispatch
+        ),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
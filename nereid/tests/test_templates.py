@@ -15,6 +15,8 @@ from nereid import render_template, LazyRenderer, render_email
 from nereid.testing import NereidTestCase, NereidTestApp
 from nereid.sessions import Session
 from nereid.contrib.locale import Babel
+from nereid.signals import fragment_cache_render, fragment_cache_wait
+from nereid.cachetags import get_tag
 from werkzeug.contrib.sessions import FilesystemSessionStore
 
 
@@ -529,12 +531,133 @@ class TestLazyRendering(BaseTestCase):
                 self.assertEqual(response.status_code, 201)
 
 
+class TestFragmentCache(BaseTestCase):
+    """
+    Test the cache tag of the templates
+    """
+
+    def get_app(self, **options):
+        options.setdefault('CACHE_TYPE', 'werkzeug.contrib.cache.SimpleCache')
+        return super(TestFragmentCache, self).get_app(**options)
+
+    def test_0010_key(self):
+        """
+        The fragments vary on the language of the request and the vary list
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            template = app.jinja_env.from_string(
+                "{% cache 'greeting', 60, vary=[name] %}"
+                "{{ greeting }} {{ name }}"
+                "{% endcache %}"
+            )
+
+            with app.test_request_context('/'):
+                self.assertEqual(
+                    template.render(greeting='Hello', name='Jon'), 'Hello Jon'
+                )
+                self.assertEqual(
+                    template.render(greeting='Hi', name='Jon'), 'Hello Jon'
+                )
+                self.assertEqual(
+                    template.render(greeting='Hi', name='Ned'), 'Hi Ned'
+                )
+                with Transaction().set_context(language='fr_FR'):
+                    self.assertEqual(
+                        template.render(greeting='Salut', name='Jon'),
+                        'Salut Jon'
+                    )
+
+    def test_0020_stampede(self):
+        """
+        A single worker renders an expired fragment
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app(FRAGMENT_CACHE_LOCK_TIMEOUT=1)
+            template = app.jinja_env.from_string(
+                "{% cache 'greeting', 60 %}{{ greeting }}{% endcache %}"
+            )
+            extension = app.jinja_env.extensions[
+                'nereid.templating.FragmentCacheExtension'
+            ]
+            renders, waits = [], []
+
+            def record_render(app, name, render_time):
+                renders.append(name)
+
+            def record_wait(app, name, wait_time, stale):
+                waits.append(stale)
+
+            with app.test_request_context('/'), \
+                    fragment_cache_render.connected_to(record_render), \
+                    fragment_cache_wait.connected_to(record_wait):
+                self.assertEqual(template.render(greeting='Hello'), 'Hello')
+                self.assertEqual(renders, ['greeting'])
+
+                # Expire the fragment while another worker renders it
+                key = extension._get_key('greeting', None)
+                rv, versions, expires = app.cache.get(key)
+                app.cache.set(key, (rv, versions, 0))
+                app.cache.add(key + '-lock', True)
+                self.assertEqual(template.render(greeting='Hi'), 'Hello')
+                self.assertEqual(waits, [True])
+
+                # Without a fragment to serve, the worker waits for the lock
+                app.cache.delete(key)
+                app.cache.set(key + '-lock', True, 0.1)
+                self.assertEqual(template.render(greeting='Hi'), 'Hi')
+                self.assertEqual(waits, [True, False])
+                self.assertEqual(renders, ['greeting', 'greeting'])
+
+                self.assertEqual(template.render(greeting='Hey'), 'Hi')
+
+    def test_0030_write_during_render(self):
+        """
+        A fragment is discarded if a record it shows changed while it was
+        being rendered, and is keyed without a transaction context
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            tag = get_tag('party.party', self.party.id)
+            renders = []
+
+            def render():
+                renders.append(1)
+                if len(renders) == 1:
+                    # Another worker writes the record while it is rendered
+                    app.cache_tags.bump([tag])
+                return 'Openlabs'
+
+            template = app.jinja_env.from_string(
+                "{% cache 'party', 60, tags=[tag] %}"
+                "{{ render() }}"
+                "{% endcache %}"
+            )
+            with app.test_request_context('/'):
+                for i in range(3):
+                    self.assertEqual(
+                        template.render(tag=tag, render=render), 'Openlabs'
+                    )
+                self.assertEqual(len(renders), 2)
+
+                with Transaction().set_context():
+                    Transaction().context = None
+                    extension = app.jinja_env.extensions[
+                        'nereid.templating.FragmentCacheExtension'
+                    ]
+                    self.assertTrue(extension._get_key('party', None))
+
+
 def suite():
     "Nereid Template Loading test suite"
     test_suite = unittest.TestSuite()
     test_suite.addTests([
         unittest.TestLoader().loadTestsFromTestCase(TestTemplateLoading),
         unittest.TestLoader().loadTestsFromTestCase(TestLazyRendering),
+        unittest.TestLoader().loadTestsFromTestCase(TestFragmentCache),
     ])
     return test_suite
 
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import unittest
+
+from test_templates import BaseTestCase
+from trytond.tests.test_tryton import USER, DB_NAME, CONTEXT
+from trytond.transaction import Transaction
+from nereid import throttle as throttle_module
+from nereid.throttle import LoginThrottle
+from nereid.signals import failed_login
+from nereid.globals import request
+
+
+class TestLoginThrottle(BaseTestCase):
+    """
+    Test the throttling of the logins
+    """
+
+    def get_app(self, **options):
+        options.setdefault('CACHE_TYPE', 'werkzeug.contrib.cache.SimpleCache')
+        options.setdefault('LOGIN_THROTTLE_IP_LIMIT', 5)
+        options.setdefault('LOGIN_THROTTLE_EMAIL_LIMIT', 3)
+        return super(TestLoginThrottle, self).get_app(**options)
+
+    def setUp(self):
+        super(TestLoginThrottle, self).setUp()
+        self.now = 1000 * 300
+        self._time = throttle_module.time
+        throttle_module.time = lambda: self.now
+
+    def tearDown(self):
+        throttle_module.time = self._time
+
+    def test_0010_limits(self):
+        """
+        The logins are blocked once the failures are over a limit, in the
+        worker and in the other workers
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            app = self.get_app()
+            throttle = app.login_throttle
+
+            for i in range(3):
+                self.assertFalse(throttle.is_blocked('1.1.1.1', 'a@b.com'))
+                throttle.record_failure('1.1.1.1', 'a@b.com')
+            self.assertTrue(throttle.is_blocked('1.1.1.1', 'a@b.com'))
+            self.assertTrue(throttle.is_blocked('2.2.2.2', 'A@b.com'))
+            self.assertFalse(throttle.is_blocked('1.1.1.1', 'c@d.com'))
+
+            for i in range(2):
+                throttle.record_failure('1.1.1.1', 'c@d.com')
+            self.assertTrue(throttle.is_blocked('1.1.1.1', 'e@f.com'))
+            self.assertFalse(throttle.is_blocked('2.2.2.2', 'e@f.com'))
+            self.assertEqual(throttle.stats, {
+                'rejected': 3, 'unknown': 0, 'failures': 5,
+            })
+
+            # The other workers read the counts of the shared cache
+            other = LoginThrottle(app)
+            self.assertTrue(other.is_blocked('2.2.2.2', 'a@b.com'))
+            self.assertFalse(other.is_blocked('2.2.2.2', 'c@d.com'))
+
+    def test_0020_sliding_window(self):
+        """
+        The failures of the previous window count less as it slides out
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            app = self.get_app()
+            throttle = app.login_throttle
+
+            for i in range(3):
+                throttle.record_failure('1.1.1.1', 'a@b.com')
+
+            # 80% of the previous window is still in the sliding window
+            self.now += 300 + 60
+            self.assertFalse(throttle.is_blocked(None, 'a@b.com'))
+            throttle.record_failure(None, 'a@b.com')
+            self.assertTrue(throttle.is_blocked(None, 'a@b.com'))
+            self.now += 120
+            self.assertFalse(throttle.is_blocked(None, 'a@b.com'))
+
+            self.now += 300
+            self.assertFalse(throttle.is_blocked(None, 'a@b.com'))
+            self.assertFalse(LoginThrottle(app).is_blocked(None, 'a@b.com'))
+
+    def test_0030_failed_login(self):
+        """
+        The failures of the login view are recorded from the signal
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            other = self.get_app()
+
+            with app.test_request_context('/login', method='POST'):
+                failed_login.send(form=type('Form', (), {
+                    'email': type('Field', (), {'data': 'a@b.com'}),
+                }))
+            self.assertEqual(app.login_throttle.stats['failures'], 1)
+            self.assertEqual(other.login_throttle.stats['failures'], 0)
+
+            # The logins rejected by the throttle are not counted again
+            with app.test_request_context('/login', method='POST'):
+                request.login_rejected = True
+                failed_login.send(form=None)
+            self.assertEqual(app.login_throttle.stats['failures'], 1)
+
+    def test_0040_unknown_emails(self):
+        """
+        The emails without user are remembered until they are forgotten
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            app = self.get_app()
+            throttle = app.login_throttle
+
+            self.assertFalse(throttle.is_unknown(1, 'a@b.com'))
+            throttle.remember_unknown(1, 'a@b.com')
+            self.assertTrue(throttle.is_unknown(1, 'a@b.com'))
+            self.assertFalse(throttle.is_unknown(2, 'a@b.com'))
+
+            throttle.forget_unknown([(1, 'a@b.com')])
+            self.assertFalse(throttle.is_unknown(1, 'a@b.com'))
+
+            app.config['LOGIN_UNKNOWN_EMAIL_TIMEOUT'] = 0
+            throttle.remember_unknown(1, 'a@b.com')
+            self.assertFalse(throttle.is_unknown(1, 'a@b.com'))
+
+
+def suite():
+    "Login throttling test suite"
+    test_suite = unittest.TestSuite()
+    test_suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestLoginThrottle),
+    ])
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,216 @@
+# This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+    Throttling of the logins.
+
+    The failed logins are counted per IP address and per email over a
+    sliding window of `LOGIN_THROTTLE_WINDOW` seconds, in the memory of the
+    worker and in the cache of the application (`app.cache`) which the
+    workers share. Once an address or an email is over its limit, the
+    logins are rejected before the user is searched and the password is
+    hashed.
+
+    The failures are recorded from the `failed_login` signal of the login
+    view and by the Basic authentication. The logins rejected by the
+    throttle, which set `request.login_rejected`, are not counted again.
+
+    The limit per IP address is off by default. Behind a reverse proxy,
+    `request.remote_addr` is the address of the proxy for all the logins,
+    so the application must be wrapped with
+    :class:`werkzeug.contrib.fixers.ProxyFix` (and only behind a proxy
+    which is trusted to set `X-Forwarded-For`) before the limit is set.
+
+    The emails for which there is no user are also remembered for
+    `LOGIN_UNKNOWN_EMAIL_TIMEOUT` seconds, so that the logins with unknown
+    emails, like in credential stuffing, do not search the users either.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from time import time
+
+from flask.ctx import has_request_context
+from flask.globals import current_app, request
+
+from .signals import failed_login
+
+__all__ = ['LoginThrottle']
+
+
+def _digest(*args):
+    return hashlib.md5('\0'.join(
+        arg.encode('utf-8') if isinstance(arg, unicode) else str(arg)
+        for arg in args
+    )).hexdigest()
+
+
+class LoginThrottle(object):
+    """
+    The login throttle of a nereid application.
+
+    The sliding window is approximated with the counts of the current and
+    of the previous fixed windows, the latter weighted by the part of it
+    which is still in the sliding window.
+
+    :param app: The nereid application
+    """
+
+    #: The maximum number of counters kept in the memory of the worker
+    threshold = 10000
+
+    def __init__(self, app):
+        self.app = app
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+        #: The number of logins rejected because of the limits and because
+        #: the email is unknown, and the number of failures recorded
+        self.stats = {'rejected': 0, 'unknown': 0, 'failures': 0}
+
+        failed_login.connect(self.on_failed_login)
+
+    @property
+    def cache(self):
+        return self.app.cache
+
+    def get_limits(self, ip, email):
+        """
+        Returns the list of the keys of the counters of the login with their
+        limit
+        """
+        limits = []
+        if self.app.login_throttle_ip_limit and ip:
+            limits.append((_digest('ip', ip), self.app.login_throttle_ip_limit))
+        if self.app.login_throttle_email_limit and email:
+            limits.append((
+                _digest('email', email.lower()),
+                self.app.login_throttle_email_limit
+            ))
+        return limits
+
+    def get_key(self, key, window):
+        return '%sthrottle-%s-%d' % (self.app.cache_key_prefix, key, window)
+
+    def _windows(self):
+        """
+        Returns the index of the current fixed window and the weight of the
+        previous one
+        """
+        now = time() / float(self.app.login_throttle_window)
+        window = int(now)
+        return window, 1 - (now - window)
+
+    def is_blocked(self, ip, email):
+        """
+        Returns True if the login from the IP address with the email is
+        over a limit. The counters of the worker are checked first, so the
+        shared cache is read only if they are under the limits.
+        """
+        limits = self.get_limits(ip, email)
+        if not limits:
+            return False
+        window, weight = self._windows()
+
+        with self._lock:
+            local = [self._local_count(key, window) for key, limit in limits]
+        counts = [
+            current + previous * weight for current, previous in local
+        ]
+        if all(count < limit for count, (key, limit) in zip(counts, limits)):
+            keys = []
+            for key, limit in limits:
+                keys.extend([
+                    self.get_key(key, window), self.get_key(key, window - 1)
+                ])
+            values = [value or 0 for value in self.cache.get_many(*keys)]
+            counts = [
+                max(count, values[2 * i] + values[2 * i + 1] * weight)
+                for i, count in enumerate(counts)
+            ]
+        if any(count >= limit for count, (key, limit) in zip(counts, limits)):
+            self.stats['rejected'] += 1
+            return True
+        return False
+
+    def _local_count(self, key, window):
+        counter = self._counters.get(key)
+        if counter is None or counter[0] < window - 1:
+            return 0, 0
+        if counter[0] == window - 1:
+            return 0, counter[1]
+        return counter[1], counter[2]
+
+    def record_failure(self, ip, email):
+        """
+        Count a failed login from the IP address with the email
+        """
+        limits = self.get_limits(ip, email)
+        if not limits:
+            return
+        window, weight = self._windows()
+        self.stats['failures'] += 1
+
+        with self._lock:
+            for key, limit in limits:
+                current, previous = self._local_count(key, window)
+                self._counters.pop(key, None)
+                self._counters[key] = (window, current + 1, previous)
+            while len(self._counters) > self.threshold:
+                self._counters.popitem(last=False)
+
+        timeout = 2 * self.app.login_throttle_window
+        for key, limit in limits:
+            key = self.get_key(key, window)
+            if not self.cache.add(key, 1, timeout):
+                self.cache.inc(key)
+
+    def on_failed_login(self, sender, form=None, **kwargs):
+        """
+        Count the failed login of the login view of the application
+        """
+        if not has_request_context() or \
+                current_app._get_current_object() is not self.app:
+            return
+        if getattr(request, 'login_rejected', False):
+            # The login was rejected by the throttle, and was not attempted
+            return
+        email = form.email.data if form is not None else None
+        self.record_failure(request.remote_addr, email)
+
+    def get_unknown_key(self, company, email):
+        return '%sunknown-email-%s' % (
+            self.app.cache_key_prefix, _digest(company, email)
+        )
+
+    def is_unknown(self, company, email):
+        """
+        Returns True if there was no user with the email in the company
+        the last time it was searched
+        """
+        if not self.app.login_unknown_email_timeout:
+            return False
+        if self.cache.get(self.get_unknown_key(company, email)):
+            self.stats['unknown'] += 1
+            return True
+        return False
+
+    def remember_unknown(self, company, email):
+        """
+        Remember that there is no user with the email in the company
+        """
+        if self.app.login_unknown_email_timeout:
+            self.cache.set(
+                self.get_unknown_key(company, email), True,
+                self.app.login_unknown_email_timeout
+            )
+
+    def forget_unknown(self, emails):
+        """
+        Forget the unknown emails of the list of tuples of the company and
+        the email, like when users are created with them
+        """
+        if emails:
+            self.cache.delete_many(*[
+                self.get_unknown_key(company, email)
+                for company, email in emails
+            ])
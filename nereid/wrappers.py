@@ -6,8 +6,11 @@ from werkzeug._internal import _missing
 from flask.wrappers import Request as RequestBase, Response as ResponseBase
 from flask.ext.login import current_user
 
-from .globals import current_app, request
+from .globals import current_app, request, _request_ctx_stack
 from .signals import transaction_stop
+from .cachetags import RequestTags
+from .helpers import URLBuilder
+from .memo import RequestMemo
 
 
 class cached_property(object):
@@ -62,14 +65,28 @@ class Request(RequestBase):
         super(Request, self).__init__(*args, **kwargs)
         self.__dictcache__ = {}
 
+        #: The tags of the page of this request, like the tags of the
+        #: records it shows. See :mod:`nereid.cachetags`.
+        self.cache_tags = RequestTags()
+
+        #: The results of the functions memoized for this request. See
+        #: :mod:`nereid.memo`.
+        self.memo = RequestMemo()
+
+        #: True if a login of this request was rejected by the login
+        #: throttle without checking the password. See
+        #: :mod:`nereid.throttle`.
+        self.login_rejected = False
+
     @staticmethod
     @transaction_stop.connect
     def clear_dictcache(app):
         """
         Clears the dictcache which stored the cached values of the records
-        below.
+        below, and the results memoized for the transaction.
         """
         request.__dictcache__ = {}
+        request.memo.clear('transaction')
 
     @cached_property
     def nereid_website(self):
@@ -79,6 +96,17 @@ class Request(RequestBase):
         Website = current_app.pool.get('nereid.website')
         return Website.get_from_host(self.host)
 
+    @cached_property
+    def url_builder(self):
+        """
+        The :class:`~nereid.helpers.URLBuilder` which builds the URLs of
+        this request.
+        """
+        return URLBuilder(
+            self, current_app._get_current_object(),
+            _request_ctx_stack.top.url_adapter
+        )
+
     @cached_property
     def nereid_user(self):
         """Fetch the browse record of current user or None."""
@@ -2,7 +2,7 @@
 # this repository contains the full copyright notices and license terms.
 
 from trytond.pool import Pool
-from model import TestModel
+from model import TestModel, Party
 
 
 def register():
@@ -11,5 +11,6 @@ def register():
     """
     Pool.register(
         TestModel,
+        Party,
         module='nereid_test', type_='model',
     )
@@ -1,18 +1,25 @@
 # This file is part of Tryton & Nereid. The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 from trytond.model import ModelSQL, fields
-from trytond.pool import Pool
+from trytond.pool import Pool, PoolMeta
 from flask_wtf import Form
 from flask_wtf.csrf import generate_csrf
 from wtforms import StringField
 from wtforms.validators import DataRequired
 from nereid import route
+from nereid.cachetags import CacheTagsMixin
 
 
 class MyForm(Form):
     name = StringField("Name", validators=[DataRequired()])
 
 
+class Party(CacheTagsMixin):
+    "Invalidate the cache tags of the parties"
+    __metaclass__ = PoolMeta
+    __name__ = 'party.party'
+
+
 class TestModel(ModelSQL):
     """A Tryton model which uses Pagination which could be used for
     testing."""
@@ -30,6 +37,15 @@ class TestModel(ModelSQL):
         DatabaseOperationalError = backend.get('DatabaseOperationalError')
         raise DatabaseOperationalError()
 
+    @classmethod
+    @route('/test-write', methods=['GET', 'POST'], readonly=False)
+    def test_write(cls):
+        """
+        Create a record, even from a GET request
+        """
+        record, = cls.create([{'name': 'Test'}])
+        return '%d' % record.id
+
     @classmethod
     @route('/test-lazy-renderer')
     def test_lazy_renderer(cls):
@@ -5,7 +5,7 @@ from trytond.pool import Pool
 from .party import Address, Party, ContactMechanism
 from .user import NereidUser, Permission, UserPermission, NereidAnonymousUser
 from .website import WebSite, WebSiteLocale, WebsiteCountry, \
-    WebsiteCurrency, WebsiteWebsiteLocale
+    WebsiteCurrency, WebsiteWebsiteLocale, Lang
 from .static_file import NereidStaticFolder, NereidStaticFile
 from .currency import Currency
 from .configuration import NereidConfigStart, NereidConfig
@@ -29,6 +29,7 @@ def register():
         WebsiteCountry,
         WebsiteCurrency,
         WebsiteWebsiteLocale,
+        Lang,
         NereidStaticFolder,
         NereidStaticFile,
         Currency,
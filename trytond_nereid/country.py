@@ -6,7 +6,7 @@
     :license: BSD, see LICENSE for more details.
 """
 from trytond.pool import PoolMeta, Pool
-from nereid import jsonify, route
+from nereid import jsonify, route, request_memoize
 
 __metaclass__ = PoolMeta
 
@@ -28,6 +28,7 @@ class Country:
             country.serialize() for country in cls.search([])
         ])
 
+    @request_memoize(copy=True)
     def serialize(self, purpose=None):
         """
         Serialize country data
@@ -5,13 +5,15 @@ import urllib
 import unittest
 import base64
 import json
+import hashlib
 
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import POOL, USER, DB_NAME, CONTEXT
 from trytond.transaction import Transaction
 from trytond.config import config
+from trytond.cache import Cache
 from nereid.testing import NereidTestCase
-from nereid import permissions_required
+from nereid import permissions_required, request
 from werkzeug.exceptions import Forbidden
 
 config.set('email', 'from', 'from@xyz.com')
@@ -34,6 +36,10 @@ class TestAuth(NereidTestCase):
         self.language_obj = POOL.get('ir.lang')
         self.party_obj = POOL.get('party.party')
 
+        # The per worker caches, like the verified credentials, outlive the
+        # transactions of the tests
+        Cache.drop(DB_NAME)
+
     def setup_defaults(self):
         """
         Setup the defaults
@@ -240,6 +246,49 @@ class TestAuth(NereidTestCase):
             }])
             self.assertTrue(registered_user.match_password('password'))
 
+    def test_0016_rehash_password(self):
+        """
+        The passwords hashed by the previous versions or by another hasher
+        are hashed again when the user logs in
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app(PASSWORD_HASHER='pbkdf2_sha512')
+
+            nereid_user, = self.nereid_user_obj.create([{
+                'party': self.party_obj.create([{'name': 'User'}])[0],
+                'display_name': 'User',
+                'email': 'user@example.com',
+                'password': 'password',
+                'company': self.company,
+            }])
+            self.assertTrue(
+                nereid_user.password.startswith('pbkdf2_sha256$')
+            )
+
+            # The salted sha1 of the previous versions
+            user_table = self.nereid_user_obj.__table__()
+            Transaction().cursor.execute(*user_table.update(
+                [user_table.password, user_table.salt],
+                [hashlib.sha1('passwordabcdefgh').hexdigest(), 'abcdefgh'],
+                where=user_table.id == nereid_user.id
+            ))
+            Transaction().cursor.cache.clear()
+            nereid_user = self.nereid_user_obj(nereid_user.id)
+
+            with app.test_request_context('/login', method='POST'):
+                self.assertFalse(nereid_user.match_password('wrong'))
+                self.assertTrue(nereid_user.match_password('password'))
+
+            nereid_user = self.nereid_user_obj(nereid_user.id)
+            self.assertTrue(
+                nereid_user.password.startswith('pbkdf2_sha512$')
+            )
+            self.assertIsNone(nereid_user.salt)
+            with app.test_request_context('/login', method='POST'):
+                self.assertTrue(nereid_user.match_password('password'))
+                self.assertFalse(nereid_user.match_password('wrong'))
+
     def test_0015_verify_email(self):
         """
         Check that the verification of email is working
@@ -814,6 +863,71 @@ class TestAuth(NereidTestCase):
                 perm_any=[p3.value, p4.value]
             ))
 
+    def test_0105_permissions_cache(self):
+        """
+        The permissions are cached per worker and in the cache of the
+        application, and read at once for many users
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app(
+                CACHE_TYPE='werkzeug.contrib.cache.SimpleCache'
+            )
+            stats = self.nereid_user_obj.permissions_stats
+
+            user1, user2 = self.nereid_user_obj.create([{
+                'party': self.party_obj.create([{'name': 'User %d' % i}])[0],
+                'display_name': 'User %d' % i,
+                'email': 'user%d@example.com' % i,
+                'password': 'password',
+                'company': self.company,
+            } for i in (1, 2)])
+            p1, p2 = self.nereid_permission_obj.create([
+                {'name': 'p1', 'value': 'nereid.perm1'},
+                {'name': 'p2', 'value': 'nereid.perm2'},
+            ])
+            self.nereid_user_obj.write([user1], {
+                'permissions': [('add', [p1, p2])]
+            })
+
+            with app.test_request_context('/'):
+                misses = stats['misses']
+                self.assertEqual(
+                    self.nereid_user_obj.has_permissions_many(
+                        [user1, user2], perm_any=['nereid.perm2']
+                    ), [True, False]
+                )
+                self.assertEqual(stats['misses'], misses + 2)
+
+                local_hits = stats['local_hits']
+                self.assertEqual(
+                    user1.get_permissions_many([user1])[user1.id],
+                    frozenset(['nereid.perm1', 'nereid.perm2'])
+                )
+                self.assertEqual(stats['local_hits'], local_hits + 1)
+
+                # Another worker finds the permissions in the shared cache
+                self.nereid_user_obj._permissions_cache.clear()
+                shared_hits = stats['shared_hits']
+                self.nereid_user_obj.get_permissions_many([user1, user2])
+                self.assertEqual(stats['shared_hits'], shared_hits + 2)
+
+            # Changing the permissions invalidates both caches
+            with app.test_request_context('/'):
+                self.nereid_user_obj.write([user1], {
+                    'permissions': [('remove', [p2])]
+                })
+                self.assertFalse(user1.has_permissions(
+                    perm_any=['nereid.perm2']
+                ))
+                self.nereid_permission_obj.write([p1], {
+                    'value': 'nereid.admin',
+                })
+                self.assertEqual(
+                    self.nereid_user_obj.get_permissions_many([user1]),
+                    {user1.id: frozenset(['nereid.admin'])}
+                )
+
     def test_0110_user_management(self):
         """
         ensure that the cookie gets cleared if the user in session
@@ -848,6 +962,37 @@ class TestAuth(NereidTestCase):
                 response = c.get('/me')
                 self.assertEqual(response.status_code, 302)
 
+    def test_0115_load_user(self):
+        """
+        The users of the sessions are looked up once per worker, inactive
+        users included, and deleted users are not loaded
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+
+            nereid_user, = self.nereid_user_obj.create([{
+                'party': self.party_obj.create([{'name': 'User'}])[0],
+                'display_name': 'User',
+                'email': 'user@example.com',
+                'password': 'password',
+                'company': self.company,
+                'active': False,
+            }])
+            load_user = self.nereid_user_obj.load_user
+
+            self.assertIsNone(load_user(u'abc'))
+            self.assertIsNone(load_user(unicode(nereid_user.id + 1)))
+            self.assertEqual(load_user(unicode(nereid_user.id)), nereid_user)
+            self.assertTrue(
+                self.nereid_user_obj._exists_cache.get(nereid_user.id)
+            )
+            self.assertEqual(
+                load_user(unicode(nereid_user.id)).display_name, 'User'
+            )
+
+            self.nereid_user_obj.delete([nereid_user])
+            self.assertIsNone(load_user(unicode(nereid_user.id)))
+
     def test_200_basic_authentication(self):
         """
         Test if basic authentication works
@@ -1030,6 +1175,130 @@ class TestAuth(NereidTestCase):
                 )
                 self.assertEqual(response.status_code, 302)
 
+    def test_215_credentials_cache(self):
+        """
+        The verified tokens and Basic credentials are remembered until the
+        password of the user changes
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+
+            party, = self.party_obj.create([{'name': 'Registered user'}])
+            nereid_user, = self.nereid_user_obj.create([{
+                'party': party,
+                'display_name': 'Registered User',
+                'email': 'email@example.com',
+                'password': 'password',
+                'company': self.company,
+            }])
+            credentials_cache = self.nereid_user_obj._credentials_cache
+            basic_auth = 'Basic ' + base64.b64encode(
+                b'email@example.com:password'
+            )
+
+            with app.test_request_context('/'):
+                token = nereid_user.get_auth_token()
+                self.assertTrue(
+                    self.nereid_user_obj.get_token_serializer() is
+                    self.nereid_user_obj.get_token_serializer()
+                )
+
+            with app.test_client() as c:
+                for header in ('token ' + token, basic_auth):
+                    response = c.get('/me', headers={'Authorization': header})
+                    self.assertEqual(response.data, 'Registered User')
+                self.assertEqual(
+                    len(credentials_cache._cache[DB_NAME]), 2
+                )
+                response = c.get('/me', headers={'Authorization': basic_auth})
+                self.assertEqual(response.data, 'Registered User')
+
+            self.nereid_user_obj.write([nereid_user], {
+                'password': 'new password',
+            })
+            self.assertEqual(len(credentials_cache._cache[DB_NAME]), 0)
+
+            with app.test_client() as c:
+                for header in ('token ' + token, basic_auth):
+                    response = c.get('/me', headers={'Authorization': header})
+                    self.assertEqual(response.status_code, 302)
+
+            app.config['CREDENTIALS_CACHE_TIMEOUT'] = 0
+            with app.test_client() as c:
+                response = c.get('/me', headers={
+                    'Authorization': 'Basic ' + base64.b64encode(
+                        b'email@example.com:new password'
+                    )
+                })
+                self.assertEqual(response.data, 'Registered User')
+                self.assertEqual(len(credentials_cache._cache[DB_NAME]), 0)
+
+    def test_220_login_throttle(self):
+        """
+        The logins are rejected after too many failures, and the emails
+        without user are not searched again
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app(
+                CACHE_TYPE='werkzeug.contrib.cache.SimpleCache',
+                LOGIN_THROTTLE_EMAIL_LIMIT=2,
+            )
+            throttle = app.login_throttle
+
+            party, = self.party_obj.create([{'name': 'Registered user'}])
+            self.nereid_user_obj.create([{
+                'party': party,
+                'display_name': 'Registered User',
+                'email': 'email@example.com',
+                'password': 'password',
+                'company': self.company,
+            }])
+
+            with app.test_client() as c:
+                for password in ('wrong', 'wrong', 'password'):
+                    response = c.post('/login', data={
+                        'email': 'email@example.com', 'password': password,
+                    })
+                    self.assertEqual(response.status_code, 200)
+                self.assertEqual(throttle.stats['rejected'], 1)
+
+                # The rejected logins are not counted as failures
+                self.assertEqual(throttle.stats['failures'], 2)
+
+                # The failures of the Basic authentication are counted too
+                response = c.get('/me', headers={
+                    'Authorization': 'Basic ' + base64.b64encode(
+                        b'other@example.com:wrong'
+                    )
+                })
+                self.assertEqual(response.status_code, 302)
+                self.assertEqual(throttle.stats['failures'], 3)
+
+            with app.test_request_context('/'):
+                for i in range(2):
+                    self.assertEqual(self.nereid_user_obj.authenticate(
+                        'new@example.com', 'password'
+                    ), None)
+                self.assertEqual(throttle.stats['unknown'], 1)
+                self.assertTrue(request.login_rejected)
+
+                self.nereid_user_obj.create([{
+                    'party': party,
+                    'display_name': 'New User',
+                    'email': 'new@example.com',
+                    'password': 'password',
+                    'company': self.company,
+                    'active': True,
+                }])
+
+            with app.test_client() as c:
+                response = c.post('/login', data={
+                    'email': 'new@example.com', 'password': 'password',
+                })
+                self.assertEqual(response.status_code, 302)
+
     def test_0400_auth_xhr_wrong(self):
         """
         Ensure that auth in XHR sends the right results
@@ -154,6 +154,28 @@ class TestCurrency(NereidTestCase):
                     self.currency_obj.convert(Decimal('100')), Decimal('200')
                 )
 
+    def test_0030_get_currencies(self):
+        """
+        The currencies of the website are read once per request and the
+        callers can change the list they get
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            website, = self.nereid_website_obj.search([])
+
+            with app.test_request_context('/en_US/'):
+                currencies = website.get_currencies()
+                self.assertEqual(
+                    sorted(c['id'] for c in currencies),
+                    sorted(c.id for c in self.website_currencies)
+                )
+                currencies.pop()
+                self.assertEqual(
+                    len(website.get_currencies()),
+                    len(self.website_currencies)
+                )
+
 
 def suite():
     "Currency test suite"
@@ -297,6 +297,49 @@ class TestRouting(NereidTestCase):
                 self.assertEqual(response.status_code, 200)
                 self.assertEqual(response.data, 'Success')
 
+    def test_0080_url_map_registry(self):
+        """
+        Test that the URL maps are built on initialisation and only built
+        again when the locales or the URL rules change
+        """
+        with Transaction().start(DB_NAME, USER, CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+            self.assertEqual(app.url_map_stats['builds'], 1)
+
+            # A rule added to the application builds a new map
+            app.add_url_rule('/flask-rule', 'flask_rule')
+
+            with app.test_client() as c:
+                response = c.get('/en_US/')
+                self.assertEqual(response.data, 'en_US')
+                self.assertEqual(app.url_map_stats['builds'], 2)
+
+                # Resetting the tryton cache does not build the map again
+                self.nereid_website.clear_url_adapter_cache()
+                response = c.get('/es_ES/')
+                self.assertEqual(response.data, 'es_ES')
+                self.assertEqual(app.url_map_stats['builds'], 2)
+
+                # The rules keep their attributes in the locale submount
+                adapter = self.nereid_website.get_url_adapter(app)
+                rule, = [
+                    r for r in adapter.iter_rules()
+                    if r.endpoint == 'nereid.user.verify_email'
+                ]
+                self.assertIs(rule.readonly, False)
+
+                # Changing the locales builds a new map
+                self.nereid_website.default_locale = self.locale_es_es
+                self.nereid_website.locales = [self.locale_es_es]
+                self.nereid_website.save()
+                response = c.get('/')
+                self.assertEqual(
+                    response.location, 'http://localhost/es_ES'
+                )
+                self.assertEqual(app.url_map_stats['builds'], 3)
+                self.assertEqual(len(app.url_maps), 1)
+
 
 def suite():
     "Nereid test suite"
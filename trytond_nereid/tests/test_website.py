@@ -6,6 +6,7 @@ import json
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import POOL, USER, DB_NAME, CONTEXT
 from trytond.transaction import Transaction
+from werkzeug.exceptions import NotFound
 from nereid.testing import NereidTestCase
 
 
@@ -74,6 +75,104 @@ class TestWebsite(NereidTestCase):
                 self.assertEqual(data['status']['logged_id'], False)
                 self.assertEqual(data['status']['messages'], [])
 
+    def test_0020_website_context(self):
+        """
+        Test the user, context and language the view is dispatched with
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            app = self.get_app()
+
+            with app.test_request_context('/'):
+                from nereid.globals import request
+
+                user, context, language = app.get_website_context(request)
+                self.assertEqual(user, USER)
+                self.assertEqual(context, {'company': self.company.id})
+                self.assertEqual(language, 'en_US')
+
+    def test_0030_get_from_host(self):
+        """
+        Test the lookup of websites by host from the index
+        """
+        Website = self.NereidWebsite
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            localhost, = Website.search([])
+
+            # With a single website, it is returned for any host
+            self.assertEqual(Website.get_from_host('localhost'), localhost)
+            self.assertEqual(Website.get_from_host('example.com'), localhost)
+
+            other, = Website.create([{
+                'name': 'example.com',
+                'company': self.company,
+                'application_user': USER,
+                'default_locale': localhost.default_locale,
+            }])
+            self.assertEqual(Website.get_from_host('localhost'), localhost)
+            self.assertEqual(Website.get_from_host('example.com'), other)
+
+            stats = Website.host_index_stats.copy()
+            self.assertIsNone(
+                Website.get_from_host('unknown.com', silent=True)
+            )
+            self.assertRaises(
+                NotFound, Website.get_from_host, 'unknown.com'
+            )
+            self.assertEqual(
+                Website.host_index_stats['unknown'], stats['unknown'] + 2
+            )
+            self.assertEqual(
+                Website.host_index_stats['hits'], stats['hits'] + 2
+            )
+            self.assertEqual(
+                Website.host_index_stats['misses'], stats['misses']
+            )
+
+            # Renaming the website clears the index
+            Website.write([other], {'name': 'example.org'})
+            self.assertIsNone(
+                Website.get_from_host('example.com', silent=True)
+            )
+            self.assertEqual(Website.get_from_host('example.org'), other)
+            self.assertEqual(
+                Website.host_index_stats['misses'], stats['misses'] + 1
+            )
+
+    def test_0040_dispatch_profile(self):
+        """
+        Test the profile of the website which the dispatcher uses
+        """
+        Website = self.NereidWebsite
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            website, = Website.search([])
+
+            profile = website.get_dispatch_profile()
+            self.assertEqual(profile.user, USER)
+            self.assertEqual(profile.company, self.company.id)
+            self.assertEqual(profile.context, ())
+            self.assertEqual(profile.get_language('en_US'), 'en_US')
+            self.assertEqual(profile.get_language(None), 'en_US')
+
+            # The profile is kept till the website or its locales change
+            self.assertIs(website.get_dispatch_profile(), profile)
+
+            es_es, = self.Language.search([('code', '=', 'es_ES')])
+            self.NereidWebsiteLocale.write(
+                [website.default_locale], {'language': es_es}
+            )
+            profile = website.get_dispatch_profile()
+            self.assertEqual(profile.get_language('en_US'), 'es_ES')
+            self.assertEqual(profile.get_language('fr_FR'), 'es_ES')
+
+            # Writing a language clears the profiles
+            self.Language.write([es_es], {'translatable': True})
+            self.assertIsNot(website.get_dispatch_profile(), profile)
+
 
 def suite():
     "Nereid test suite"
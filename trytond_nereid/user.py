@@ -1,33 +1,32 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
-import random
-import string
+import time
 import urllib
 import base64
-
-try:
-    import hashlib
-except ImportError:
-    hashlib = None
-    import sha
+import hashlib
 
 import pytz
 from flask_wtf import Form, RecaptchaField
 from wtforms import TextField, SelectField, validators, PasswordField
+from flask.ctx import has_app_context
 from flask.ext.login import logout_user, AnonymousUserMixin, login_url
 from werkzeug import redirect, abort
 
 from nereid import request, url_for, render_template, login_required, flash, \
-    jsonify, route
+    jsonify, route, request_memoize
 from nereid.ctx import has_request_context
 from nereid.globals import current_app
 from nereid.signals import registration
 from nereid.templating import render_email
+from nereid.passwords import make_password, check_password
+from nereid.cachetags import CacheTagsMixin
 from trytond.model import ModelView, ModelSQL, fields
 from trytond.pool import Pool
 from trytond.pyson import Eval, Bool, Not
 from trytond.transaction import Transaction
 from trytond.config import config
+from trytond.cache import Cache
+from trytond.tools import reduce_ids, grouped_slice
 from trytond import backend
 from itsdangerous import URLSafeSerializer, TimestampSigner, SignatureExpired, \
     BadSignature, TimedJSONWebSignatureSerializer
@@ -101,6 +100,23 @@ class ResetAccountForm(Form):
     )
 
 
+def _check_permissions(permissions, perm_all=None, perm_any=None):
+    """
+    Returns True if the permissions include all those of perm_all and any
+    of perm_any
+    """
+    if not isinstance(perm_all, (set, frozenset)):
+        perm_all = frozenset(perm_all if perm_all else [])
+    if not isinstance(perm_any, (set, frozenset)):
+        perm_any = frozenset(perm_any if perm_any else [])
+
+    if perm_all and not perm_all.issubset(permissions):
+        return False
+    if perm_any and not perm_any.intersection(permissions):
+        return False
+    return True
+
+
 class NereidUser(ModelSQL, ModelView):
     """
     Nereid Users
@@ -118,12 +134,12 @@ class NereidUser(ModelSQL, ModelView):
     #: The email of the user is also the login name/username of the user
     email = fields.Char("e-Mail", select=1)
 
-    #: The password is the user password + the salt, which is
-    #: then hashed together
-    password = fields.Sha('Password')
+    #: The hash of the password, made by the hasher of the
+    #: `PASSWORD_HASHER` of the application. See :mod:`nereid.passwords`.
+    password = fields.Char('Password')
 
-    #: The salt which was used to make the hash is separately
-    #: stored. Needed for
+    #: The salt of the sha1 of the password of the previous versions, which
+    #: is cleared when the password is hashed again
     salt = fields.Char('Salt', size=8)
 
     # The company of the website(s) to which the user is affiliated. This
@@ -193,13 +209,126 @@ class NereidUser(ModelSQL, ModelView):
             'permissions': list(self.get_permissions()),
         }
 
+    #: A per worker cache of the permissions of the users, which is cleared
+    #: when a permission or the permissions of a user change.
+    _permissions_cache = Cache('nereid.user.permissions', context=False)
+
+    #: The tags of the permissions in the shared cache. See
+    #: :mod:`nereid.cachetags`.
+    permission_cache_tags = (
+        'nereid.permission', 'nereid.permission-nereid.user',
+    )
+
+    #: Counters of the lookups of :meth:`get_permissions_many`. A local hit
+    #: is served by the worker cache, a shared hit by the cache of the
+    #: application and a miss is read from the database.
+    permissions_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    @request_memoize()
     def get_permissions(self):
         """
         Returns all the permissions as a list of names
         """
-        # TODO: Cache this value for each user to avoid hitting the database
-        # everytime.
-        return frozenset([p.value for p in self.permissions])
+        return self.get_permissions_many([self])[self.id]
+
+    @classmethod
+    def get_permissions_many(cls, nereid_users):
+        """
+        Returns a dictionary of the ids of the users and the frozenset of
+        the values of their permissions.
+
+        The permissions are looked up in the worker cache, then in the cache
+        of the application and the permissions of the remaining users are
+        read from the database in a single query.
+        """
+        rv = {}
+        missing = []
+        for user_id in set(user.id for user in nereid_users):
+            permissions = cls._permissions_cache.get(user_id)
+            if permissions is None:
+                missing.append(user_id)
+            else:
+                rv[user_id] = permissions
+        cls.permissions_stats['local_hits'] += len(rv)
+        if not missing:
+            return rv
+
+        shared = has_request_context() and \
+            getattr(current_app, 'cache_tags', None) is not None
+        if shared:
+            cache_tags = current_app.cache_tags
+            versions = cache_tags.get_versions(cls.permission_cache_tags)
+            keys = dict(
+                (user_id, cls._get_permissions_key(user_id))
+                for user_id in missing
+            )
+            entries = current_app.cache.get_many(
+                *[keys[user_id] for user_id in missing]
+            )
+            for user_id, entry in zip(list(missing), entries):
+                if entry is not None and entry[0] == versions:
+                    rv[user_id] = entry[1]
+                    cls._permissions_cache.set(user_id, entry[1])
+                    missing.remove(user_id)
+                    cls.permissions_stats['shared_hits'] += 1
+        if not missing:
+            return rv
+
+        cls.permissions_stats['misses'] += len(missing)
+        permissions = cls._read_permissions(missing)
+        for user_id, values in permissions.iteritems():
+            rv[user_id] = values
+            cls._permissions_cache.set(user_id, values)
+        if shared:
+            current_app.cache.set_many(dict(
+                (keys[user_id], (versions, values))
+                for user_id, values in permissions.iteritems()
+            ))
+        return rv
+
+    @classmethod
+    def _read_permissions(cls, ids):
+        """
+        Returns a dictionary of the ids of the users and the frozenset of
+        the values of their permissions, read from the database
+        """
+        pool = Pool()
+        UserPermission = pool.get('nereid.permission-nereid.user')
+        Permission = pool.get('nereid.permission')
+        relation = UserPermission.__table__()
+        permission = Permission.__table__()
+        cursor = Transaction().cursor
+
+        rv = dict((user_id, set()) for user_id in ids)
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*relation.join(
+                permission, condition=relation.permission == permission.id
+            ).select(
+                relation.nereid_user, permission.value,
+                where=reduce_ids(relation.nereid_user, list(sub_ids))
+            ))
+            for user_id, value in cursor.fetchall():
+                rv[user_id].add(value)
+        return dict(
+            (user_id, frozenset(values)) for user_id, values in rv.iteritems()
+        )
+
+    @classmethod
+    def _get_permissions_key(cls, user_id):
+        # The timestamp of the last clear of the worker cache seen by this
+        # worker changes when the permissions are changed by a process
+        # which does not share the cache of the application
+        return '%spermissions-%s-%s-%s' % (
+            current_app.cache_key_prefix, Transaction().cursor.dbname,
+            cls._permissions_cache._timestamp, user_id
+        )
+
+    @classmethod
+    def clear_permissions_cache(cls):
+        """
+        Clears the cache of the permissions of the users
+        """
+        cls._permissions_cache.clear()
 
     def has_permissions(self, perm_all=None, perm_any=None):
         """Check if the user has all required permissions in perm_all and
@@ -213,17 +342,24 @@ class NereidUser(ModelSQL, ModelView):
         if not perm_all and not perm_any:
             # Access allowed if no permission is required
             return True
-        if not isinstance(perm_all, (set, frozenset)):
-            perm_all = frozenset(perm_all if perm_all else [])
-        if not isinstance(perm_any, (set, frozenset)):
-            perm_any = frozenset(perm_any if perm_any else [])
-        current_user_permissions = self.get_permissions()
+        return _check_permissions(
+            self.get_permissions(), perm_all, perm_any
+        )
 
-        if perm_all and not perm_all.issubset(current_user_permissions):
-            return False
-        if perm_any and not perm_any.intersection(current_user_permissions):
-            return False
-        return True
+    @classmethod
+    def has_permissions_many(cls, nereid_users, perm_all=None,
+                             perm_any=None):
+        """
+        Returns the list of the results of :meth:`has_permissions` for the
+        users, whose permissions are looked up at once
+        """
+        if not perm_all and not perm_any:
+            return [True] * len(nereid_users)
+        permissions = cls.get_permissions_many(nereid_users)
+        return [
+            _check_permissions(permissions[user.id], perm_all, perm_any)
+            for user in nereid_users
+        ]
 
     @staticmethod
     def default_timezone():
@@ -629,17 +765,28 @@ class NereidUser(ModelSQL, ModelView):
         """
         Checks if 'password' is the same as the current users password.
 
+        The password is verified by the password pool of the application
+        and hashed again if it was not hashed by the `PASSWORD_HASHER` of
+        the application, unless the transaction is readonly.
+
         :param password: The password of the user (string or unicode)
         :return: True or False
         """
-        password += self.salt or ''
-        if isinstance(password, unicode):
-            password = password.encode('utf-8')
-        if hashlib:
-            digest = hashlib.sha1(password).hexdigest()
-        else:
-            digest = sha.new(password).hexdigest()
-        return (digest == self.password)
+        encoded = self.password
+        if encoded and '$' not in encoded:
+            # The salted sha1 of the previous versions
+            encoded = 'sha1$%s$%s' % (self.salt or '', encoded)
+        pool = current_app.password_pool if has_request_context() else None
+        valid, needs_rehash = check_password(password, encoded, pool)
+        if valid and needs_rehash and self._can_rehash_password():
+            self.write([self], {'password': password})
+        return valid
+
+    @staticmethod
+    def _can_rehash_password():
+        # The views of the readonly rules run in readonly transactions
+        rule = request.url_rule if has_request_context() else None
+        return rule is None or not rule.is_readonly
 
     @classmethod
     def authenticate(cls, email, password):
@@ -659,14 +806,28 @@ class NereidUser(ModelSQL, ModelView):
         """
         if not (email and password):
             return None
+        company_id = request.nereid_website.company.id
+
+        # The logins over the limits and with the emails known to have no
+        # user are rejected before any query
+        throttle = current_app.login_throttle
+        if throttle.is_blocked(request.remote_addr, email):
+            current_app.logger.debug("Too many failed logins %s" % email)
+            request.login_rejected = True
+            return None
+        if throttle.is_unknown(company_id, email):
+            request.login_rejected = True
+            return None
+
         with Transaction().set_context(active_test=False):
             users = cls.search([
                 ('email', '=', email),
-                ('company', '=', request.nereid_website.company.id),
+                ('company', '=', company_id),
             ])
 
         if not users:
             current_app.logger.debug("No user with email %s" % email)
+            throttle.remember_unknown(company_id, email)
             return None
 
         if len(users) > 1:
@@ -679,25 +840,38 @@ class NereidUser(ModelSQL, ModelView):
 
         return None
 
+    #: A per worker cache of the ids of the users known to exist, which is
+    #: cleared when users are deleted.
+    _exists_cache = Cache(
+        'nereid.user.exists', size_limit=10000, context=False
+    )
+
     @classmethod
     def load_user(cls, user_id):
         """
         Implements the load_user method for Flask-Login
 
+        The user is looked up by its primary key, once per worker, and the
+        fields of the returned record are read only when they are used.
+
         :param user_id: Unicode ID of the user
         """
         try:
-            with Transaction().set_context(active_test=False):
-                user, = cls.search([('id', '=', int(user_id))])
+            user_id = int(user_id)
         except ValueError:
             return None
 
-        # Instead of returning the active record returned in the above search
-        # we are creating a new record here. This is because the returned
-        # active record seems to carry around the context setting of
-        # active_test and any nested lookup from the record will result in
-        # records being fetched which are inactive.
-        return cls(int(user_id))
+        if not cls._exists_cache.get(user_id):
+            # Inactive users are loaded too, like with active_test=False
+            table = cls.__table__()
+            cursor = Transaction().cursor
+            cursor.execute(*table.select(
+                table.id, where=table.id == user_id
+            ))
+            if cursor.fetchone() is None:
+                return None
+            cls._exists_cache.set(user_id, True)
+        return cls(user_id)
 
     @classmethod
     def load_user_from_header(cls, header_val):
@@ -714,9 +888,22 @@ class NereidUser(ModelSQL, ModelView):
             except TypeError:
                 pass
             else:
-                user = cls.authenticate(*header_val.split(':', 1))
+                email, _, password = header_val.partition(':')
+                key = cls._get_credentials_key(
+                    'basic', request.nereid_website.id, email, password
+                )
+                user = cls._get_verified_user(key)
+                if user is not None:
+                    return user
+
+                user = cls.authenticate(email, password)
                 if user and user.is_active():
+                    cls._set_verified_user(key, user)
                     return user
+                if user is None and not request.login_rejected:
+                    current_app.login_throttle.record_failure(
+                        request.remote_addr, email
+                    )
 
         # TODO: Digest authentication
 
@@ -734,13 +921,15 @@ class NereidUser(ModelSQL, ModelView):
 
         :param token: The token sent in the user's request
         """
-        serializer = TimedJSONWebSignatureSerializer(
-            current_app.secret_key,
-            expires_in=current_app.token_validity_duration
-        )
+        key = cls._get_credentials_key('token', token)
+        user = cls._get_verified_user(key)
+        if user is not None:
+            return user
 
         try:
-            data = serializer.loads(token)
+            data, header = cls.get_token_serializer().loads(
+                token, return_header=True
+            )
         except SignatureExpired:
             return None     # valid token, but expired
         except BadSignature:
@@ -754,8 +943,72 @@ class NereidUser(ModelSQL, ModelView):
 
         if user.is_active():
             # Login only if the login_user method returns True for the user
+            cls._set_verified_user(key, user, header.get('exp'))
             return user
 
+    #: A per worker cache of the verified tokens and Basic credentials, which
+    #: is cleared when the fields of :attr:`_credentials_fields` of a user
+    #: change. The entries expire after `CREDENTIALS_CACHE_TIMEOUT` seconds.
+    _credentials_cache = Cache(
+        'nereid.user.credentials', size_limit=10000, context=False
+    )
+    _credentials_fields = ('email', 'password', 'active', 'company')
+
+    #: The token serializers by secret key and validity duration
+    _token_serializers = {}
+
+    @classmethod
+    def get_token_serializer(cls):
+        """
+        Returns the serializer of the authentication tokens of the current
+        application, which is made once
+        """
+        key = (current_app.secret_key, current_app.token_validity_duration)
+        serializer = cls._token_serializers.get(key)
+        if serializer is None:
+            serializer = cls._token_serializers[key] = \
+                TimedJSONWebSignatureSerializer(
+                    current_app.secret_key,
+                    expires_in=current_app.token_validity_duration
+                )
+        return serializer
+
+    @staticmethod
+    def _get_credentials_key(*args):
+        # The credentials are not kept in clear in the memory of the worker
+        return hashlib.sha256('\0'.join(
+            arg.encode('utf-8') if isinstance(arg, unicode) else str(arg)
+            for arg in args
+        )).digest()
+
+    @classmethod
+    def _get_verified_user(cls, key):
+        """
+        Returns the user of the verified credentials of the key or None
+        """
+        entry = cls._credentials_cache.get(key)
+        if entry is not None and entry[1] > time.time():
+            return cls(entry[0])
+
+    @classmethod
+    def _set_verified_user(cls, key, user, expires=None):
+        """
+        Remember the user of the verified credentials of the key, until the
+        credentials expire if expires is given
+        """
+        timeout = current_app.credentials_cache_timeout
+        if not timeout:
+            return
+        expires = min(time.time() + timeout, expires or float('inf'))
+        cls._credentials_cache.set(key, (user.id, expires))
+
+    @classmethod
+    def clear_credentials_cache(cls):
+        """
+        Clears the cache of the verified credentials of the users
+        """
+        cls._credentials_cache.clear()
+
     def get_auth_token(self):
         """
         Return an authentication token for the user. The auth token uniquely
@@ -765,10 +1018,7 @@ class NereidUser(ModelSQL, ModelView):
         The token_validity_duration can be set in application configuration
         using TOKEN_VALIDITY_DURATION
         """
-        serializer = TimedJSONWebSignatureSerializer(
-            current_app.secret_key,
-            expires_in=current_app.token_validity_duration
-        )
+        serializer = self.get_token_serializer()
         local_txn = None
         if Transaction().cursor is None:
             # Flask-Login can call get_auth_token outside the context
@@ -821,35 +1071,64 @@ class NereidUser(ModelSQL, ModelView):
     def _convert_values(values):
         """
         A helper method which looks if the password is specified in the values.
-        If it is, then the salt is also made and added
+        If it is, then it is hashed
 
         :param values: A dictionary of field: value pairs
         """
         if 'password' in values and values['password']:
-            values['salt'] = ''.join(random.sample(
-                string.ascii_letters + string.digits, 8))
-            values['password'] += values['salt']
+            values['password'] = make_password(values['password'])
+            values['salt'] = None
 
         return values
 
     @classmethod
     def create(cls, vlist):
         """
-        Create, but add salt before saving
+        Create, but hash the passwords before saving
 
         :param vlist: List of dictionary of Values
         """
         vlist = [cls._convert_values(vals.copy()) for vals in vlist]
-        return super(NereidUser, cls).create(vlist)
+        users = super(NereidUser, cls).create(vlist)
+        cls._forget_unknown_emails(users)
+        return users
 
     @classmethod
     def write(cls, nereid_users, values, *args):
         """
-        Update salt before saving
+        Hash the passwords before saving
         """
-        return super(NereidUser, cls).write(
-            nereid_users, cls._convert_values(values), *args
+        args = list(args)
+        for i in range(1, len(args), 2):
+            args[i] = cls._convert_values(args[i].copy())
+        rv = super(NereidUser, cls).write(
+            nereid_users, cls._convert_values(values.copy()), *args
         )
+        if any(
+                field in vals for vals in [values] + args[1::2]
+                for field in cls._credentials_fields):
+            cls.clear_credentials_cache()
+        actions = iter((nereid_users, values) + tuple(args))
+        cls._forget_unknown_emails(sum([
+            users for users, vals in zip(actions, actions)
+            if 'email' in vals or 'company' in vals
+        ], []))
+        return rv
+
+    @staticmethod
+    def _forget_unknown_emails(users):
+        # The emails may have been remembered as unknown by the throttle
+        # of the logins
+        if has_app_context() and users:
+            current_app.login_throttle.forget_unknown([
+                (user.company.id, user.email) for user in users
+            ])
+
+    @classmethod
+    def delete(cls, nereid_users):
+        super(NereidUser, cls).delete(nereid_users)
+        cls._exists_cache.clear()
+        cls.clear_credentials_cache()
 
     @staticmethod
     def get_gravatar_url(email, **kwargs):
@@ -969,7 +1248,7 @@ class NereidAnonymousUser(AnonymousUserMixin, ModelView):
         return User.get_gravatar_url("does not matter", **kwargs)
 
 
-class Permission(ModelSQL, ModelView):
+class Permission(CacheTagsMixin, ModelSQL, ModelView):
     "Nereid Permissions"
     __name__ = 'nereid.permission'
 
@@ -988,8 +1267,24 @@ class Permission(ModelSQL, ModelView):
                 'Permissions must be unique by value'),
         ]
 
+    @classmethod
+    def create(cls, vlist):
+        rv = super(Permission, cls).create(vlist)
+        Pool().get('nereid.user').clear_permissions_cache()
+        return rv
 
-class UserPermission(ModelSQL):
+    @classmethod
+    def write(cls, *args):
+        super(Permission, cls).write(*args)
+        Pool().get('nereid.user').clear_permissions_cache()
+
+    @classmethod
+    def delete(cls, permissions):
+        super(Permission, cls).delete(permissions)
+        Pool().get('nereid.user').clear_permissions_cache()
+
+
+class UserPermission(CacheTagsMixin, ModelSQL):
     "Nereid User Permissions"
     __name__ = 'nereid.permission-nereid.user'
 
@@ -1001,3 +1296,19 @@ class UserPermission(ModelSQL):
         'nereid.user', 'User',
         ondelete='CASCADE', select=True, required=True
     )
+
+    @classmethod
+    def create(cls, vlist):
+        rv = super(UserPermission, cls).create(vlist)
+        Pool().get('nereid.user').clear_permissions_cache()
+        return rv
+
+    @classmethod
+    def write(cls, *args):
+        super(UserPermission, cls).write(*args)
+        Pool().get('nereid.user').clear_permissions_cache()
+
+    @classmethod
+    def delete(cls, user_permissions):
+        super(UserPermission, cls).delete(user_permissions)
+        Pool().get('nereid.user').clear_permissions_cache()
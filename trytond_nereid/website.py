@@ -1,30 +1,51 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import warnings
+from collections import namedtuple
 
 import pytz
 from werkzeug import abort, redirect
-from werkzeug.routing import Map, Submount
+from werkzeug.routing import Submount
 from flask_wtf import Form
 from wtforms import TextField, PasswordField, validators, BooleanField
 from flask.ext.login import login_user, logout_user
 
 from nereid import jsonify, flash, render_template, url_for, cache, \
-    current_user, route
+    current_user, route, request_memoize
 from nereid.globals import request
 from nereid.exceptions import WebsiteNotFound
 from nereid.helpers import login_required, key_from_list, get_flashed_messages
+from nereid.routing import Map
 from nereid.signals import failed_login
 from trytond.model import ModelView, ModelSQL, fields
 from trytond.transaction import Transaction
-from trytond.pool import Pool
+from trytond.pool import Pool, PoolMeta
 from trytond.cache import Cache
 from trytond import backend
 
 from .i18n import _
 
 __all__ = ['WebSite', 'WebSiteLocale', 'WebsiteCountry',
-           'WebsiteCurrency', 'WebsiteWebsiteLocale']
+           'WebsiteCurrency', 'WebsiteWebsiteLocale', 'Lang']
+
+
+class DispatchProfile(namedtuple(
+        'DispatchProfile',
+        ['user', 'context', 'company', 'languages', 'default_language'])):
+    """
+    What the dispatcher needs from a website to run a view: the id of the
+    application user, the items of the context, the id of the company, the
+    language codes by locale code and the language code of the default
+    locale.
+    """
+    __slots__ = ()
+
+    def get_language(self, locale_code):
+        """
+        Returns the language code for the locale code or the language of the
+        default locale if the website has no such locale
+        """
+        return self.languages.get(locale_code, self.default_language)
 
 
 class LoginForm(Form):
@@ -276,6 +297,7 @@ class WebSite(ModelSQL, ModelView):
     def account(cls):
         return render_template('account.jinja', **cls.account_context())
 
+    @request_memoize(lifetime='request', copy=True)
     def get_currencies(self):
         """Returns available currencies for current site
 
@@ -329,30 +351,138 @@ class WebSite(ModelSQL, ModelView):
         """
         return jsonify(status=cls._user_status())
 
+    #: A per worker index of the hosts of the websites, which is cleared
+    #: when a website is created, written or deleted.
+    _host_index_cache = Cache(
+        'nereid.website.host_index', size_limit=1, context=False
+    )
+
+    #: Counters of the lookups of :meth:`get_from_host`. A hit is a host
+    #: resolved from the index, a miss is a lookup which had to build the
+    #: index and an unknown is a host for which there is no website.
+    host_index_stats = {'hits': 0, 'misses': 0, 'unknown': 0}
+
+    @classmethod
+    def get_host_index(cls):
+        """
+        Returns a tuple of the id of the website if there is only one website
+        (None otherwise) and a dictionary of the website names and ids.
+        """
+        index = cls._host_index_cache.get('index')
+        if index is not None:
+            cls.host_index_stats['hits'] += 1
+            return index
+
+        cls.host_index_stats['misses'] += 1
+        with Transaction().set_user(0):
+            websites = cls.search([])
+        index = (
+            websites[0].id if len(websites) == 1 else None,
+            dict((website.name, website.id) for website in websites),
+        )
+        cls._host_index_cache.set('index', index)
+        return index
+
     @classmethod
     def get_from_host(cls, host, silent=False):
         """
         Returns the website with name as given host
 
         If not silent a website not found error is raised.
+
+        The lookup is made on an index of all the websites which is built
+        once per worker, so unknown hosts do not hit the database either.
         """
-        if cls.search([], count=True) == 1:
-            return cls.search([])[0]
+        single_website, websites = cls.get_host_index()
+        if single_website is not None:
+            return cls(single_website)
         try:
-            website, = cls.search([('name', '=', host)])
-        except ValueError:
+            return cls(websites[host])
+        except KeyError:
+            cls.host_index_stats['unknown'] += 1
             if not silent:
                 raise WebsiteNotFound()
-        else:
-            return website
+
+    @classmethod
+    def clear_host_index_cache(cls):
+        """
+        Clears the index of hosts used by :meth:`get_from_host`
+        """
+        cls._host_index_cache.clear()
+
+    @classmethod
+    def create(cls, vlist):
+        rv = super(WebSite, cls).create(vlist)
+        cls.clear_host_index_cache()
+        return rv
+
+    @classmethod
+    def write(cls, *args):
+        super(WebSite, cls).write(*args)
+        cls.clear_host_index_cache()
+        cls.clear_url_adapter_cache()
+        cls.clear_dispatch_profile_cache()
+
+    @classmethod
+    def delete(cls, websites):
+        super(WebSite, cls).delete(websites)
+        cls.clear_host_index_cache()
+        cls.clear_url_adapter_cache()
+        cls.clear_dispatch_profile_cache()
 
     def get_context(self):
         """
         Returns transaction context to be used by nereid dispatcher for this
         website
+
+        The context is kept in the :class:`DispatchProfile` of the website,
+        so it should depend only on the website and its locales. Downstream
+        modules which add a context depending on other records should clear
+        the profiles (:meth:`clear_dispatch_profile_cache`) when they change.
         """
         return {}
 
+    #: A per worker cache of the :class:`DispatchProfile` of the websites,
+    #: which is cleared when a website, a locale or a language is written or
+    #: deleted.
+    _dispatch_profile_cache = Cache(
+        'nereid.website.dispatch_profile', context=False
+    )
+
+    def get_dispatch_profile(self):
+        """
+        Returns the :class:`DispatchProfile` of the website. The profile is
+        built once per worker, so in the steady state the dispatcher sets up
+        the transaction of a view without reading the website.
+        """
+        profile = self._dispatch_profile_cache.get(self.id)
+        if profile is None:
+            profile = self.build_dispatch_profile()
+            self._dispatch_profile_cache.set(self.id, profile)
+        return profile
+
+    def build_dispatch_profile(self):
+        """
+        Builds a new :class:`DispatchProfile` for the website
+        """
+        return DispatchProfile(
+            user=self.application_user.id,
+            context=tuple(sorted(self.get_context().items())),
+            company=self.company.id,
+            languages=dict(
+                (locale.code, locale.language.code) for locale in self.locales
+            ),
+            default_language=self.default_locale.language.code,
+        )
+
+    @classmethod
+    def clear_dispatch_profile_cache(cls):
+        """
+        Clears the cache of the profiles returned by
+        :meth:`get_dispatch_profile`
+        """
+        cls._dispatch_profile_cache.clear()
+
     _url_adapter_cache = Cache('nereid.website.url_adapter', context=False)
 
     @classmethod
@@ -364,14 +494,39 @@ class WebSite(ModelSQL, ModelView):
 
     def get_url_adapter(self, app):
         """
-        Returns the URL adapter for the website
+        Returns the URL map for the website
+
+        The map is kept in the worker local registry of the application (see
+        :meth:`nereid.Nereid.get_url_map`) and is built only when the locales
+        of the website or the URL rules change. Only the key of the map is
+        kept in the tryton cache, so when the cache is reset, the map is
+        looked up again but not built again unless the key changes.
         """
-        cache_rv = self._url_adapter_cache.get(self.id)
+        key = self._url_adapter_cache.get(self.id)
+        if key is None:
+            key = self.get_url_map_key()
+            self._url_adapter_cache.set(self.id, key)
+        return app.get_url_map(key, self.build_url_map)
 
-        if cache_rv is not None:
-            return cache_rv
+    def get_url_map_key(self):
+        """
+        Returns a tuple which identifies the URL map of the website. Downstream
+        modules which change the URL map based on other fields of the website
+        should add them to the key.
+        """
+        if not self.locales:
+            return (self.id, None, ())
+        return (
+            self.id,
+            self.default_locale.code,
+            tuple(sorted(locale.code for locale in self.locales)),
+        )
 
-        url_rules = app.get_urls()[:]
+    def build_url_map(self, app):
+        """
+        Builds a new URL map for the website
+        """
+        url_rules = [rule.empty() for rule in app.get_url_rules()]
 
         # Add the static url
         url_rules.append(
@@ -399,8 +554,6 @@ class WebSite(ModelSQL, ModelView):
         for rule in app.url_map._rules:
             url_map.add(rule.empty())
 
-        self._url_adapter_cache.set(self.id, url_map)
-
         return url_map
 
     def get_current_locale(self, req):
@@ -439,6 +592,20 @@ class WebSiteLocale(ModelSQL, ModelView):
                 'Code must be unique'),
         ]
 
+    @classmethod
+    def write(cls, *args):
+        super(WebSiteLocale, cls).write(*args)
+        Website = Pool().get('nereid.website')
+        Website.clear_url_adapter_cache()
+        Website.clear_dispatch_profile_cache()
+
+    @classmethod
+    def delete(cls, locales):
+        super(WebSiteLocale, cls).delete(locales)
+        Website = Pool().get('nereid.website')
+        Website.clear_url_adapter_cache()
+        Website.clear_dispatch_profile_cache()
+
 
 class WebsiteCountry(ModelSQL):
     "Website Country Relations"
@@ -472,3 +639,18 @@ class WebsiteWebsiteLocale(ModelSQL):
     locale = fields.Many2One(
         'nereid.website.locale', 'Locale',
         ondelete='CASCADE', select=1, required=True)
+
+
+class Lang:
+    __metaclass__ = PoolMeta
+    __name__ = 'ir.lang'
+
+    @classmethod
+    def write(cls, *args):
+        super(Lang, cls).write(*args)
+        Pool().get('nereid.website').clear_dispatch_profile_cache()
+
+    @classmethod
+    def delete(cls, langs):
+        super(Lang, cls).delete(langs)
+        Pool().get('nereid.website').clear_dispatch_profile_cache()